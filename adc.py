@@ -0,0 +1,689 @@
+"""ADC acquisition: device map, PCF8591 scan over I2C (or the simulated boards) and frame processing.
+
+Shared by app.py and remote_sampler.py. Importing it only loads device_map.json and calibration.json
+and opens the I2C buses; it needs no database, web framework or background threads.
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import metrics, log_rate_limited, METRICS_I2C_BUCKETS, METRICS_LATENCY_BUCKETS
+
+# Try to import smbus for I2C communication (needed on Raspberry Pi)
+try:
+    import smbus
+    HARDWARE_AVAILABLE = True
+except ImportError:
+    HARDWARE_AVAILABLE = False
+
+# NumPy powers the vectorized frame processing stage (oversampling, calibration, filtering).
+# Without it frames are converted cell by cell and calibration / filtering are unavailable.
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# ADC backend.
+#   'smbus'     - the PCF8591 boards on the Raspberry Pi I2C buses (default)
+#   'simulated' - a deterministic in-process model of the same boards (see SimulatedBus), used to
+#                 load-test storage, streaming and aggregation off-device
+# BATTERY_MONITOR_ADC_BACKEND overrides the setting without editing this file.
+ADC_BACKEND = os.environ.get('BATTERY_MONITOR_ADC_BACKEND', 'smbus')
+
+if ADC_BACKEND == 'simulated':
+    logger.warning("Using the simulated ADC backend. Readings are synthetic.")
+elif not HARDWARE_AVAILABLE:
+    logger.warning("smbus not available. ADC communication will not be possible.")
+else:
+    logger.info("smbus available. Running with hardware.")
+
+# Default divider factor for device map entries that don't set their own 'divider' (adjust as per your circuit).
+VOLTAGE_DIVIDER_COMPENSATION_FACTOR = 1.0
+# Define a threshold below which a cell is considered disconnected or completely depleted,
+# and should be reported as 0.0V. Based on user: "lowest value, which means zero, is 2.51".
+# Set threshold slightly above to catch this range.
+FUNCTIONAL_ZERO_THRESHOLD = 2.6
+
+# Acquisition timing, shared by the local sampler in app.py and remote_sampler.py.
+SAMPLE_INTERVAL_SECONDS = 1.0
+HARDWARE_ERROR_RETRY_SECONDS = 10  # Back-off when the I2C interface itself is unavailable
+
+# Every stored reading is keyed by (pack_id, seq, cell_number); see reading_seq(). The cells read
+# over this node's own I2C bus are LOCAL_PACK_ID, remote sampler nodes use 1..MAX_PACK_ID.
+LOCAL_PACK_ID = 0
+MAX_PACK_ID = 65535  # pack_id is SMALLINT UNSIGNED
+
+STORAGE_DEADBAND_VOLTS = 0.02  # Default per-cell deadband (STORAGE_POLICY = 'deadband' in app.py); override with 'deadband' in device_map.json
+
+# I2C Configuration (for Raspberry Pi)
+PCF8591_ADDRESS = 0x48  # Default address for PCF8591
+PCF8591_CONTROL_ANALOG_ENABLE = 0x40  # Control byte: analog output enable (keeps the oscillator running)
+PCF8591_CONTROL_AUTO_INCREMENT = 0x04  # Control byte: auto-increment the channel after each conversion
+PCF8591_CHANNELS = 4  # Analog inputs AIN0..AIN3 per chip
+DEFAULT_I2C_BUS = 1  # Use bus 1 for newer Raspberry Pi models
+
+# Device map: which bus / ADC / input each cell is wired to, and its divider factor.
+# If device_map.json exists next to this file it replaces the default single-board map, e.g.:
+#   [{"cell": 1, "bus": 1, "address": "0x48", "channel": 0, "divider": 2.0, "deadband": 0.02},
+#    {"cell": 5, "bus": 1, "address": "0x49", "channel": 0, "divider": 2.0}, ...]
+DEVICE_MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_map.json')
+DEFAULT_DEVICE_MAP = [
+    {'cell': ch + 1, 'bus': DEFAULT_I2C_BUS, 'address': PCF8591_ADDRESS, 'channel': ch,
+     'divider': VOLTAGE_DIVIDER_COMPENSATION_FACTOR, 'deadband': STORAGE_DEADBAND_VOLTS}
+    for ch in range(PCF8591_CHANNELS)
+]
+
+# ADC scan configuration.
+# 'auto_increment' reads every channel in one read_i2c_block_data transaction;
+# 'per_channel' is the original select / settle / dummy read / read sequence.
+ADC_SCAN_MODE = 'auto_increment'
+ADC_BLOCK_FAILURES_BEFORE_FALLBACK = 3  # Consecutive block-read failures before switching to per_channel
+ADC_BLOCK_MAX_BYTES = 32  # SMBus block transfer limit
+# Per-board timings (keyed by I2C address). Boards not listed use ADC_DEFAULT_TIMING.
+ADC_DEFAULT_TIMING = {
+    'settle_seconds': 0.02,  # per_channel: wait after selecting a channel
+    'dummy_read_seconds': 0.02,  # per_channel: wait after the dummy read
+    'block_settle_seconds': 0.0,  # auto_increment: wait after writing the control byte, before the block read
+}
+ADC_BOARD_TIMINGS = {
+    PCF8591_ADDRESS: dict(ADC_DEFAULT_TIMING),
+}
+
+# Frame processing. Raw codes of a whole frame are turned into voltages in one vectorized pass:
+# oversample reduction -> divider -> per-cell calibration -> functional-zero clamp -> optional filter.
+ADC_OVERSAMPLE = 1  # Conversions per cell and frame. auto_increment gets up to 7 from one block read.
+ADC_OVERSAMPLE_REDUCER = 'mean'  # 'mean' or 'median' (robust against single-code spikes)
+# Per-cell piecewise-linear calibration: measured volts -> true volts, linear beyond the end points.
+# Optional calibration.json next to this file, e.g. {"1": [[3.0, 3.02], [3.7, 3.71], [4.2, 4.18]]}.
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration.json')
+FILTER_MODE = None  # None, 'ema' or 'kalman'; the state is per cell and resets when a cell drops out
+FILTER_EMA_ALPHA = 0.3  # Weight of the newest sample
+FILTER_KALMAN_PROCESS_NOISE_VOLTS = 0.002  # Expected real change per frame (std deviation)
+FILTER_KALMAN_MEASUREMENT_NOISE_VOLTS = 0.02  # Expected measurement noise (std deviation)
+
+# Simulated ADC backend (ADC_BACKEND = 'simulated').
+# Without device_map.json the simulator generates SIMULATED_CELL_COUNT cells, four per board,
+# eight boards (0x48..0x4F) per bus. Output is fully determined by the seed and the read order.
+SIMULATED_CELL_COUNT = int(os.environ.get('BATTERY_MONITOR_SIM_CELLS', PCF8591_CHANNELS))
+SIMULATED_SEED = 1
+SIMULATED_SECONDS_PER_FRAME = 1.0  # Simulated time that passes per read_all_voltages() call
+SIMULATED_DISCHARGE_SECONDS = 4 * 3600  # Full-to-empty time of an average cell (then it restarts full)
+SIMULATED_CAPACITY_SPREAD = 0.05  # Relative per-cell capacity variation, so cells drift apart
+SIMULATED_NOISE_VOLTS = 0.01  # Std deviation of gaussian noise added before quantization
+SIMULATED_DROPOUT_RATE = 0.0  # Probability that one conversion reads as a disconnected cell (code 0)
+SIMULATED_I2C_ERROR_RATE = 0.0  # Probability that one I2C transaction raises OSError
+SIMULATED_ADC_TIMING = {'settle_seconds': 0.0, 'dummy_read_seconds': 0.0, 'block_settle_seconds': 0.0}
+# Open-circuit voltage of a Li-ion cell by state of charge, interpolated linearly.
+SIMULATED_OCV_CURVE = [(0.0, 3.0), (0.05, 3.3), (0.1, 3.45), (0.2, 3.6), (0.5, 3.75), (0.8, 3.95), (1.0, 4.2)]
+
+metric_i2c_transaction_seconds = metrics.histogram(
+    'i2c_transaction_seconds', 'Duration of one channel read (per_channel mode) or one board block read (channel="block").',
+    METRICS_I2C_BUCKETS, ('bus', 'address', 'channel'))
+metric_i2c_errors = metrics.counter('i2c_errors_total', 'Failed I2C reads.', ('bus', 'address'))
+metric_scan_frame_seconds = metrics.histogram(
+    'scan_frame_seconds', 'Time to read one frame of all cells.', METRICS_LATENCY_BUCKETS)
+
+
+def simulated_device_map(cell_count):
+    """Generate a device map for cell_count cells: four per board, eight boards per bus."""
+    device_map = []
+    for index in range(cell_count):
+        board = index // PCF8591_CHANNELS
+        device_map.append({
+            'cell': index + 1,
+            'bus': DEFAULT_I2C_BUS + board // 8,
+            'address': PCF8591_ADDRESS + board % 8,
+            'channel': index % PCF8591_CHANNELS,
+            'divider': VOLTAGE_DIVIDER_COMPENSATION_FACTOR,
+            'deadband': STORAGE_DEADBAND_VOLTS,
+        })
+    return device_map
+
+def load_device_map(path=DEVICE_MAP_FILE):
+    """Load and validate the cell -> (bus, address, channel, divider) map.
+
+    Falls back to DEFAULT_DEVICE_MAP if the file does not exist. Raises ValueError on an invalid map.
+    """
+    if not os.path.exists(path):
+        if ADC_BACKEND == 'simulated':
+            return simulated_device_map(SIMULATED_CELL_COUNT)
+        return [dict(entry) for entry in DEFAULT_DEVICE_MAP]
+
+    with open(path) as f:
+        raw_entries = json.load(f)
+
+    device_map = []
+    seen_inputs = set()
+    for raw in raw_entries:
+        address = raw.get('address', PCF8591_ADDRESS)
+        entry = {
+            'cell': int(raw['cell']),
+            'bus': int(raw.get('bus', DEFAULT_I2C_BUS)),
+            'address': int(address, 0) if isinstance(address, str) else int(address),
+            'channel': int(raw['channel']),
+            'divider': float(raw.get('divider', VOLTAGE_DIVIDER_COMPENSATION_FACTOR)),
+            'deadband': float(raw.get('deadband', STORAGE_DEADBAND_VOLTS)),
+        }
+        if not 0 <= entry['channel'] < PCF8591_CHANNELS:
+            raise ValueError(f"Device map: cell {entry['cell']} has invalid channel {entry['channel']}. Expected 0 to {PCF8591_CHANNELS - 1}.")
+        adc_input = (entry['bus'], entry['address'], entry['channel'])
+        if adc_input in seen_inputs:
+            raise ValueError(f"Device map: cell {entry['cell']} reuses bus {entry['bus']} address {entry['address']:#04x} AIN{entry['channel']}.")
+        seen_inputs.add(adc_input)
+        device_map.append(entry)
+
+    device_map.sort(key=lambda e: e['cell'])
+    cells = [e['cell'] for e in device_map]
+    if cells != list(range(1, len(cells) + 1)):
+        raise ValueError(f"Device map: cells must be numbered 1..N without gaps or duplicates, got {cells}.")
+    return device_map
+
+def build_scan_plan(device_map):
+    """Group cells by bus, then by board.
+
+    Each bus gets its boards in address order and each board its inputs in channel order,
+    so a scan walks every chip once and never jumps back to an earlier channel.
+    """
+    buses = {}
+    for entry in device_map:
+        buses.setdefault(entry['bus'], {}).setdefault(entry['address'], []).append(entry)
+    return {
+        bus: [(address, sorted(entries, key=lambda e: e['channel'])) for address, entries in sorted(boards.items())]
+        for bus, boards in sorted(buses.items())
+    }
+
+DEVICE_MAP = load_device_map()
+PYTHON_NUMBER_OF_CELLS = len(DEVICE_MAP)
+DEVICE_MAP_BY_CELL = {entry['cell']: entry for entry in DEVICE_MAP}
+SCAN_PLAN = build_scan_plan(DEVICE_MAP)
+
+
+
+class SmbusBackend:
+    """ADC backend for the real PCF8591 boards, one smbus.SMBus handle per bus in the scan plan."""
+
+    name = 'smbus'
+
+    def __init__(self, bus_numbers):
+        self._buses = {bus: smbus.SMBus(bus) for bus in bus_numbers} if HARDWARE_AVAILABLE else {}
+
+    def check_available(self):
+        """Raise IOError if ADC readings are impossible (smbus missing)."""
+        if not HARDWARE_AVAILABLE:
+            raise IOError("smbus (I2C interface) is not available. ADC readings are impossible.")
+
+    def begin_frame(self):
+        pass
+
+    def bus(self, number):
+        return self._buses[number]
+
+    def timing(self, address):
+        return ADC_BOARD_TIMINGS.get(address, ADC_DEFAULT_TIMING)
+
+
+class SimulatedPack:
+    """Deterministic model of the cells behind the simulated boards.
+
+    Each cell discharges along SIMULATED_OCV_CURVE with its own capacity and starting charge,
+    drawn from the seed. Time advances by SIMULATED_SECONDS_PER_FRAME per frame.
+    """
+
+    def __init__(self, device_map, seed=SIMULATED_SEED):
+        rng = random.Random(seed)
+        self.frame = 0
+        self._cells = {}  # (bus, address, channel) -> (divider, discharge_seconds, initial_discharged)
+        for entry in device_map:
+            capacity = 1.0 + rng.uniform(-SIMULATED_CAPACITY_SPREAD, SIMULATED_CAPACITY_SPREAD)
+            self._cells[(entry['bus'], entry['address'], entry['channel'])] = (
+                entry['divider'], SIMULATED_DISCHARGE_SECONDS * capacity, rng.uniform(0.0, 0.1)
+            )
+        self._soc_points = [soc for soc, _ in SIMULATED_OCV_CURVE]
+
+    def open_circuit_voltage(self, soc):
+        index = min(max(bisect.bisect_right(self._soc_points, soc), 1), len(SIMULATED_OCV_CURVE) - 1)
+        (soc0, v0), (soc1, v1) = SIMULATED_OCV_CURVE[index - 1], SIMULATED_OCV_CURVE[index]
+        return v0 + (v1 - v0) * (soc - soc0) / (soc1 - soc0)
+
+    def code(self, bus, address, channel, rng):
+        """8-bit conversion result of one input in the current frame (0 for unwired inputs and dropouts)."""
+        cell = self._cells.get((bus, address, channel))
+        if cell is None or rng.random() < SIMULATED_DROPOUT_RATE:
+            return 0
+        divider, discharge_seconds, initial_discharged = cell
+        soc = 1.0 - (initial_discharged + self.frame * SIMULATED_SECONDS_PER_FRAME / discharge_seconds) % 1.0
+        voltage = self.open_circuit_voltage(soc) + rng.gauss(0.0, SIMULATED_NOISE_VOLTS)
+        return max(0, min(255, int(round(voltage / divider / 5.0 * 255))))
+
+
+class SimulatedBus:
+    """Stand-in for smbus.SMBus that answers PCF8591 transactions from a SimulatedPack.
+
+    Like the real chip, each read returns the previous conversion and starts the next one,
+    so the dummy-read and auto-increment handling in the scan code is exercised unchanged.
+    Every transaction fails with SIMULATED_I2C_ERROR_RATE probability.
+    """
+
+    def __init__(self, number, pack, seed=SIMULATED_SEED):
+        self.number = number
+        self.pack = pack
+        self._rng = random.Random(seed * 1000003 + number)  # One stream per bus: deterministic per scan thread
+        self._selected = {}  # address -> selected channel
+        self._pending = {}  # address -> conversion returned by the next read
+
+    def _transaction(self, address):
+        if self._rng.random() < SIMULATED_I2C_ERROR_RATE:
+            raise OSError(121, f"Remote I/O error (simulated) on bus {self.number} address {address:#04x}")
+
+    def write_byte(self, address, value):
+        self._transaction(address)
+        self._selected[address] = value & 0x03
+
+    def read_byte(self, address):
+        self._transaction(address)
+        result = self._pending.get(address, 0x80)
+        self._pending[address] = self.pack.code(self.number, address, self._selected.get(address, 0), self._rng)
+        return result
+
+    def read_i2c_block_data(self, address, cmd, length):
+        self._transaction(address)
+        channel = cmd & 0x03
+        data = [self._pending.get(address, 0x80)]
+        for _ in range(length - 1):
+            data.append(self.pack.code(self.number, address, channel, self._rng))
+            if cmd & PCF8591_CONTROL_AUTO_INCREMENT:
+                channel = (channel + 1) % PCF8591_CHANNELS
+        self._selected[address] = channel
+        self._pending[address] = self.pack.code(self.number, address, channel, self._rng)
+        return data
+
+
+class SimulatedBackend:
+    """ADC backend serving the device map from SimulatedBus instances instead of I2C hardware."""
+
+    name = 'simulated'
+
+    def __init__(self, device_map, bus_numbers, seed=SIMULATED_SEED):
+        self.pack = SimulatedPack(device_map, seed)
+        self._buses = {bus: SimulatedBus(bus, self.pack, seed) for bus in bus_numbers}
+
+    def check_available(self):
+        pass
+
+    def begin_frame(self):
+        self.pack.frame += 1
+
+    def bus(self, number):
+        return self._buses[number]
+
+    def timing(self, address):
+        return SIMULATED_ADC_TIMING
+
+
+def create_adc_backend(name=ADC_BACKEND):
+    """Instantiate the configured ADC backend for the current device map."""
+    if name == 'smbus':
+        return SmbusBackend(SCAN_PLAN)
+    if name == 'simulated':
+        return SimulatedBackend(DEVICE_MAP, SCAN_PLAN)
+    raise ValueError(f"Unknown ADC_BACKEND '{name}'. Expected 'smbus' or 'simulated'.")
+
+adc_backend = create_adc_backend()
+
+# Separate buses are scanned concurrently, one worker thread per bus.
+_bus_executor = ThreadPoolExecutor(max_workers=len(SCAN_PLAN), thread_name_prefix='I2CBus') if len(SCAN_PLAN) > 1 else None
+
+def get_adc_timing(address):
+    """Return the settle / dummy-read timings for the board at the given I2C address."""
+    return adc_backend.timing(address)
+
+def ain_channel_for_cell(cell):
+    """Return the 'AINx' label of the ADC input a cell is wired to."""
+    entry = DEVICE_MAP_BY_CELL.get(cell)
+    return f"AIN{entry['channel']}" if entry else f'AIN{cell - 1}'
+
+def convert_raw_to_voltage(cell, raw_value, divider=VOLTAGE_DIVIDER_COMPENSATION_FACTOR):
+    """Convert a raw 8-bit ADC code into a compensated cell voltage (0.0 below functional zero)."""
+    voltage_at_adc_pin = (raw_value / 255.0) * 5.0 # Assuming VREF is 5.0V
+    actual_cell_voltage = voltage_at_adc_pin * divider
+
+    # Check if voltage is below the functional zero threshold
+    if actual_cell_voltage < FUNCTIONAL_ZERO_THRESHOLD:
+        log_rate_limited(('functional_zero', cell), logging.INFO, f"Cell {cell} voltage {actual_cell_voltage:.3f}V is below functional zero threshold {FUNCTIONAL_ZERO_THRESHOLD}V. Reporting as 0.0V.")
+        return 0.0
+
+    # General sanity check for "impossible" readings (e.g., way above VREF after compensation)
+    # This primarily logs a warning if a value is outside a very broad expected hardware range.
+    max_expected_compensated_voltage = (5.0 * divider) + 0.5 # Allow some margin
+    if not (-0.5 <= actual_cell_voltage <= max_expected_compensated_voltage):
+        log_rate_limited(('out_of_range', cell), logging.WARNING, f"Cell {cell} compensated voltage {actual_cell_voltage:.3f}V is outside very broad expected range (-0.5V to {max_expected_compensated_voltage:.1f}V). This might indicate an issue.")
+        # Depending on how strict, could return 0.0 or None here. For now, let it pass if not caught by functional zero.
+
+    return round(actual_cell_voltage, 3)
+
+def read_raw_channel(bus, address, channel, samples=1):
+    """Per-channel scan: select the channel, settle, discard the stale conversion and read `samples` codes."""
+    timing = get_adc_timing(address)
+    i2c = adc_backend.bus(bus)
+    started = time.perf_counter()
+    i2c.write_byte(address, PCF8591_CONTROL_ANALOG_ENABLE + channel) # Select channel
+    time.sleep(timing['settle_seconds']) # Allow ADC to settle
+    i2c.read_byte(address)  # Dummy read to discard previous channel's residue
+    time.sleep(timing['dummy_read_seconds']) # A bit more settling time
+    codes = [i2c.read_byte(address) for _ in range(samples)] # Each read returns a fresh conversion of this channel
+    metric_i2c_transaction_seconds.observe(time.perf_counter() - started, bus, f"{address:#04x}", channel)
+    return codes
+
+def read_raw_block(bus, address, channel_count, samples=1):
+    """Auto-increment scan: read a board in a single I2C block transaction.
+
+    With samples=1, channels 0..channel_count-1 are read once. When oversampling, the chip
+    cycles through all PCF8591_CHANNELS inputs `samples` times within the same transaction.
+    Returns one list of codes per channel. The first byte returned by the PCF8591 is the result
+    of the previous conversion, so it doubles as the dummy read and is discarded.
+    """
+    span = channel_count if samples == 1 else PCF8591_CHANNELS
+    length = span * samples + 1
+    timing = get_adc_timing(address)
+    control = PCF8591_CONTROL_ANALOG_ENABLE | PCF8591_CONTROL_AUTO_INCREMENT
+    i2c = adc_backend.bus(bus)
+    started = time.perf_counter()
+    if timing['block_settle_seconds'] > 0:
+        i2c.write_byte(address, control)
+        time.sleep(timing['block_settle_seconds'])
+    data = i2c.read_i2c_block_data(address, control, length)
+    metric_i2c_transaction_seconds.observe(time.perf_counter() - started, bus, f"{address:#04x}", 'block')
+    if len(data) < length:
+        raise IOError(f"Short block read from PCF8591 at {address:#04x}: got {len(data)} bytes, expected {length}.")
+    return [data[1 + channel:length:span] for channel in range(channel_count)]
+
+def read_cell_codes(entry, samples=ADC_OVERSAMPLE):
+    """Per-channel read of one device map entry. Returns its raw codes, or None on an I2C error."""
+    try:
+        return read_raw_channel(entry['bus'], entry['address'], entry['channel'], samples)
+    except IOError as e:
+        metric_i2c_errors.inc(entry['bus'], f"{entry['address']:#04x}")
+        log_rate_limited(('i2c_error', entry['cell']), logging.ERROR, f"I2C Error reading cell {entry['cell']} (bus {entry['bus']}, PCF8591 {entry['address']:#04x}, AIN{entry['channel']}): {e}. Returning None.")
+        return None 
+    except Exception as e:
+        log_rate_limited(('read_error', entry['cell']), logging.ERROR, f"General error reading cell {entry['cell']}: {e}. Returning None.")
+        return None
+
+def read_cell_voltage(entry):
+    """Per-channel read of one device map entry, calibrated but not filtered. Returns None on an I2C error."""
+    index = DEVICE_MAP.index(entry)
+    return frame_processor.process([read_cell_codes(entry)], rows=[index])[0]
+
+def read_voltage(channel):
+    """Read voltage of one cell (0-based index into the device map) with validation and compensation."""
+    try:
+        adc_backend.check_available()
+    except IOError:
+        logger.error(f"smbus (I2C interface) is not available. Cannot read from ADC for channel {channel}.")
+        raise
+
+    if not 0 <= channel < PYTHON_NUMBER_OF_CELLS:
+        logger.error(f"Invalid channel number: {channel}. Expected 0 to {PYTHON_NUMBER_OF_CELLS - 1}.")
+        return None
+    return read_cell_voltage(DEVICE_MAP[channel])
+
+_block_read_failures = {}  # (bus, address) -> consecutive auto-increment failures
+
+def read_board_block(bus, address, entries):
+    """Read all inputs of one board in one auto-increment transaction.
+
+    Returns one code list per entry, or None if the block read failed, so the caller
+    can fall back to per-channel mode.
+    """
+    board = (bus, address)
+    samples = min(ADC_OVERSAMPLE, (ADC_BLOCK_MAX_BYTES - 1) // PCF8591_CHANNELS)
+    try:
+        raw_codes = read_raw_block(bus, address, entries[-1]['channel'] + 1, samples)
+    except (IOError, OSError) as e:
+        _block_read_failures[board] = _block_read_failures.get(board, 0) + 1
+        metric_i2c_errors.inc(bus, f"{address:#04x}")
+        log_rate_limited(('block_read', bus, address), logging.WARNING, f"Auto-increment block read failed on bus {bus} PCF8591 {address:#04x} ({_block_read_failures[board]} in a row): {e}. Falling back to per-channel scan for this frame.")
+        if _block_read_failures[board] == ADC_BLOCK_FAILURES_BEFORE_FALLBACK:
+            logger.error(f"Auto-increment block reads keep failing on bus {bus} PCF8591 {address:#04x}. Switching that board to per_channel scan mode.")
+        return None
+    _block_read_failures[board] = 0
+    return [raw_codes[e['channel']] for e in entries]
+
+def scan_bus(bus, boards, scan_mode):
+    """Scan every board on one bus in plan order. Returns {cell: raw codes or None}."""
+    codes = {}
+    for address, entries in boards:
+        board_codes = None
+        if scan_mode == 'auto_increment' and _block_read_failures.get((bus, address), 0) < ADC_BLOCK_FAILURES_BEFORE_FALLBACK:
+            board_codes = read_board_block(bus, address, entries)
+        if board_codes is None:
+            # read_cell_codes returns None if there's a specific I2C read error for that cell.
+            board_codes = [read_cell_codes(entry) for entry in entries]
+        for entry, cell_codes in zip(entries, board_codes):
+            codes[entry['cell']] = cell_codes
+    return codes
+
+def load_calibration(path=CALIBRATION_FILE):
+    """Load per-cell calibration tables {cell: [(measured, actual), ...]}.
+
+    Returns {} if the file does not exist. Raises ValueError on an invalid table.
+    """
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        raw_tables = json.load(f)
+
+    calibration = {}
+    for cell_key, raw_points in raw_tables.items():
+        cell = int(cell_key)
+        points = sorted((float(measured), float(actual)) for measured, actual in raw_points)
+        if cell not in DEVICE_MAP_BY_CELL:
+            raise ValueError(f"Calibration: cell {cell} is not in the device map.")
+        if len(points) < 2:
+            raise ValueError(f"Calibration: cell {cell} needs at least 2 points, got {len(points)}.")
+        if any(a[0] == b[0] for a, b in zip(points, points[1:])):
+            raise ValueError(f"Calibration: cell {cell} has duplicate measured values.")
+        calibration[cell] = points
+    return calibration
+
+
+class FrameProcessor:
+    """Turns raw ADC codes of a frame into cell voltages.
+
+    With NumPy the whole frame is processed as arrays: oversample reduction, divider,
+    per-cell piecewise-linear calibration, functional-zero clamp and the optional EMA or
+    Kalman filter. Without NumPy each cell goes through convert_raw_to_voltage() as before,
+    and calibration and filtering are skipped.
+    """
+
+    def __init__(self, device_map, calibration=None, reducer=ADC_OVERSAMPLE_REDUCER, filter_mode=FILTER_MODE):
+        self.cells = [entry['cell'] for entry in device_map]
+        self.dividers = [entry['divider'] for entry in device_map]
+        self.reducer = reducer
+        self.filter_mode = filter_mode
+        self._lock = threading.Lock()
+        calibration = calibration or {}
+        if not NUMPY_AVAILABLE:
+            if calibration or filter_mode:
+                logger.warning("NumPy is not available. Calibration and filtering are disabled.")
+            return
+
+        self._divider = np.array(self.dividers, dtype=float)
+        self._max_expected = self._divider * 5.0 + 0.5
+        self._cal_x, self._cal_y = self._build_calibration(calibration)
+        self._state = np.full(len(self.cells), np.nan)  # Filtered voltage per cell (NaN: no state)
+        self._variance = np.full(len(self.cells), np.nan)  # Kalman estimate variance per cell
+
+    def _build_calibration(self, calibration):
+        """Pad every cell's table to the same width so all cells interpolate in one pass.
+
+        Uncalibrated cells get the identity. Padding points continue the last segment,
+        which also makes values beyond the table extrapolate linearly.
+        """
+        width = max([len(points) for points in calibration.values()], default=2)
+        xs = np.empty((len(self.cells), width))
+        ys = np.empty((len(self.cells), width))
+        for row, cell in enumerate(self.cells):
+            points = calibration.get(cell, [(0.0, 0.0), (1.0, 1.0)])
+            (x0, y0), (x1, y1) = points[-2], points[-1]
+            slope = (y1 - y0) / (x1 - x0)
+            padding = range(1, width - len(points) + 1)
+            xs[row] = [x for x, _ in points] + [x1 + step for step in padding]
+            ys[row] = [y for _, y in points] + [y1 + step * slope for step in padding]
+        return xs, ys
+
+    def _reduce(self, raw):
+        """Stack per-cell code lists into a (cells, samples) array and reduce each row to one code."""
+        width = max((len(codes) for codes in raw if codes), default=1)
+        missing = [math.nan] * width
+        flat = []
+        for codes in raw:
+            if not codes:
+                flat.extend(missing)
+            else:
+                flat.extend(codes)
+                if len(codes) < width:
+                    flat.extend(missing[:width - len(codes)])
+        codes = np.array(flat, dtype=float).reshape(len(raw), width)
+        if width == 1:
+            return codes[:, 0]
+        if self.reducer == 'median':
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN rows (failed reads) stay NaN
+                return np.nanmedian(codes, axis=1)
+        valid = ~np.isnan(codes)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(valid, codes, 0.0).sum(axis=1) / valid.sum(axis=1)
+
+    def _calibrate(self, volts, rows):
+        xs, ys = self._cal_x[rows], self._cal_y[rows]
+        segment = np.clip((xs <= volts[:, None]).sum(axis=1) - 1, 0, xs.shape[1] - 2)
+        index = np.arange(len(volts))
+        x0, x1 = xs[index, segment], xs[index, segment + 1]
+        y0, y1 = ys[index, segment], ys[index, segment + 1]
+        return y0 + (volts - x0) * (y1 - y0) / (x1 - x0)
+
+    def _filter(self, volts, live):
+        """Advance the per-cell filter state with this frame's live cells and return the filtered frame."""
+        state = self._state
+        if self.filter_mode == 'ema':
+            updated = np.where(np.isnan(state), volts, state + FILTER_EMA_ALPHA * (volts - state))
+            self._state = np.where(live, updated, state)
+        elif self.filter_mode == 'kalman':
+            measurement_variance = FILTER_KALMAN_MEASUREMENT_NOISE_VOLTS ** 2
+            fresh = np.isnan(state)
+            predicted = np.where(fresh, measurement_variance, self._variance + FILTER_KALMAN_PROCESS_NOISE_VOLTS ** 2)
+            gain = np.where(fresh, 1.0, predicted / (predicted + measurement_variance))
+            updated = np.where(fresh, volts, state + gain * (volts - state))
+            self._state = np.where(live, updated, state)
+            # A state seeded from one measurement is only as certain as that measurement.
+            posterior = np.where(fresh, measurement_variance, (1.0 - gain) * predicted)
+            self._variance = np.where(live, posterior, self._variance)
+        else:
+            return volts
+        return np.where(live, self._state, volts)
+
+    def process(self, raw, rows=None):
+        """Convert raw codes (one list or None per cell) to rounded voltages (None where the read failed).
+
+        raw covers the whole device map in order, or only the device map indexes given in rows;
+        partial frames are calibrated and clamped but do not touch the filter state.
+        """
+        if not NUMPY_AVAILABLE:
+            return self._process_scalar(raw, rows)
+
+        rows = np.arange(len(self.cells)) if rows is None else np.asarray(rows)
+        volts = self._reduce(raw) / 255.0 * 5.0 * self._divider[rows]  # Assuming VREF is 5.0V
+        volts = self._calibrate(volts, rows)
+
+        with np.errstate(invalid='ignore'):
+            below_zero = volts < FUNCTIONAL_ZERO_THRESHOLD
+            out_of_range = (volts < -0.5) | (volts > self._max_expected[rows])
+        for index in np.flatnonzero(below_zero):
+            cell = self.cells[rows[index]]
+            log_rate_limited(('functional_zero', cell), logging.INFO, f"Cell {cell} voltage {volts[index]:.3f}V is below functional zero threshold {FUNCTIONAL_ZERO_THRESHOLD}V. Reporting as 0.0V.")
+        for index in np.flatnonzero(out_of_range & ~below_zero):
+            cell = self.cells[rows[index]]
+            log_rate_limited(('out_of_range', cell), logging.WARNING, f"Cell {cell} compensated voltage {volts[index]:.3f}V is outside very broad expected range (-0.5V to {self._max_expected[rows[index]]:.1f}V). This might indicate an issue.")
+
+        if self.filter_mode and len(rows) == len(self.cells):
+            with self._lock:
+                # Disconnected cells (functional zero) and failed reads restart their filter from scratch.
+                live = ~np.isnan(volts) & ~below_zero
+                self._state[~live] = np.nan
+                volts = self._filter(volts, live)
+        volts = np.where(below_zero, 0.0, np.round(volts, 3))
+        if not np.isnan(volts).any():
+            return volts.tolist()
+        return [None if value != value else value for value in volts.tolist()]
+
+    def _process_scalar(self, raw, rows):
+        rows = range(len(self.cells)) if rows is None else rows
+        voltages = []
+        for row, codes in zip(rows, raw):
+            if not codes:
+                voltages.append(None)
+                continue
+            code = statistics.median(codes) if self.reducer == 'median' else sum(codes) / len(codes)
+            voltages.append(convert_raw_to_voltage(self.cells[row], code, self.dividers[row]))
+        return voltages
+
+
+frame_processor = FrameProcessor(DEVICE_MAP, load_calibration())
+
+def read_all_voltages(scan_mode=None):
+    """Read voltages from all configured battery cells.
+
+    Buses in the device map are scanned concurrently; boards on the same bus are scanned in order.
+    scan_mode overrides ADC_SCAN_MODE ('auto_increment' or 'per_channel'). The raw codes of the
+    frame are then converted by frame_processor in one pass.
+    """
+    try:
+        adc_backend.check_available()
+    except IOError:
+        logger.error("smbus (I2C interface) is not available. Cannot scan ADC channels.")
+        raise
+
+    adc_backend.begin_frame()
+    started = time.perf_counter()
+    scan_mode = scan_mode or ADC_SCAN_MODE
+    if _bus_executor is None:
+        codes = {}
+        for bus, boards in SCAN_PLAN.items():
+            codes.update(scan_bus(bus, boards, scan_mode))
+    else:
+        futures = [_bus_executor.submit(scan_bus, bus, boards, scan_mode) for bus, boards in SCAN_PLAN.items()]
+        codes = {}
+        for future in futures:
+            codes.update(future.result())
+    voltages = frame_processor.process([codes.get(entry['cell']) for entry in DEVICE_MAP])
+    metric_scan_frame_seconds.observe(time.perf_counter() - started)
+
+    readings = []
+    for entry, voltage in zip(DEVICE_MAP, voltages):
+        readings.append({
+            'cell': entry['cell'], 
+            'ain_channel': f"AIN{entry['channel']}",
+            'voltage': voltage
+        })
+    return readings
+
+def reading_seq(timestamp):
+    """Idempotency key of a sample: its timestamp in integer microseconds.
+
+    Together with pack_id and cell_number it identifies a row in voltage_readings, so replaying
+    the same rows (e.g. from the spool after a crash) never creates duplicates.
+    """
+    return int(round(timestamp.timestamp() * 1000000))
@@ -1,210 +1,2791 @@
 
-from flask import Flask, render_template, jsonify, send_file, request, Response
+from flask import Flask, render_template, jsonify, request, Response
 from flask_cors import CORS
 import mariadb
 import time
+import base64
 import csv
-from datetime import datetime
+import struct
+import math
+import io
+import zlib
+from datetime import datetime, timedelta
 import os
 import logging
 import json # Added for SSE
+import threading
+import queue
+import atexit
+from array import array
+import heapq
+from collections import deque
+import sqlite3
+import hmac
+import shutil
+import zipfile
+import re
 
-# Try to import smbus for I2C communication (needed on Raspberry Pi)
+from instrumentation import metrics, log_rate_limited, METRICS_LATENCY_BUCKETS, METRICS_ENCODE_BUCKETS
+# ADC acquisition (device map, I2C / simulated scan, frame processing) lives in adc.py, so
+# remote_sampler.py can use it without the web app, the database driver or any background jobs.
+from adc import (
+    DEVICE_MAP, PYTHON_NUMBER_OF_CELLS, SAMPLE_INTERVAL_SECONDS, HARDWARE_ERROR_RETRY_SECONDS,
+    LOCAL_PACK_ID, MAX_PACK_ID, STORAGE_DEADBAND_VOLTS, ain_channel_for_cell, read_all_voltages, reading_seq,
+)
+
+# NumPy powers the columnar archive (and, in adc.py, the vectorized frame processing stage).
 try:
-    import smbus
-    HARDWARE_AVAILABLE = True
+    import numpy as np
+    NUMPY_AVAILABLE = True
 except ImportError:
-    HARDWARE_AVAILABLE = False
+    NUMPY_AVAILABLE = False
+
+app = Flask(__name__)
+CORS(app, expose_headers=['X-Next-Before', 'X-Next-After', 'X-Archive-Rows', 'X-Archive-Missing-Days'])  # Enable CORS for all routes (and custom headers)
+
+# --- Logging Setup ---
+log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'battery_monitor.log')
+logging.basicConfig(
+    filename=log_file_path,
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s:%(name)s:%(threadName)s:%(message)s'
+)
+
+# --- Configuration ---
+# Acquisition configuration. A single background sampler owns the I2C bus and
+# publishes every frame to all API consumers (SSE streams, /api/voltage, /api/connect).
+# SAMPLE_INTERVAL_SECONDS and HARDWARE_ERROR_RETRY_SECONDS are set in adc.py.
+SAMPLE_ERROR_RETRY_SECONDS = 5  # Back-off after any other unexpected sampling error
+SNAPSHOT_WAIT_TIMEOUT_SECONDS = 5  # How long request handlers wait for the very first frame
+SSE_KEEPALIVE_SECONDS = 15  # Send an SSE comment if no frame arrived within this time
+
+# Live stream encodings, negotiated per client with ?encoding=...
+#   json     - full readings dict per frame (default, what the dashboard uses)
+#   columnar - one timestamp plus all voltages as base64 little-endian float16 (NaN = no reading)
+#   delta    - only cells that moved more than STREAM_DELTA_EPSILON, with periodic full keyframes
+STREAM_ENCODINGS = ('json', 'columnar', 'delta')
+STREAM_DELTA_EPSILON = 0.005  # Volts
+STREAM_KEYFRAME_INTERVAL = 30  # Frames between full keyframes in delta mode
+
+# In-memory history: a fixed-size ring buffer per cell holding the most recent samples.
+# Memory is fixed at startup: cells x capacity x 12 bytes (float64 timestamp + float32 voltage),
+# e.g. 48 cells x 24 h at 1 Hz is about 50 MB.
+HISTORY_RING_SECONDS = 24 * 3600
+HISTORY_RING_CAPACITY = int(HISTORY_RING_SECONDS / SAMPLE_INTERVAL_SECONDS)  # Samples kept per cell
+HISTORY_RING_MAX_BYTES = 256 * 1024 * 1024  # Large (e.g. simulated) device maps get a shorter window instead
+HISTORY_DEFAULT_LIMIT = 100
+HISTORY_MAX_LIMIT = 5000
+# Cell-filtered history pages run one idx_cell_timestamp range scan per cell (UNION ALL);
+# above this many cells a single idx_timestamp scan with an IN filter is cheaper.
+HISTORY_UNION_MAX_CELLS = 32
+
+# Downsampled history: the response holds at most DOWNSAMPLE_MAX_POINTS buckets per cell.
+DOWNSAMPLE_DEFAULT_POINTS = 500
+DOWNSAMPLE_MAX_POINTS = 5000
+DOWNSAMPLE_DEFAULT_RANGE_SECONDS = 24 * 3600  # Used when 'start' is omitted
+
+# Rollups: minute / hour / day summaries per cell, each built from the next finer level.
+# (table, bucket seconds, DATE_FORMAT pattern for the bucket start, source table)
+ROLLUP_LEVELS = [
+    ('voltage_rollup_1m', 60, '%Y-%m-%d %H:%i:00', 'voltage_readings'),
+    ('voltage_rollup_1h', 3600, '%Y-%m-%d %H:00:00', 'voltage_rollup_1m'),
+    ('voltage_rollup_1d', 86400, '%Y-%m-%d 00:00:00', 'voltage_rollup_1h'),
+]
+ROLLUP_INTERVAL_SECONDS = 60  # How often the rollup / retention job runs
+ROLLUP_LATENESS_SECONDS = 120  # Raw minutes are only rolled up once they are this old (covers the write-behind buffer)
+ROLLUP_CHUNK_BUCKETS = 360  # Buckets per INSERT ... SELECT while catching up, keeps transactions small
+# Retention in days per table (None keeps rows forever). Rows are only deleted once rolled up
+# (and, for voltage_readings, archived when the columnar archive is enabled).
+RETENTION_DAYS = {
+    'voltage_readings': 30,
+    'voltage_rollup_1m': 365,
+}
+RETENTION_DELETE_BATCH_ROWS = 5000
+RETENTION_MAX_BATCHES_PER_RUN = 50
+RETENTION_BATCH_PAUSE_SECONDS = 0.2  # Give the sampler's inserts room between delete batches
+
+# CSV export: rows are streamed from an unbuffered cursor in batches of this size.
+CSV_EXPORT_BATCH_ROWS = 2000
+CSV_EXPORT_GZIP_LEVEL = 6
+
+# Columnar archive (requires numpy). ArchiveWorker compacts every finished day of voltage_readings into
+# one partition per pack: ARCHIVE_DIR/pack_<id>/<YYYY-MM-DD>/ with timestamp_us.npy (int64, Unix us),
+# cell.npy (uint16) and voltage.npy (float32, NaN for NULL), sorted by cell then time, plus index.json
+# with each cell's row range. Partitions are plain .npy so readers can memory-map them (zero copy);
+# exports (/api/archive/export, archive_export.py) are one compressed .npz for any date range.
+# Raw rows are only removed by retention once their day is archived.
+ARCHIVE_ENABLED = True
+ARCHIVE_DIR = os.environ.get('BATTERY_MONITOR_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+ARCHIVE_INTERVAL_SECONDS = 3600  # How often the archive job looks for finished days
+ARCHIVE_LATENESS_SECONDS = 24 * 3600  # A day is archived once it ended this long ago (spool replays, late remote batches)
+ARCHIVE_MAX_PARTITIONS_PER_RUN = 50  # Bounds one catch-up run; the rest follows on the next run
+ARCHIVE_FETCH_BATCH_ROWS = 10000  # Rows per fetchmany while reading a day from MariaDB
+ARCHIVE_EXPORT_MAX_DAYS = 366
+ARCHIVE_EXPORT_CHUNK_ROWS = 1000000  # Rows per write while streaming an export
+
+# Database configuration
+db_config = {
+    'host': 'localhost',
+    'user': 'app_user',
+    'password': 'Ah12345678',
+    'database': 'i2c_db'
+}
+
+# Connection pool configuration
+DB_POOL_NAME = 'battery_monitor_pool'
+DB_POOL_SIZE = 5  # Sampler + a handful of concurrent API requests
+DB_POOL_CHECKOUT_TIMEOUT_SECONDS = 5  # Max time a caller waits for a free pooled connection
+DB_POOL_WAIT_INTERVAL_SECONDS = 0.05  # Poll interval while the pool is exhausted
+DB_POOL_RETRY_BACKOFF_SECONDS = 5  # Don't hammer an unreachable server with new pool attempts
+
+# Write-behind configuration. Readings are buffered in memory and inserted in multi-row batches.
+DB_WRITE_BATCH_SIZE = 200  # Flush as soon as this many rows are buffered...
+DB_WRITE_FLUSH_INTERVAL_MS = 1000  # ...or when the oldest buffered row is this old, whichever comes first
+DB_WRITE_QUEUE_MAX_ROWS = 20000  # Upper bound on buffered rows (backpressure)
+DB_WRITE_ENQUEUE_TIMEOUT_SECONDS = 0.05  # How long the sampler may block on a full buffer before dropping
+DB_WRITE_SHUTDOWN_TIMEOUT_SECONDS = 10  # Max time spent draining the buffer on shutdown
+
+# Local durable spool. When enabled, the write-behind buffer flushes into a SQLite file on local disk
+# instead of MariaDB, and a separate drainer replays the spool into MariaDB once the server is reachable.
+# Acquisition therefore never waits on (or loses data to) a slow or unavailable database.
+SPOOL_ENABLED = True
+SPOOL_PATH = os.environ.get('BATTERY_MONITOR_SPOOL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'voltage_spool.sqlite3'))
+SPOOL_MAX_ROWS = 2000000  # Disk bound: oldest spooled rows are dropped (and counted) beyond this
+SPOOL_DRAIN_BATCH_ROWS = 1000  # Rows replayed into MariaDB per transaction
+SPOOL_DRAIN_IDLE_SECONDS = 0.5  # Poll interval while the spool is empty
+SPOOL_RETRY_MIN_SECONDS = 1  # Backoff after a failed replay, doubled up to...
+SPOOL_RETRY_MAX_SECONDS = 60  # ...this ceiling
+
+# Multi-pack ingestion. Every row in voltage_readings belongs to a pack; the cells read over this node's
+# own I2C bus are LOCAL_PACK_ID (see adc.py). Remote sampler nodes (remote_sampler.py) POST batches of frames to
+# /api/ingest, which de-duplicates them by (pack_id, seq) and stores them with the batched insert.
+# The per-cell summary behind /api/dashboard covers every pack (?pack=); the live stream, ring buffer and
+# alerts cover the local pack only.
+INGEST_TOKEN = os.environ.get('BATTERY_MONITOR_INGEST_TOKEN')  # If set, /api/ingest requires 'Authorization: Bearer <token>'
+INGEST_MAX_BODY_BYTES = 8 * 1024 * 1024  # Request body as sent (usually gzip)
+INGEST_MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024  # Guard against decompression bombs
+INGEST_MAX_FRAMES = 10000  # Frames per request
+INGEST_MAX_CELLS_PER_FRAME = 127  # voltage_readings.cell_number is TINYINT unless widened for a large device map
+INGEST_INSERT_BATCH_ROWS = 1000  # Rows per insert transaction; a failed request is simply resent by the sampler
+
+# Storage policy.
+#   'all'      - store every sample (default)
+#   'deadband' - store a sample only if it moved more than the cell's deadband since the last stored
+#                value, or STORAGE_HEARTBEAT_SECONDS passed. Stored rows then form a step-wise series:
+#                each value holds until the next stored row (see /api/history?fill=step).
+# The per-cell deadband defaults to STORAGE_DEADBAND_VOLTS (adc.py) unless device_map.json sets one.
+STORAGE_POLICY = 'all'
+STORAGE_HEARTBEAT_SECONDS = 60  # Store at least one row per cell this often, even if nothing moved
+# Averages (rollups, /api/history/downsampled, /api/dashboard) are time-weighted: a stored value counts for
+# the time until the next row of its cell, so step-wise 'deadband' rows average like the samples they
+# replace. A longer gap than this is missing data (an outage), not a held value; such a row, like a row
+# with no successor yet, counts for one SAMPLE_INTERVAL_SECONDS (see hold_seconds()).
+AVERAGE_MAX_HOLD_SECONDS = 2 * STORAGE_HEARTBEAT_SECONDS
+
+# Alerting. Rules are evaluated by the sampler on every frame from in-memory state only; state changes
+# (an alert becoming active or clearing) are stored in voltage_alerts and pushed to stream subscribers.
+# If alert_rules.json exists next to this file it replaces DEFAULT_ALERT_RULES. Rule types:
+#   threshold - per cell: 'above' or 'below' a limit, clears at 'clear' (hysteresis)
+#   rate      - per cell: |dV/dt| over 'window_seconds' exceeds 'max_volts_per_second'
+#   spread    - pack: max - min cell voltage exceeds 'max_spread', clears at 'clear'
+#   stale     - per cell: no valid reading for 'timeout_seconds'
+# Per-cell rules accept an optional 'cells' list. Cells at functional zero (0.0V, disconnected) are
+# ignored by threshold, rate and spread rules unless the rule sets "include_zero": true.
+ALERT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alert_rules.json')
+DEFAULT_ALERT_RULES = [
+    {'name': 'cell_over_voltage', 'type': 'threshold', 'above': 4.25, 'clear': 4.2, 'severity': 'critical'},
+    {'name': 'cell_under_voltage', 'type': 'threshold', 'below': 3.2, 'clear': 3.3, 'severity': 'critical'},
+    {'name': 'cell_fast_change', 'type': 'rate', 'max_volts_per_second': 0.05, 'window_seconds': 10, 'severity': 'warning'},
+    {'name': 'pack_imbalance', 'type': 'spread', 'max_spread': 0.1, 'clear': 0.08, 'severity': 'warning'},
+    {'name': 'cell_stale', 'type': 'stale', 'timeout_seconds': 10, 'severity': 'warning'},
+]
+ALERT_SEVERITIES = ('info', 'warning', 'critical')
+ALERT_RATE_CLEAR_RATIO = 0.8  # Rate alerts clear once the rate drops below this fraction of the limit
+ALERT_RATE_WINDOW_POINTS = 20  # Samples kept per rate window (one per window_seconds / this), whatever the sample rate
+ALERT_RECENT_EVENTS = 500  # Alert events kept in memory (served when the database is unavailable)
+ALERT_WRITE_QUEUE_MAX = 10000  # Alert events waiting to be stored
+ALERT_HISTORY_DEFAULT_LIMIT = 100
+ALERT_HISTORY_MAX_LIMIT = 1000
+
+metric_db_insert_seconds = metrics.histogram(
+    'db_insert_seconds', 'Time to execute one batch insert, including the summary upsert.', METRICS_LATENCY_BUCKETS)
+metric_db_commit_seconds = metrics.histogram(
+    'db_commit_seconds', 'Time to commit one batch insert.', METRICS_LATENCY_BUCKETS)
+metric_db_rows_written = metrics.counter('db_rows_written_total', 'Rows committed to voltage_readings.')
+metric_db_batch_errors = metrics.counter('db_batch_errors_total', 'Batch inserts that failed and were rolled back.')
+metric_stream_encode_seconds = metrics.histogram(
+    'stream_encode_seconds', 'Time to encode one live stream frame (once per snapshot and encoding).',
+    METRICS_ENCODE_BUCKETS, ('encoding',))
+metric_alert_evaluate_seconds = metrics.histogram(
+    'alert_evaluate_seconds', 'Time to evaluate every alert rule against one frame.', METRICS_ENCODE_BUCKETS)
+metric_ingest_requests = metrics.counter('ingest_requests_total', 'Bulk ingest requests by outcome.', ('status',))
+metric_ingest_frames = metrics.counter('ingest_frames_total', 'Frames accepted by /api/ingest.')
+metric_archive_rows = metrics.counter('archive_rows_total', 'Rows written into columnar archive partitions.')
+
+class DBConnectionPool:
+    """Thin wrapper around mariadb.ConnectionPool.
+
+    Adds a blocking checkout with timeout, a ping health check on every checkout,
+    reconnect-on-failure and counters that can be used to size the pool.
+    Connections are returned to the pool by calling conn.close() as before.
+    """
+
+    def __init__(self, config, pool_name=DB_POOL_NAME, pool_size=DB_POOL_SIZE):
+        self.config = config
+        self.pool_name = pool_name
+        self.pool_size = pool_size
+        self._pool = None
+        self._lock = threading.Lock()
+        self._last_failure = 0.0
+        self._stats = {
+            'checkouts': 0,   # Successful checkouts
+            'waits': 0,       # Checkouts that found the pool exhausted and had to wait
+            'timeouts': 0,    # Checkouts that gave up after DB_POOL_CHECKOUT_TIMEOUT_SECONDS
+            'errors': 0,      # Pool creation, health check or reconnect failures
+            'reconnects': 0,  # Stale connections that were successfully re-established
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _get_pool(self):
+        """Return the underlying pool, creating it on demand. Returns None while the server is unreachable."""
+        with self._lock:
+            if self._pool is not None:
+                return self._pool
+            if time.monotonic() - self._last_failure < DB_POOL_RETRY_BACKOFF_SECONDS:
+                return None
+            try:
+                self._pool = mariadb.ConnectionPool(
+                    pool_name=self.pool_name,
+                    pool_size=self.pool_size,
+                    **self.config
+                )
+                app.logger.info(f"Database connection pool '{self.pool_name}' created with {self.pool_size} connections.")
+            except mariadb.Error as e:
+                self._stats['errors'] += 1
+                self._last_failure = time.monotonic()
+                app.logger.error(f"Database connection pool creation error: {e}")
+                return None
+            return self._pool
+
+    def _discard_pool(self):
+        """Drop the pool so the next checkout rebuilds it (e.g. after the server restarted)."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._last_failure = time.monotonic()
+        if pool is not None:
+            try:
+                pool.close()
+            except mariadb.Error as e:
+                app.logger.error(f"Error closing database connection pool: {e}")
+
+    def get_connection(self, timeout=DB_POOL_CHECKOUT_TIMEOUT_SECONDS):
+        """Check out a healthy connection, or return None if none could be obtained in time."""
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            pool = self._get_pool()
+            if pool is None:
+                return None
+
+            try:
+                conn = pool.get_connection()
+            except mariadb.PoolError:
+                conn = None # Pool exhausted
+            except mariadb.Error as e:
+                self._count('errors')
+                app.logger.error(f"Database pool checkout error: {e}")
+                return None
+
+            if conn is None:
+                if not waited:
+                    waited = True
+                    self._count('waits')
+                if time.monotonic() >= deadline:
+                    self._count('timeouts')
+                    app.logger.error(f"Timed out after {timeout}s waiting for a pooled database connection.")
+                    return None
+                time.sleep(DB_POOL_WAIT_INTERVAL_SECONDS)
+                continue
+
+            # Health check: a pooled connection may have been dropped by the server.
+            try:
+                conn.ping()
+            except mariadb.Error as e_ping:
+                self._count('errors')
+                app.logger.warning(f"Pooled database connection failed health check ({e_ping}). Reconnecting.")
+                try:
+                    conn.reconnect()
+                    self._count('reconnects')
+                except mariadb.Error as e_reconnect:
+                    self._count('errors')
+                    app.logger.error(f"Database reconnect failed: {e_reconnect}. Resetting connection pool.")
+                    self._discard_pool()
+                    return None
+
+            self._count('checkouts')
+            return conn
+
+    def stats(self):
+        """Return a copy of the pool counters plus the configured size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pool_size'] = self.pool_size
+            stats['pool_active'] = self._pool is not None
+        return stats
+
+
+db_pool = DBConnectionPool(db_config)
+
+def get_db_connection():
+    """Check out a pooled database connection. Call conn.close() to return it to the pool."""
+    return db_pool.get_connection()
+
+def close_db_resources(cursor, conn, context):
+    """Close a cursor and release its connection (back to the pool), logging rather than raising errors."""
+    if cursor:
+        try:
+            cursor.close()
+        except mariadb.Error as e_cur:
+            app.logger.error(f"Error closing cursor in {context}: {e_cur}")
+    if conn:
+        try:
+            conn.close()
+        except mariadb.Error as e_conn:
+            app.logger.error(f"Error closing connection in {context}: {e_conn}")
+
+SUMMARY_UPSERT_QUERY = """
+    INSERT INTO voltage_cell_summary
+        (pack_id, cell_number, reading_count, nonzero_count, nonzero_sum, min_voltage, max_voltage, last_timestamp,
+         held_sum, held_seconds, last_voltage)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        reading_count = reading_count + VALUES(reading_count),
+        nonzero_count = nonzero_count + VALUES(nonzero_count),
+        nonzero_sum = nonzero_sum + VALUES(nonzero_sum),
+        min_voltage = LEAST(COALESCE(min_voltage, VALUES(min_voltage)), COALESCE(VALUES(min_voltage), min_voltage)),
+        max_voltage = GREATEST(COALESCE(max_voltage, VALUES(max_voltage)), COALESCE(VALUES(max_voltage), max_voltage)),
+        held_sum = held_sum + VALUES(held_sum),
+        held_seconds = held_seconds + VALUES(held_seconds),
+        last_voltage = IF(last_timestamp IS NULL OR VALUES(last_timestamp) >= last_timestamp, VALUES(last_voltage), last_voltage),
+        last_timestamp = GREATEST(COALESCE(last_timestamp, VALUES(last_timestamp)), VALUES(last_timestamp))
+"""
+
+# Takes rows deleted by retention out of the running aggregates (counts are unsigned, so never below 0).
+SUMMARY_RETENTION_QUERY = """
+    UPDATE voltage_cell_summary
+    SET reading_count = reading_count - LEAST(reading_count, %s),
+        nonzero_count = nonzero_count - LEAST(nonzero_count, %s),
+        nonzero_sum = nonzero_sum - %s,
+        held_sum = held_sum - %s,
+        held_seconds = GREATEST(held_seconds - %s, 0)
+    WHERE pack_id = %s AND cell_number = %s
+"""
+
+# voltage_readings rows with `hold`, the seconds each value counts for in time-weighted averages (see
+# hold_seconds()), and the timestamp of the next row of its cell. {where_clause} must also select the
+# rows that end the holds of the wanted ones. Parameters: HELD_READINGS_PARAMS, then the where_clause ones.
+HELD_READINGS_SQL = """
+    SELECT pack_id, cell_number, voltage, timestamp, next_timestamp,
+           IF(TIMESTAMPDIFF(MICROSECOND, timestamp, next_timestamp) BETWEEN 1 AND %s,
+              TIMESTAMPDIFF(MICROSECOND, timestamp, next_timestamp) / 1000000, %s) AS hold
+    FROM (
+        SELECT pack_id, cell_number, voltage, timestamp,
+               LEAD(timestamp) OVER (PARTITION BY pack_id, cell_number ORDER BY timestamp) AS next_timestamp
+        FROM voltage_readings
+        {where_clause}
+    ) AS readings
+"""
+HELD_READINGS_PARAMS = (AVERAGE_MAX_HOLD_SECONDS * 1000000, SAMPLE_INTERVAL_SECONDS)
+
+# Marks an archived day of a pack for rewriting because rows for it were written after it was archived.
+ARCHIVE_MARK_DIRTY_QUERY = """
+    INSERT INTO voltage_archive_dirty (pack_id, day, marked_at) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE marked_at = VALUES(marked_at)
+"""
+
+# Marks a pack's buckets of a rollup level, from dirty_since on, for rebuilding because rows for them
+# were written after they were rolled up (see RollupWorker).
+ROLLUP_MARK_DIRTY_QUERY = """
+    INSERT INTO voltage_rollup_dirty (table_name, pack_id, dirty_since, marked_at) VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE dirty_since = LEAST(dirty_since, VALUES(dirty_since)), marked_at = VALUES(marked_at)
+"""
+
+def combine_optional(pick, *values):
+    """Apply min/max to the values that are not None; None if all of them are."""
+    present = [v for v in values if v is not None]
+    return pick(present) if present else None
+
+def hold_seconds(timestamp, next_timestamp):
+    """Seconds a stored value counts for in time-weighted averages (see AVERAGE_MAX_HOLD_SECONDS)."""
+    if next_timestamp is not None:
+        gap = (next_timestamp - timestamp).total_seconds()
+        if 0 < gap <= AVERAGE_MAX_HOLD_SECONDS:
+            return gap
+    return SAMPLE_INTERVAL_SECONDS
+
+def summarize_batch(rows, previous=None):
+    """Reduce (cell, voltage, timestamp) rows to per-cell aggregate deltas.
+
+    Mirrors the dashboard semantics: every stored reading counts towards the total,
+    only readings above 0.0V (not functional zero) count towards avg/min/max. A value's
+    hold (held_sum / held_seconds, the time-weighted average) is known once the next row of
+    its cell is, so `previous` maps cell -> (voltage, timestamp) of the last row stored before
+    this batch, whose hold this batch ends.
+    """
+    previous = previous or {}
+    deltas = {}
+    for cell, voltage, timestamp in sorted(rows, key=lambda row: row[2]):
+        delta = deltas.get(cell)
+        if delta is None:
+            delta = deltas[cell] = {'reading_count': 0, 'nonzero_count': 0, 'nonzero_sum': 0.0,
+                                    'min_voltage': None, 'max_voltage': None, 'last_timestamp': None,
+                                    'held_sum': 0.0, 'held_seconds': 0.0, 'last_voltage': None}
+            prior_voltage, prior_timestamp = previous.get(cell, (None, None))
+            if prior_timestamp is not None and prior_timestamp < timestamp:
+                delta['last_voltage'], delta['last_timestamp'] = prior_voltage, prior_timestamp
+        if delta['last_voltage'] is not None and delta['last_voltage'] > 0:
+            hold = hold_seconds(delta['last_timestamp'], timestamp)
+            delta['held_sum'] += delta['last_voltage'] * hold
+            delta['held_seconds'] += hold
+        delta['reading_count'] += 1
+        delta['last_voltage'], delta['last_timestamp'] = voltage, timestamp
+        if voltage > 0:
+            delta['nonzero_count'] += 1
+            delta['nonzero_sum'] += voltage
+            if delta['min_voltage'] is None or voltage < delta['min_voltage']:
+                delta['min_voltage'] = voltage
+            if delta['max_voltage'] is None or voltage > delta['max_voltage']:
+                delta['max_voltage'] = voltage
+    return deltas
+
+
+class CellAggregates:
+    """Running per-cell aggregates (count, sum, held sum, min, max, last reading) of every pack behind /api/dashboard.
+
+    The persistent copy lives in voltage_cell_summary, keyed by (pack_id, cell_number), and is updated in the same transaction
+    as each batch insert and each retention delete. Writers bracket that transaction with
+    begin_write() / end_write(); the lock is only taken to count them in and out and to merge
+    committed deltas, never across a commit. load() waits until no write is in flight and holds
+    new ones back while it reads, so it can never miss or double-count a batch. It runs at startup,
+    before the writers (and again from the rollup job if the DB was unreachable then).
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self.loaded = False
+        self._packs = {}  # pack_id -> {cell: aggregates}
+        self._writes_in_flight = 0
+        self._loading = False
+
+    def begin_write(self):
+        """Call before a transaction that changes voltage_cell_summary; always pair with end_write()."""
+        with self._lock:
+            while self._loading:
+                self._lock.wait()
+            self._writes_in_flight += 1
+
+    def end_write(self, deltas=None):
+        """Call after the transaction: with its deltas ({(pack_id, cell): delta}) once committed, with None after a rollback.
+
+        Deltas are dropped until load() has run (load reads them from the DB).
+        """
+        with self._lock:
+            self._writes_in_flight -= 1
+            if deltas and self.loaded:
+                self._merge(deltas)
+            self._lock.notify_all()
+
+    def _merge(self, deltas):
+        """Merge committed batch deltas. Caller holds the lock."""
+        for (pack_id, cell), delta in deltas.items():
+            cells = self._packs.setdefault(pack_id, {})
+            current = cells.get(cell)
+            if current is None:
+                cells[cell] = dict(delta)
+                continue
+            for key in ('reading_count', 'nonzero_count', 'nonzero_sum', 'held_sum', 'held_seconds'):
+                current[key] += delta[key]
+            if delta['last_timestamp'] is not None and (current['last_timestamp'] is None
+                                                        or delta['last_timestamp'] >= current['last_timestamp']):
+                current['last_voltage'] = delta['last_voltage']
+            for key, pick in (('min_voltage', min), ('max_voltage', max), ('last_timestamp', max)):
+                current[key] = combine_optional(pick, current[key], delta[key])
+
+    def load(self):
+        """Load aggregates from voltage_cell_summary in one pass.
+
+        Packs with rows in voltage_readings but none in the summary table (first start, or upgraded
+        from a version without it or without its pack_id) are seeded with one GROUP BY pass over
+        their rows first. Writes wait meanwhile. Returns True on success.
+        """
+        conn = None
+        cursor = None
+        with self._lock:
+            while self._loading:
+                self._lock.wait()
+            self._loading = True
+            while self._writes_in_flight:
+                self._lock.wait()
+        try:
+            conn = get_db_connection()
+            if not conn:
+                app.logger.error("Failed to get DB connection for loading cell aggregates.")
+                return False
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT DISTINCT pack_id FROM voltage_cell_summary")
+            summarized = {int(row['pack_id']) for row in cursor.fetchall()}
+            cursor.execute("SELECT DISTINCT pack_id FROM voltage_readings")
+            unsummarized = sorted({int(row['pack_id']) for row in cursor.fetchall()} - summarized)
+            for pack_id in unsummarized:
+                app.logger.info(f"voltage_cell_summary has no rows for pack {pack_id}. Rebuilding them from voltage_readings.")
+                cursor.execute(f"""
+                    INSERT INTO voltage_cell_summary
+                        (pack_id, cell_number, reading_count, nonzero_count, nonzero_sum, min_voltage, max_voltage, last_timestamp,
+                         held_sum, held_seconds, last_voltage)
+                    SELECT pack_id, cell_number,
+                           COUNT(*),
+                           SUM(voltage > 0),
+                           COALESCE(SUM(CASE WHEN voltage > 0 THEN voltage END), 0),
+                           MIN(CASE WHEN voltage > 0 THEN voltage END),
+                           MAX(CASE WHEN voltage > 0 THEN voltage END),
+                           MAX(timestamp),
+                           COALESCE(SUM(CASE WHEN voltage > 0 AND next_timestamp IS NOT NULL THEN voltage * hold END), 0),
+                           COALESCE(SUM(CASE WHEN voltage > 0 AND next_timestamp IS NOT NULL THEN hold END), 0),
+                           MAX(CASE WHEN next_timestamp IS NULL THEN voltage END)
+                    FROM ({HELD_READINGS_SQL.format(where_clause='WHERE pack_id = %s AND voltage IS NOT NULL')}) AS held
+                    GROUP BY pack_id, cell_number
+                """, (*HELD_READINGS_PARAMS, pack_id))
+                conn.commit()
+
+            cursor.execute("SELECT * FROM voltage_cell_summary")
+            packs = {}
+            for row in cursor.fetchall():
+                packs.setdefault(int(row['pack_id']), {})[int(row['cell_number'])] = {
+                    'reading_count': int(row['reading_count']),
+                    'nonzero_count': int(row['nonzero_count']),
+                    'nonzero_sum': float(row['nonzero_sum']),
+                    'min_voltage': float(row['min_voltage']) if row['min_voltage'] is not None else None,
+                    'max_voltage': float(row['max_voltage']) if row['max_voltage'] is not None else None,
+                    'last_timestamp': row['last_timestamp'],
+                    'held_sum': float(row['held_sum']),
+                    'held_seconds': float(row['held_seconds']),
+                    'last_voltage': float(row['last_voltage']) if row['last_voltage'] is not None else None,
+                }
+            with self._lock:
+                self._packs = packs
+                self.loaded = True
+            app.logger.info(f"Loaded running aggregates for {sum(len(cells) for cells in packs.values())} cells of {len(packs)} packs.")
+            return True
+        except mariadb.Error as e:
+            app.logger.error(f"Database error loading cell aggregates: {e}")
+            return False
+        finally:
+            close_db_resources(cursor, conn, 'CellAggregates.load')
+            with self._lock:
+                self._loading = False
+                self._lock.notify_all()
+
+    def snapshot(self, pack_id=LOCAL_PACK_ID):
+        """Return a copy of one pack's per-cell aggregates, keyed by cell number."""
+        with self._lock:
+            return {cell: dict(values) for cell, values in self._packs.get(pack_id, {}).items()}
+
+
+cell_aggregates = CellAggregates()
+
+def find_existing_seqs(cursor, keyed_rows, pack_id=LOCAL_PACK_ID):
+    """Return the (seq, cell_number) pairs among keyed_rows that are already stored for the pack."""
+    seqs = [row[0] for row in keyed_rows]
+    cursor.execute(
+        "SELECT seq, cell_number FROM voltage_readings WHERE pack_id = %s AND seq BETWEEN %s AND %s",
+        (pack_id, min(seqs), max(seqs))
+    )
+    return {(seq, cell) for seq, cell in cursor.fetchall()}
+
+class PermanentBatchError(Exception):
+    """A batch insert failed in a way retrying the same rows cannot fix (see is_permanent_db_error)."""
+
+
+def is_permanent_db_error(error):
+    """True for errors caused by the rows themselves (bad values, constraint violations), not by an outage."""
+    return isinstance(error, (mariadb.DataError, mariadb.IntegrityError))
+
+def insert_voltage_batch(rows, raise_permanent=False):
+    """Insert (cell, voltage, timestamp) rows of the local pack, keyed by reading_seq(timestamp).
+
+    Returns True on success, False if the rows could not be written.
+    """
+    keyed_rows = [(reading_seq(timestamp), cell, voltage, timestamp) for cell, voltage, timestamp in rows]
+    return insert_keyed_voltage_batch(keyed_rows, raise_permanent=raise_permanent)
+
+def insert_keyed_voltage_batch(keyed_rows, pack_id=LOCAL_PACK_ID, raise_permanent=False):
+    """Insert (seq, cell, voltage, timestamp) rows with one multi-row statement and a single commit.
+
+    Every row is keyed by (pack_id, seq, cell_number). Rows that are already stored (a replayed or
+    resent batch) are skipped before the insert, so the pack's per-cell running aggregates in
+    voltage_cell_summary, updated in the same transaction, only count new rows.
+
+    Returns True on success, False if the rows could not be written. With raise_permanent=True,
+    failures that retrying cannot fix raise PermanentBatchError instead.
+    """
+    # Collapse repeats within the batch; INSERT IGNORE would store only the first one.
+    keyed_rows = list({(row[0], row[1]): row for row in keyed_rows}.values())
+    if not keyed_rows:
+        return True
+    rows = [(cell, voltage, timestamp) for _, cell, voltage, timestamp in keyed_rows]
+
+    conn = None
+    cursor = None
+    summary_write = False
+    committed_deltas = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            log_rate_limited('db_batch_connect', logging.ERROR, f"Failed to get DB connection for insert_voltage_batch ({len(rows)} rows).")
+            return False
+
+        cursor = conn.cursor()
+        existing = find_existing_seqs(cursor, keyed_rows, pack_id)
+        if existing:
+            keyed_rows = [row for row in keyed_rows if (row[0], row[1]) not in existing]
+            app.logger.info(f"Skipping {len(rows) - len(keyed_rows)} already stored rows in replayed batch.")
+            if not keyed_rows:
+                return True
+            rows = [(cell, voltage, timestamp) for _, cell, voltage, timestamp in keyed_rows]
+
+        # Before touching voltage_cell_summary, so cell_aggregates.load() never sees this batch half done.
+        cell_aggregates.begin_write()
+        summary_write = True
+        # The cells' last stored rows, whose holds this batch ends; locked until the commit.
+        batch_cells = sorted({row[0] for row in rows})
+        cursor.execute(
+            f"SELECT cell_number, last_voltage, last_timestamp FROM voltage_cell_summary "
+            f"WHERE pack_id = %s AND cell_number IN ({', '.join(['%s'] * len(batch_cells))}) FOR UPDATE",
+            (pack_id, *batch_cells)
+        )
+        previous = {int(cell): (float(voltage) if voltage is not None else None, last_timestamp)
+                    for cell, voltage, last_timestamp in cursor.fetchall()}
+        deltas = summarize_batch(rows, previous)
+        earliest = min(row[2] for row in rows)
+        # Rows older than the rollup lateness (spool replay, resent remote batches) land in buckets
+        # that may already be rolled up; mark them dirty for this pack with the same commit.
+        late = earliest < datetime.now() - timedelta(seconds=ROLLUP_LATENESS_SECONDS)
+        # Days the archive job may already have written get rewritten (see ArchiveWorker).
+        archive_before = floor_to_bucket(datetime.now() - timedelta(seconds=ARCHIVE_LATENESS_SECONDS), 86400)
+        late_days = []
+        if archive_worker.enabled and earliest < archive_before:
+            late_days = sorted({floor_to_bucket(row[2], 86400) for row in rows if row[2] < archive_before})
+        query = "INSERT IGNORE INTO voltage_readings (pack_id, seq, cell_number, voltage, timestamp) VALUES (%s, %s, %s, %s, %s)"
+        started = time.perf_counter()
+        cursor.executemany(query, [(pack_id, *row) for row in keyed_rows])
+        if deltas:
+            cursor.executemany(SUMMARY_UPSERT_QUERY, [
+                (pack_id, cell, d['reading_count'], d['nonzero_count'], d['nonzero_sum'], d['min_voltage'], d['max_voltage'], d['last_timestamp'],
+                 d['held_sum'], d['held_seconds'], d['last_voltage'])
+                for cell, d in deltas.items()
+            ])
+        if late:
+            marked_at = datetime.now()
+            cursor.executemany(ROLLUP_MARK_DIRTY_QUERY, [
+                (table, pack_id, bucket_start, marked_at) for table, bucket_start in RollupWorker.dirty_targets(earliest)
+            ])
+        if late_days:
+            marked_at = datetime.now()
+            cursor.executemany(ARCHIVE_MARK_DIRTY_QUERY, [(pack_id, day.date(), marked_at) for day in late_days])
+        executed = time.perf_counter()
+        conn.commit()
+        committed_deltas = {(pack_id, cell): delta for cell, delta in deltas.items()}
+        metric_db_insert_seconds.observe(executed - started)
+        metric_db_commit_seconds.observe(time.perf_counter() - executed)
+        metric_db_rows_written.inc(amount=len(keyed_rows))
+        rollup_worker.note_rows_written(pack_id, earliest)
+        return True
+    except mariadb.Error as e:
+        metric_db_batch_errors.inc()
+        log_rate_limited('db_batch_insert', logging.ERROR, f"Database batch insert error ({len(rows)} rows): {e}")
+        if conn:
+            try:
+                conn.rollback()
+            except mariadb.Error as rb_err:
+                app.logger.error(f"Error during rollback: {rb_err}")
+        if raise_permanent and is_permanent_db_error(e):
+            raise PermanentBatchError(str(e)) from e
+        return False
+    except Exception as e_gen:
+        app.logger.error(f"Generic error in insert_voltage_batch: {e_gen}")
+        if raise_permanent:
+            raise PermanentBatchError(str(e_gen)) from e_gen
+        return False
+    finally:
+        close_db_resources(cursor, conn, 'insert_voltage_batch')
+        if summary_write:
+            cell_aggregates.end_write(committed_deltas)
+
+
+class VoltageWriter(threading.Thread):
+    """Write-behind buffer between the acquisition path and storage.
+
+    Rows are queued without touching the database and flushed by this thread with
+    sink (insert_voltage_batch() by default, LocalSpool.append when the spool is enabled)
+    once DB_WRITE_BATCH_SIZE rows are buffered or DB_WRITE_FLUSH_INTERVAL_MS has passed.
+    Rows that cannot be queued (buffer full) or written (sink failed) are counted as drops.
+    """
+
+    def __init__(self, batch_size=DB_WRITE_BATCH_SIZE, flush_interval_ms=DB_WRITE_FLUSH_INTERVAL_MS,
+                 max_rows=DB_WRITE_QUEUE_MAX_ROWS, sink=None):
+        super().__init__(name='VoltageWriter', daemon=True)
+        self.sink = sink or insert_voltage_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_rows)
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'dropped_queue_full': 0,
+            'dropped_db_error': 0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def submit(self, cell, voltage, timestamp):
+        """Queue one row. Blocks at most DB_WRITE_ENQUEUE_TIMEOUT_SECONDS if the buffer is full."""
+        try:
+            self._queue.put((cell, voltage, timestamp), timeout=DB_WRITE_ENQUEUE_TIMEOUT_SECONDS)
+        except queue.Full:
+            self._count('dropped_queue_full')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _flush(self, batch):
+        if self.sink(batch):
+            self._count('written', len(batch))
+            self._count('batches')
+        else:
+            self._count('dropped_db_error', len(batch))
+
+    def _drain_available(self, batch, limit):
+        """Move already-queued rows into batch without blocking."""
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+    def run(self):
+        app.logger.info(f"Voltage writer started (batch {self.batch_size} rows / {self.flush_interval}s).")
+        while not self._stop_event.is_set():
+            try:
+                first_row = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first_row]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                self._drain_available(batch, self.batch_size)
+            self._flush(batch)
+
+        # Drain whatever is still buffered on shutdown.
+        while True:
+            batch = []
+            self._drain_available(batch, self.batch_size)
+            if not batch:
+                break
+            self._flush(batch)
+        app.logger.info("Voltage writer stopped.")
+
+    def ensure_started(self):
+        """Start the writer thread once; later calls are no-ops."""
+        if self.ident is None:
+            self.start()
+
+    def stop(self, timeout=DB_WRITE_SHUTDOWN_TIMEOUT_SECONDS):
+        """Stop the writer, drain whatever is still buffered and wait for the thread to finish."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_capacity'] = self._queue.maxsize
+        return stats
+
+
+class LocalSpool:
+    """Append-only SQLite spool of (cell, voltage, timestamp) rows on local disk.
+
+    The file runs in WAL mode so appends are a single sequential write per batch. Rows are
+    read back oldest first by the drainer and removed once MariaDB has committed them. The
+    spool is bounded by max_rows; beyond that the oldest rows are discarded and counted.
+    Rows MariaDB rejects for good are moved to the dead_letter table of the same file.
+    The file is opened on first use, so importing the app does not create it.
+    """
+
+    def __init__(self, path=SPOOL_PATH, max_rows=SPOOL_MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = None
+        self._depth = 0
+        self._stats = {'appended': 0, 'removed': 0, 'dropped_full': 0, 'append_errors': 0, 'dead_lettered': 0}
+
+    def _connect(self):
+        """Open the spool file on first use. Caller holds the lock."""
+        if self._conn is not None:
+            return self._conn
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cell_number INTEGER NOT NULL,
+                voltage REAL NOT NULL,
+                timestamp TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cell_number INTEGER NOT NULL,
+                voltage REAL,
+                timestamp TEXT NOT NULL,
+                error TEXT NOT NULL,
+                failed_at TEXT NOT NULL
+            )
+        """)
+        self._conn = conn
+        self._depth = conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        if self._depth:
+            app.logger.info(f"Spool {self.path} holds {self._depth} rows from a previous run; they will be replayed.")
+        return conn
+
+    def append(self, rows):
+        """Durably append a batch. Returns False only if the local write itself failed."""
+        try:
+            with self._lock:
+                self._connect()
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT INTO spool (cell_number, voltage, timestamp) VALUES (?, ?, ?)",
+                    [(cell, voltage, timestamp.isoformat()) for cell, voltage, timestamp in rows]
+                )
+                self._conn.execute("COMMIT")
+                self._depth += len(rows)
+                self._stats['appended'] += len(rows)
+                if self._depth > self.max_rows:
+                    self._trim(self._depth - self.max_rows)
+            return True
+        except sqlite3.Error as e:
+            app.logger.error(f"Spool append error ({len(rows)} rows): {e}")
+            with self._lock:
+                self._stats['append_errors'] += 1
+                if self._conn is not None and self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+            return False
+
+    def _trim(self, excess):
+        """Drop the oldest rows to stay within max_rows. Caller holds the lock."""
+        cursor = self._conn.execute(
+            "DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)", (excess,)
+        )
+        self._depth -= cursor.rowcount
+        self._stats['dropped_full'] += cursor.rowcount
+        app.logger.warning(f"Spool full ({self.max_rows} rows); dropped {cursor.rowcount} oldest rows.")
+
+    def peek(self, limit):
+        """Return up to limit of the oldest rows as (last_id, [(cell, voltage, timestamp), ...])."""
+        with self._lock:
+            records = self._connect().execute(
+                "SELECT id, cell_number, voltage, timestamp FROM spool ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        if not records:
+            return None, []
+        rows = [(cell, voltage, datetime.fromisoformat(timestamp)) for _, cell, voltage, timestamp in records]
+        return records[-1][0], rows
+
+    def remove_through(self, last_id):
+        """Remove every row up to and including last_id (after it was committed to MariaDB)."""
+        with self._lock:
+            cursor = self._connect().execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self._depth -= cursor.rowcount
+            self._stats['removed'] += cursor.rowcount
+
+    def dead_letter(self, rows, error):
+        """Keep rows MariaDB will never accept, with the error, for inspection."""
+        failed_at = datetime.now().isoformat()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO dead_letter (cell_number, voltage, timestamp, error, failed_at) VALUES (?, ?, ?, ?, ?)",
+                [(cell, voltage, timestamp.isoformat(), error, failed_at) for cell, voltage, timestamp in rows]
+            )
+            conn.execute("COMMIT")
+            self._stats['dead_lettered'] += len(rows)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['depth'] = self._depth
+        stats['capacity'] = self.max_rows
+        stats['path'] = self.path
+        return stats
+
+
+class SpoolDrainer(threading.Thread):
+    """Replays the spool into MariaDB in batches of SPOOL_DRAIN_BATCH_ROWS.
+
+    Rows are removed from the spool only after sink (insert_voltage_batch by default) reported
+    success, so a crash between commit and removal leads to a replay that the (pack_id, seq,
+    cell_number) key turns into a no-op. Transient failures (MariaDB unreachable) are retried
+    with backoff. A batch that fails permanently (PermanentBatchError) is replayed row by row
+    so the rows MariaDB rejects go to the spool's dead letter table and the rest gets through;
+    one bad row never blocks the rows queued behind it.
+    """
+
+    def __init__(self, spool, sink=None, batch_rows=SPOOL_DRAIN_BATCH_ROWS):
+        super().__init__(name='SpoolDrainer', daemon=True)
+        self.spool = spool
+        self.sink = sink or (lambda rows: insert_voltage_batch(rows, raise_permanent=True))
+        self.batch_rows = batch_rows
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {'replayed': 0, 'batches': 0, 'failed_batches': 0, 'dead_lettered': 0, 'last_error_at': None}
+
+    def drain_once(self):
+        """Replay one batch. Returns the number of rows replayed, 0 if empty, None on failure."""
+        last_id, rows = self.spool.peek(self.batch_rows)
+        if not rows:
+            return 0
+        try:
+            written = self.sink(rows)
+        except PermanentBatchError as e:
+            app.logger.warning(f"Spool batch of {len(rows)} rows rejected ({e}); isolating the bad rows.")
+            written = self._replay_rows_individually(rows)
+        if not written:
+            with self._stats_lock:
+                self._stats['failed_batches'] += 1
+                self._stats['last_error_at'] = datetime.now().isoformat()
+            return None
+        self.spool.remove_through(last_id)
+        with self._stats_lock:
+            self._stats['replayed'] += len(rows)
+            self._stats['batches'] += 1
+        return len(rows)
+
+    def _replay_rows_individually(self, rows):
+        """Write rows one at a time, dead-lettering those rejected for good. False on a transient failure."""
+        for row in rows:
+            try:
+                if not self.sink([row]):
+                    return False # Outage while isolating; the whole batch is replayed later (already written rows are skipped)
+            except PermanentBatchError as e:
+                app.logger.error(f"Moving spooled row {row} to the dead letter table: {e}")
+                self.spool.dead_letter([row], str(e))
+                with self._stats_lock:
+                    self._stats['dead_lettered'] += 1
+        return True
+
+    def run(self):
+        app.logger.info(f"Spool drainer started ({self.spool.path}).")
+        backoff = SPOOL_RETRY_MIN_SECONDS
+        while not self._stop_event.is_set():
+            try:
+                replayed = self.drain_once()
+            except Exception as e:
+                app.logger.error(f"Unexpected error in spool drainer: {e}")
+                replayed = None
+            if replayed is None:
+                log_rate_limited('spool_replay', logging.WARNING, f"Spool replay failed; retrying in {backoff}s.")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, SPOOL_RETRY_MAX_SECONDS)
+                continue
+            backoff = SPOOL_RETRY_MIN_SECONDS
+            if replayed == 0:
+                self._stop_event.wait(SPOOL_DRAIN_IDLE_SECONDS)
+        app.logger.info("Spool drainer stopped.")
+
+    def ensure_started(self):
+        """Start the drainer thread once; later calls are no-ops."""
+        if self.ident is None:
+            self.start()
+
+    def stop(self, timeout=DB_WRITE_SHUTDOWN_TIMEOUT_SECONDS):
+        """Stop after the current batch. Whatever is left stays in the spool for the next run."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+if SPOOL_ENABLED:
+    voltage_spool = LocalSpool()
+    spool_drainer = SpoolDrainer(voltage_spool)
+    voltage_writer = VoltageWriter(sink=voltage_spool.append)
+else:
+    voltage_spool = None
+    spool_drainer = None
+    voltage_writer = VoltageWriter()
+
+class StoragePolicy:
+    """Decides which samples are persisted (see STORAGE_POLICY).
+
+    In 'deadband' mode a sample is stored when it differs from the cell's last stored value
+    by more than the cell's deadband, or when the heartbeat interval has passed. Long runs of
+    a resting pack (or of functional-zero 0.0V readings) collapse to one row per heartbeat.
+    """
+
+    def __init__(self, policy=STORAGE_POLICY, heartbeat_seconds=STORAGE_HEARTBEAT_SECONDS):
+        self.policy = policy
+        self.heartbeat_seconds = heartbeat_seconds
+        self._deadbands = {entry['cell']: entry['deadband'] for entry in DEVICE_MAP}
+        self._last_stored = {}  # cell -> (voltage, timestamp)
+        self._lock = threading.Lock()
+        self._stats = {'stored': 0, 'suppressed': 0}
+
+    def should_store(self, cell, voltage, timestamp):
+        """Whether to store this sample. Call record_stored() once it was actually queued."""
+        with self._lock:
+            if self.policy == 'deadband':
+                last = self._last_stored.get(cell)
+                deadband = self._deadbands.get(cell, STORAGE_DEADBAND_VOLTS)
+                if (last is not None and abs(voltage - last[0]) <= deadband
+                        and (timestamp - last[1]).total_seconds() < self.heartbeat_seconds):
+                    self._stats['suppressed'] += 1
+                    return False
+            return True
+
+    def record_stored(self, cell, voltage, timestamp):
+        """Make this sample the reference for the cell's deadband. A dropped sample must not become one."""
+        with self._lock:
+            if self.policy == 'deadband':
+                self._last_stored[cell] = (voltage, timestamp)
+            self._stats['stored'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['policy'] = self.policy
+        return stats
+
+
+storage_policy = StoragePolicy()
+
+def insert_voltage_reading(cell, voltage, timestamp=None):
+    """Queue a voltage reading for batched insertion into the database.
+
+    Skips None (I2C error) and samples the storage policy decides not to keep. Returns True
+    only if the reading was queued, i.e. it will become a row.
+    """
+    # Allow 0.0V to be inserted if it's a functional zero.
+    if voltage is None: # Only skip if it's an actual I2C read error resulting in None
+        app.logger.debug(f"Skipping database insert for cell {cell} due to voltage being None (I2C error).")
+        return False
+    timestamp = timestamp or datetime.now()
+    if not storage_policy.should_store(cell, voltage, timestamp):
+        return False
+    if not voltage_writer.submit(cell, voltage, timestamp):
+        return False
+    storage_policy.record_stored(cell, voltage, timestamp)
+    return True
+
+class VoltageRingBuffer:
+    """Fixed-size, array-backed ring buffer of recent (timestamp, voltage) samples per cell.
+
+    The acquisition path appends exactly the samples it queued for the DB (so in 'deadband' mode
+    the buffer holds the same step-wise rows). History queries whose answer lies entirely inside
+    the buffered window are answered from memory without a DB round trip.
+    """
+
+    def __init__(self, cells, capacity=HISTORY_RING_CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._timestamps = {cell: array('d', bytes(8 * capacity)) for cell in cells}
+        self._voltages = {cell: array('f', bytes(4 * capacity)) for cell in cells}
+        self._next = {cell: 0 for cell in cells}  # Physical index of the next write
+        self._count = {cell: 0 for cell in cells}
+        # Everything stored after this instant is in the buffer (older rows only live in the DB).
+        self._complete_since = time.time()
+
+    @property
+    def memory_bytes(self):
+        return sum(len(a) * a.itemsize for a in self._timestamps.values()) + sum(len(a) * a.itemsize for a in self._voltages.values())
+
+    def append_frame(self, timestamp, readings):
+        """Append one acquisition frame. Readings with voltage None (I2C error) are skipped, as in the DB."""
+        ts = timestamp.timestamp()
+        with self._lock:
+            for reading in readings:
+                cell = reading['cell']
+                if reading['voltage'] is None or cell not in self._next:
+                    continue
+                i = self._next[cell]
+                if self._count[cell] == self.capacity:
+                    # Overwriting the oldest sample: the buffer is no longer complete before it.
+                    self._complete_since = max(self._complete_since, self._timestamps[cell][i])
+                else:
+                    self._count[cell] += 1
+                self._timestamps[cell][i] = ts
+                self._voltages[cell][i] = reading['voltage']
+                self._next[cell] = (i + 1) % self.capacity
+
+    def _cell_rows(self, cell, start_ts, end_ts, limit):
+        """Newest-first rows of one cell with start_ts <= ts <= end_ts. Caller holds the lock."""
+        count = self._count[cell]
+        oldest = (self._next[cell] - count) % self.capacity
+        timestamps = self._timestamps[cell]
+        voltages = self._voltages[cell]
+
+        # Timestamps are ascending in logical order, so binary search for the newest row <= end_ts.
+        hi = count
+        if end_ts is not None:
+            lo = 0
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if timestamps[(oldest + mid) % self.capacity] <= end_ts:
+                    lo = mid + 1
+                else:
+                    hi = mid
+
+        rows = []
+        for logical in range(hi - 1, -1, -1):
+            if len(rows) >= limit:
+                break
+            i = (oldest + logical) % self.capacity
+            if start_ts is not None and timestamps[i] < start_ts:
+                break
+            rows.append((timestamps[i], cell, round(voltages[i], 3)))
+        return rows
+
+    def query(self, limit, start=None, end=None):
+        """Return up to `limit` newest-first rows in [start, end], or None if the DB is needed.
+
+        Rows are stamped in whole seconds, as voltage_readings stores them, and a page only holds
+        whole seconds: if `limit` cuts into one, its rows are left for the next page. Every row
+        older than the page is then older than its last timestamp, which works as a bare
+        'before' cursor. The DB is needed when the answer could include rows older than the
+        buffered window, or when one second has more rows than `limit`.
+        """
+        start_ts = start.timestamp() if start else None
+        end_ts = end.timestamp() if end else None
+        with self._lock:
+            complete_since = self._complete_since
+            if start_ts is not None and start_ts < complete_since:
+                return None
+            per_cell = [self._cell_rows(cell, start_ts, end_ts, limit + 1) for cell in self._next]
+
+        rows = list(heapq.merge(*per_cell, key=lambda row: row[0], reverse=True))[:limit + 1]
+        if start_ts is None and len(rows) < limit:
+            return None # Fewer rows than requested: older ones may still be in the DB
+        if len(rows) > limit:
+            cut_second = math.floor(rows[limit][0])  # The first row left out
+            rows = [row for row in rows[:limit] if math.floor(row[0]) > cut_second]
+            if not rows:
+                return None
+        if rows and math.floor(rows[-1][0]) < complete_since:
+            return None
+        return [
+            {'cell_number': cell, 'voltage': voltage, 'timestamp': datetime.fromtimestamp(math.floor(ts))}
+            for ts, cell, voltage in rows
+        ]
+
+
+history_ring = VoltageRingBuffer(
+    [entry['cell'] for entry in DEVICE_MAP],
+    capacity=min(HISTORY_RING_CAPACITY, HISTORY_RING_MAX_BYTES // (12 * max(PYTHON_NUMBER_OF_CELLS, 1)))
+)
+app.logger.info(f"History ring buffer: {history_ring.capacity} samples per cell, {history_ring.memory_bytes / 1e6:.1f} MB.")
+
+def build_reading_filters(start=None, end=None, cells=None, time_column='timestamp', end_inclusive=True, pack_id=None):
+    """Build a WHERE clause (and its parameters) for a pack, time range and cell list.
+
+    Works for voltage_readings (time_column 'timestamp'), the rollup tables ('bucket_start')
+    and voltage_alerts ('created_at', which has no pack_id).
+    """
+    conditions = []
+    params = []
+    if pack_id is not None:
+        conditions.append("pack_id = %s")
+        params.append(pack_id)
+    if start is not None:
+        conditions.append(f"{time_column} >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append(f"{time_column} {'<=' if end_inclusive else '<'} %s")
+        params.append(end)
+    if cells:
+        conditions.append(f"cell_number IN ({', '.join(['%s'] * len(cells))})")
+        params.extend(cells)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where_clause, params
+
+def get_voltage_history_page(limit=HISTORY_DEFAULT_LIMIT, start=None, end=None, cells=None, before=None, after=None,
+                             pack_id=LOCAL_PACK_ID):
+    """Get one page of a pack's voltage readings, newest first, using keyset pagination on (timestamp, id).
+
+    `before` / `after` are (timestamp, id) cursors; id may be None to page from a bare timestamp.
+    Every page is an index range scan: idx_pack_timestamp (pack_id, timestamp, id) for all cells, or
+    one idx_pack_cell_timestamp (pack_id, cell_number, timestamp, id) scan per requested cell merged
+    with UNION ALL. Returns None on a database error.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            app.logger.error("Failed to get DB connection for get_voltage_history_page.")
+            return None
+
+        cursor = conn.cursor(dictionary=True)
+        conditions = ["pack_id = %s"]
+        params = [pack_id]
+        if start is not None:
+            conditions.append("timestamp >= %s")
+            params.append(start)
+        if end is not None:
+            conditions.append("timestamp <= %s")
+            params.append(end)
+        # (timestamp, id) < (ts, id) spelled out so the optimizer sees a plain range on timestamp.
+        if before is not None:
+            before_ts, before_id = before
+            if before_id is None:
+                conditions.append("timestamp < %s")
+                params.append(before_ts)
+            else:
+                conditions.append("timestamp <= %s AND (timestamp < %s OR id < %s)")
+                params.extend((before_ts, before_ts, before_id))
+        if after is not None:
+            after_ts, after_id = after
+            if after_id is None:
+                conditions.append("timestamp > %s")
+                params.append(after_ts)
+            else:
+                conditions.append("timestamp >= %s AND (timestamp > %s OR id > %s)")
+                params.extend((after_ts, after_ts, after_id))
+        # Paging forward (after only) walks the index upwards; the page is flipped back to newest first.
+        direction = 'ASC' if after is not None and before is None else 'DESC'
+        order_by = f"ORDER BY timestamp {direction}, id {direction}"
+
+        if cells and len(cells) <= HISTORY_UNION_MAX_CELLS:
+            where_clause = " AND ".join([*conditions, "cell_number = %s"])
+            per_cell_query = f"""
+                (SELECT id, cell_number, voltage, timestamp FROM voltage_readings
+                 WHERE {where_clause} {order_by} LIMIT %s)
+            """
+            query = " UNION ALL ".join([per_cell_query] * len(cells)) + f" {order_by} LIMIT %s"
+            query_params = []
+            for cell in cells:
+                query_params.extend((*params, cell, limit))
+            query_params.append(limit)
+        else:
+            if cells:
+                conditions.append(f"cell_number IN ({', '.join(['%s'] * len(cells))})")
+                params.extend(cells)
+            where_clause = f"WHERE {' AND '.join(conditions)}"
+            query = f"""
+                SELECT id, cell_number, voltage, timestamp FROM voltage_readings
+                {where_clause} {order_by} LIMIT %s
+            """
+            query_params = (*params, limit)
+        cursor.execute(query, query_params)
+        rows = cursor.fetchall()
+        if direction == 'ASC':
+            rows.reverse()
+        return rows
+    except mariadb.Error as e:
+        app.logger.error(f"Database query error in get_voltage_history_page: {e}")
+        return None
+    finally:
+        close_db_resources(cursor, conn, 'get_voltage_history_page')
+
+def format_history_cursor(row):
+    """Encode a row's (timestamp, id) position as a page cursor, e.g. '2024-05-01T12:00:00,123'."""
+    return f"{row['timestamp'].isoformat()},{row['id']}"
+
+def known_pack_cells(pack_id):
+    """Return the cell numbers of a pack: the device map for the local pack, stored cells otherwise."""
+    if pack_id == LOCAL_PACK_ID:
+        return [entry['cell'] for entry in DEVICE_MAP]
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            app.logger.error("Failed to get DB connection for known_pack_cells.")
+            return []
+        cursor = conn.cursor()
+        # Loose index scan over idx_pack_cell_timestamp: one probe per distinct cell.
+        cursor.execute("SELECT DISTINCT cell_number FROM voltage_readings WHERE pack_id = %s ORDER BY cell_number", (pack_id,))
+        return [int(row[0]) for row in cursor.fetchall()]
+    except mariadb.Error as e:
+        app.logger.error(f"Database query error in known_pack_cells: {e}")
+        return []
+    finally:
+        close_db_resources(cursor, conn, 'known_pack_cells')
+
+def get_values_before(timestamp, cells, pack_id=LOCAL_PACK_ID):
+    """Return the pack's last stored row before `timestamp` for each cell (one index lookup per cell).
+
+    Used to rebuild step-wise series: that row's value is still in effect at `timestamp`.
+    """
+    if not cells:
+        return []
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            app.logger.error("Failed to get DB connection for get_values_before.")
+            return []
+        cursor = conn.cursor(dictionary=True)
+        per_cell_query = """
+            (SELECT cell_number, voltage, timestamp FROM voltage_readings
+             WHERE pack_id = %s AND cell_number = %s AND timestamp < %s ORDER BY timestamp DESC LIMIT 1)
+        """
+        query = " UNION ALL ".join([per_cell_query] * len(cells))
+        params = []
+        for cell in cells:
+            params.extend((pack_id, cell, timestamp))
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    except mariadb.Error as e:
+        app.logger.error(f"Database query error in get_values_before: {e}")
+        return []
+    finally:
+        close_db_resources(cursor, conn, 'get_values_before')
+
+def floor_to_bucket(dt, bucket_seconds):
+    """Floor a local datetime to the start of its minute, hour or day bucket."""
+    if bucket_seconds >= 86400:
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket_seconds >= 3600:
+        return dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(second=0, microsecond=0)
+
+
+class RollupWorker(threading.Thread):
+    """Background job that maintains the rollup tables and enforces RETENTION_DAYS.
+
+    Each level keeps a watermark: every bucket before it has been rolled up. Watermarks are persisted
+    in voltage_rollup_state so a restart resumes where it left off. Rows written into buckets that were
+    already rolled up (spool replays, resent remote batches) mark their pack dirty in voltage_rollup_dirty
+    from the first affected bucket on, and only that pack's buckets are rebuilt; rebuilding a bucket
+    replaces it completely. final_until() is what readers can rely on.
+    """
+
+    def __init__(self, interval=ROLLUP_INTERVAL_SECONDS):
+        super().__init__(name='RollupWorker', daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._watermarks = {}
+        self._watermarks_loaded = False
+        self._dirty = {}  # (table, pack_id) -> first bucket that must be rebuilt
+
+    def ensure_started(self):
+        if self.ident is None:
+            self.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def watermark(self, table):
+        """Return the datetime up to which `table` has been rolled up, or None if it was never built."""
+        with self._lock:
+            return self._watermarks.get(table)
+
+    def final_until(self, table, pack_id=None):
+        """Return the datetime before which `table` is final for pack_id (every pack if None), or None."""
+        with self._lock:
+            watermark = self._watermarks.get(table)
+            if watermark is None:
+                return None
+            return min([watermark] + [since for (dirty_table, dirty_pack), since in self._dirty.items()
+                                      if dirty_table == table and pack_id in (None, dirty_pack)])
+
+    @staticmethod
+    def dirty_targets(earliest_timestamp):
+        """Return (table, bucket_start) per level: the buckets from bucket_start on must be rebuilt."""
+        targets = []
+        # A late row also ends the hold of the row before it, which can be this much older.
+        earliest = earliest_timestamp - timedelta(seconds=AVERAGE_MAX_HOLD_SECONDS)
+        for table, bucket_seconds, _, source in ROLLUP_LEVELS:
+            bucket_start = floor_to_bucket(earliest, bucket_seconds)
+            if RETENTION_DAYS.get(source):
+                # Source rows past retention may already be gone; rebuilding those buckets would lose data.
+                retained_since = floor_to_bucket(datetime.now() - timedelta(days=RETENTION_DAYS[source]), bucket_seconds)
+                bucket_start = max(bucket_start, retained_since)
+            targets.append((table, bucket_start))
+            earliest = bucket_start # Coarser levels only need rebuilding from here on
+        return targets
+
+    def note_rows_written(self, pack_id, earliest_timestamp):
+        """Stop serving a pack's rollup buckets that were built before rows written into them.
+
+        This only updates the in-memory view; insert_keyed_voltage_batch marks the buckets in
+        voltage_rollup_dirty in the same transaction as late rows (see ROLLUP_MARK_DIRTY_QUERY).
+        """
+        with self._lock:
+            for table, bucket_start in self.dirty_targets(earliest_timestamp):
+                watermark = self._watermarks.get(table)
+                if watermark is not None and bucket_start < watermark:
+                    key = (table, pack_id)
+                    self._dirty[key] = min(self._dirty.get(key, bucket_start), bucket_start)
+
+    def run(self):
+        app.logger.info(f"Rollup worker started (every {self.interval}s).")
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                app.logger.error(f"Error in rollup worker: {e}", exc_info=True)
+            self._stop_event.wait(self.interval)
+        app.logger.info("Rollup worker stopped.")
+
+    def run_once(self):
+        """Bring every rollup level up to date, rebuild dirty packs, then apply retention."""
+        conn = None
+        cursor = None
+        try:
+            conn = get_db_connection()
+            if not conn:
+                app.logger.error("Failed to get DB connection for rollup worker.")
+                return
+            cursor = conn.cursor()
+            if not cell_aggregates.loaded:
+                # Startup could not reach the DB; load the dashboard aggregates here, not from a request.
+                cell_aggregates.load()
+            if not self._watermarks_loaded:
+                cursor.execute("SELECT table_name, rolled_up_to FROM voltage_rollup_state")
+                with self._lock:
+                    for table, rolled_up_to in cursor.fetchall():
+                        self._watermarks.setdefault(table, rolled_up_to)
+                self._watermarks_loaded = True
+
+            # Raw rows are rolled up once the rows ending their holds are in as well.
+            upper = datetime.now() - timedelta(seconds=ROLLUP_LATENESS_SECONDS + AVERAGE_MAX_HOLD_SECONDS)
+            for table, bucket_seconds, bucket_format, source in ROLLUP_LEVELS:
+                self._roll_up(conn, cursor, table, bucket_seconds, bucket_format, source, upper)
+                self._rebuild_dirty(conn, cursor, table, bucket_seconds, bucket_format, source)
+                # A coarser level can only be built from buckets that are final in this one.
+                upper = self.watermark(table)
+                if upper is None:
+                    break
+            self._apply_retention(conn, cursor)
+        except mariadb.Error as e:
+            app.logger.error(f"Database error in rollup worker: {e}")
+            if conn:
+                try:
+                    conn.rollback()
+                except mariadb.Error as rb_err:
+                    app.logger.error(f"Error during rollback: {rb_err}")
+        finally:
+            close_db_resources(cursor, conn, 'RollupWorker.run_once')
+
+    def _build_chunk(self, cursor, table, bucket_format, source, chunk_start, chunk_end, pack_id=None):
+        """(Re)build the buckets of [chunk_start, chunk_end) of one pack, or of every pack if pack_id is None."""
+        pack_filter = 'pack_id = %s AND ' if pack_id is not None else ''
+        pack_params = (pack_id,) if pack_id is not None else ()
+        if source == 'voltage_readings':
+            # The holds of a chunk's last rows end at rows after it (time-weighted averages).
+            select = f"""
+                SELECT pack_id, cell_number, DATE_FORMAT(timestamp, %s) AS bucket,
+                       MIN(voltage), MAX(voltage), SUM(voltage), COUNT(voltage), SUM(voltage * hold), SUM(hold)
+                FROM ({HELD_READINGS_SQL.format(where_clause=f'WHERE {pack_filter}timestamp >= %s AND timestamp < %s AND voltage IS NOT NULL')}) AS held
+                WHERE timestamp < %s
+                GROUP BY pack_id, cell_number, bucket
+            """
+            params = (bucket_format, *HELD_READINGS_PARAMS, *pack_params, chunk_start,
+                      chunk_end + timedelta(seconds=AVERAGE_MAX_HOLD_SECONDS), chunk_end)
+        else:
+            select = f"""
+                SELECT pack_id, cell_number, DATE_FORMAT(bucket_start, %s) AS bucket,
+                       MIN(min_voltage), MAX(max_voltage), SUM(sum_voltage), SUM(sample_count), SUM(weighted_sum), SUM(weight_seconds)
+                FROM {source}
+                WHERE {pack_filter}bucket_start >= %s AND bucket_start < %s
+                GROUP BY pack_id, cell_number, bucket
+            """
+            params = (bucket_format, *pack_params, chunk_start, chunk_end)
+        cursor.execute(f"""
+            INSERT INTO {table} (pack_id, cell_number, bucket_start, min_voltage, max_voltage, sum_voltage, sample_count,
+                                 weighted_sum, weight_seconds)
+            {select}
+            ON DUPLICATE KEY UPDATE
+                min_voltage = VALUES(min_voltage),
+                max_voltage = VALUES(max_voltage),
+                sum_voltage = VALUES(sum_voltage),
+                sample_count = VALUES(sample_count),
+                weighted_sum = VALUES(weighted_sum),
+                weight_seconds = VALUES(weight_seconds)
+        """, params)
+
+    @staticmethod
+    def _chunk_end(chunk_start, upper, bucket_seconds):
+        return min(upper, floor_to_bucket(chunk_start + timedelta(seconds=bucket_seconds * ROLLUP_CHUNK_BUCKETS), bucket_seconds))
+
+    def _roll_up(self, conn, cursor, table, bucket_seconds, bucket_format, source, upper):
+        watermark = self.watermark(table)
+        if watermark is None:
+            time_column = 'timestamp' if source == 'voltage_readings' else 'bucket_start'
+            cursor.execute(f"SELECT MIN({time_column}) FROM {source}")
+            first = cursor.fetchone()[0]
+            if first is None:
+                return
+            watermark = floor_to_bucket(first, bucket_seconds)
+        upper = floor_to_bucket(upper, bucket_seconds)
+
+        while watermark < upper and not self._stop_event.is_set():
+            chunk_end = self._chunk_end(watermark, upper, bucket_seconds)
+            self._build_chunk(cursor, table, bucket_format, source, watermark, chunk_end)
+            cursor.execute("""
+                INSERT INTO voltage_rollup_state (table_name, rolled_up_to) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE rolled_up_to = VALUES(rolled_up_to)
+            """, (table, chunk_end))
+            conn.commit()
+            with self._lock:
+                self._watermarks[table] = chunk_end
+            watermark = chunk_end
+
+    def _rebuild_dirty(self, conn, cursor, table, bucket_seconds, bucket_format, source):
+        """Rebuild the rolled-up buckets of packs that received late rows, pack by pack."""
+        cursor.execute("SELECT table_name, pack_id, dirty_since, marked_at FROM voltage_rollup_dirty")
+        markers = cursor.fetchall()
+        with self._lock:
+            for marked_table, pack_id, dirty_since, _ in markers:
+                key = (marked_table, int(pack_id))
+                self._dirty[key] = min(self._dirty.get(key, dirty_since), dirty_since)
+        # A pack's buckets are only rebuilt once the level they are built from is final for that pack.
+        source_dirty = {int(pack_id) for marked_table, pack_id, _, _ in markers if marked_table == source}
+        watermark = self.watermark(table)
+        for marked_table, pack_id, dirty_since, marked_at in markers:
+            pack_id = int(pack_id)
+            if marked_table != table or pack_id in source_dirty:
+                continue
+            chunk_start = dirty_since
+            while watermark is not None and chunk_start < watermark and not self._stop_event.is_set():
+                chunk_end = self._chunk_end(chunk_start, watermark, bucket_seconds)
+                self._build_chunk(cursor, table, bucket_format, source, chunk_start, chunk_end, pack_id)
+                conn.commit()
+                chunk_start = chunk_end
+            if self._stop_event.is_set():
+                return
+            # Rows committed meanwhile re-marked the pack (new marked_at); that marker must stay.
+            cursor.execute(
+                "DELETE FROM voltage_rollup_dirty WHERE table_name = %s AND pack_id = %s AND marked_at = %s",
+                (table, pack_id, marked_at)
+            )
+            cleared = cursor.rowcount
+            conn.commit()
+            if cleared:
+                app.logger.info(f"Rebuilt {table} of pack {pack_id} from {dirty_since.isoformat()} after late rows.")
+                with self._lock:
+                    if self._dirty.get((table, pack_id), dirty_since) >= dirty_since:
+                        self._dirty.pop((table, pack_id), None)
+
+    def _apply_retention(self, conn, cursor):
+        for table, days in RETENTION_DAYS.items():
+            if not days:
+                continue
+            # Never delete rows the next level has not absorbed yet.
+            rolled_into = next((level[0] for level in ROLLUP_LEVELS if level[3] == table), None)
+            safe_until = self.final_until(rolled_into) if rolled_into else None
+            if rolled_into and safe_until is None:
+                continue
+            cutoff = datetime.now() - timedelta(days=days)
+            if safe_until is not None:
+                cutoff = min(cutoff, safe_until)
+            if table == 'voltage_readings' and archive_worker.enabled:
+                # Nor raw rows whose day has not been archived yet.
+                archived_until = archive_worker.archived_until()
+                if archived_until is None:
+                    continue
+                cutoff = min(cutoff, archived_until)
+                # Nor rows of archived days that received late rows and wait to be archived again.
+                cursor.execute("SELECT MIN(day) FROM voltage_archive_dirty")
+                dirty_since = cursor.fetchone()[0]
+                if dirty_since is not None:
+                    cutoff = min(cutoff, datetime.combine(dirty_since, datetime.min.time()))
+            time_column = 'timestamp' if table == 'voltage_readings' else 'bucket_start'
+
+            deleted_total = 0
+            for _ in range(RETENTION_MAX_BATCHES_PER_RUN):
+                if table == 'voltage_readings':
+                    deleted = self._delete_raw_batch(conn, cursor, cutoff)
+                else:
+                    cursor.execute(f"DELETE FROM {table} WHERE {time_column} < %s LIMIT %s", (cutoff, RETENTION_DELETE_BATCH_ROWS))
+                    deleted = cursor.rowcount
+                    conn.commit()
+                deleted_total += max(deleted, 0)
+                if deleted < RETENTION_DELETE_BATCH_ROWS or self._stop_event.wait(RETENTION_BATCH_PAUSE_SECONDS):
+                    break
+            if deleted_total:
+                app.logger.info(f"Retention removed {deleted_total} rows older than {cutoff.isoformat()} from {table}.")
+
+    def _delete_raw_batch(self, conn, cursor, cutoff):
+        """Delete one batch of voltage_readings and take its rows out of voltage_cell_summary.
+
+        Counts, sums and holds shrink with the deleted rows, so /api/dashboard describes the rows
+        still stored. min_voltage / max_voltage stay the extremes ever seen: finding the new ones
+        would need a scan of every remaining row of the cell.
+        """
+        # Oldest first, so each cell's deleted rows are consecutive and each one's hold ends at the next.
+        cursor.execute(
+            "SELECT id, pack_id, cell_number, voltage, timestamp FROM voltage_readings WHERE timestamp < %s ORDER BY timestamp LIMIT %s",
+            (cutoff, RETENTION_DELETE_BATCH_ROWS)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return 0
+        by_cell = {}
+        for _, pack_id, cell, voltage, timestamp in rows:
+            if voltage is not None:
+                by_cell.setdefault((int(pack_id), int(cell)), []).append((float(voltage), timestamp))
+        ids = [row[0] for row in rows]
+        if not by_cell:
+            cursor.execute(f"DELETE FROM voltage_readings WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+            deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+        committed_deltas = None
+        cell_aggregates.begin_write()
+        try:
+            cursor.execute(f"DELETE FROM voltage_readings WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+            deleted = cursor.rowcount
+            # The hold of a cell's last deleted row ends at its first remaining row. Every row older than
+            # the batch's newest one is gone now, so that is the cell's first row from there on: one range
+            # scan over the longest hold finds it for all cells that are still reporting.
+            newest = rows[-1][4]
+            cursor.execute(
+                "SELECT pack_id, cell_number, MIN(timestamp) FROM voltage_readings "
+                "WHERE timestamp >= %s AND timestamp <= %s AND voltage IS NOT NULL GROUP BY pack_id, cell_number",
+                (newest, newest + timedelta(seconds=AVERAGE_MAX_HOLD_SECONDS))
+            )
+            successors = {(int(pack_id), int(cell)): timestamp for pack_id, cell, timestamp in cursor.fetchall()}
+            deltas = {}
+            for key, cell_rows in by_cell.items():
+                successor = successors.get(key)
+                if successor is None:
+                    # Stopped reporting (or paused longer than a hold); any later row still ends the hold.
+                    cursor.execute(
+                        "SELECT MIN(timestamp) FROM voltage_readings WHERE pack_id = %s AND cell_number = %s AND timestamp > %s AND voltage IS NOT NULL",
+                        (*key, cell_rows[-1][1])
+                    )
+                    successor = cursor.fetchone()[0]
+                next_timestamps = [row[1] for row in cell_rows[1:]] + [successor]
+                delta = deltas[key] = {'reading_count': 0, 'nonzero_count': 0, 'nonzero_sum': 0.0,
+                                       'min_voltage': None, 'max_voltage': None, 'last_timestamp': None,
+                                       'held_sum': 0.0, 'held_seconds': 0.0, 'last_voltage': None}
+                for (voltage, timestamp), next_timestamp in zip(cell_rows, next_timestamps):
+                    delta['reading_count'] -= 1
+                    if voltage > 0:
+                        delta['nonzero_count'] -= 1
+                        delta['nonzero_sum'] -= voltage
+                        if next_timestamp is not None:  # Without a successor the value was never held
+                            hold = hold_seconds(timestamp, next_timestamp)
+                            delta['held_sum'] -= voltage * hold
+                            delta['held_seconds'] -= hold
+            cursor.executemany(SUMMARY_RETENTION_QUERY, [
+                (-d['reading_count'], -d['nonzero_count'], -d['nonzero_sum'], -d['held_sum'], -d['held_seconds'], pack_id, cell)
+                for (pack_id, cell), d in deltas.items()
+            ])
+            conn.commit()
+            committed_deltas = deltas
+        finally:
+            cell_aggregates.end_write(committed_deltas)
+        return deleted
+
+
+rollup_worker = RollupWorker()
+
+ARCHIVE_COLUMNS = (('timestamp_us', 'int64'), ('cell', 'uint16'), ('voltage', 'float32'))
+
+def archive_partition_path(pack_id, day, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"pack_{pack_id}", day.strftime('%Y-%m-%d'))
+
+
+class ArchiveWorker(threading.Thread):
+    """Background job that compacts finished days of voltage_readings into columnar partitions.
+
+    A partition is written under a temporary name and renamed into place, so a partition directory
+    that exists is complete. Rows written later for an archived day (spool replay, late remote
+    batches) mark it in voltage_archive_dirty in the same transaction; the next run rewrites that
+    partition, and retention keeps the day's raw rows until then. archived_until() tells retention
+    how far raw rows may be deleted.
+    """
+
+    def __init__(self, archive_dir=ARCHIVE_DIR, interval=ARCHIVE_INTERVAL_SECONDS):
+        super().__init__(name='ArchiveWorker', daemon=True)
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.enabled = ARCHIVE_ENABLED and NUMPY_AVAILABLE
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._archived_until = None
+        self.partitions_written = 0
+        self.rows_written = 0
+        self.last_error = None
+
+    def ensure_started(self):
+        if self.enabled and self.ident is None:
+            self.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def archived_until(self):
+        """Return the datetime before which every pack's days are archived, or None if not known yet."""
+        with self._lock:
+            return self._archived_until
+
+    def run(self):
+        app.logger.info(f"Archive worker started (every {self.interval}s, into {self.archive_dir}).")
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                app.logger.error(f"Error in archive worker: {e}", exc_info=True)
+            self._stop_event.wait(self.interval)
+        app.logger.info("Archive worker stopped.")
+
+    def run_once(self):
+        """Rewrite days marked dirty, then archive every finished day that has no partition yet.
+
+        Both together write at most ARCHIVE_MAX_PARTITIONS_PER_RUN partitions.
+        """
+        conn = None
+        cursor = None
+        try:
+            conn = get_db_connection()
+            if not conn:
+                app.logger.error("Failed to get DB connection for archive worker.")
+                return
+            cursor = conn.cursor()
+            # One probe per pack on idx_pack_timestamp.
+            cursor.execute("SELECT pack_id, MIN(timestamp) FROM voltage_readings GROUP BY pack_id")
+            first_rows = cursor.fetchall()
+            cursor.execute("SELECT pack_id, day, marked_at FROM voltage_archive_dirty ORDER BY day")
+            dirty = cursor.fetchall()
+
+            archive_before = floor_to_bucket(datetime.now() - timedelta(seconds=ARCHIVE_LATENESS_SECONDS), 86400)
+            archived_until = archive_before
+            written = 0
+            for pack_id, day, marked_at in dirty:
+                day = datetime.combine(day, datetime.min.time())
+                if written >= ARCHIVE_MAX_PARTITIONS_PER_RUN or self._stop_event.is_set():
+                    archived_until = min(archived_until, day)
+                    break
+                if os.path.isdir(archive_partition_path(pack_id, day, self.archive_dir)):
+                    self._archive_day(conn, pack_id, day)
+                    written += 1
+                # Unless newer late rows marked the day again while it was being rewritten.
+                cursor.execute(
+                    "DELETE FROM voltage_archive_dirty WHERE pack_id = %s AND day = %s AND marked_at = %s",
+                    (pack_id, day.date(), marked_at)
+                )
+                conn.commit()
+            cursor.close()
+            cursor = None
+
+            for pack_id, first_timestamp in first_rows:
+                pack_dir = os.path.dirname(archive_partition_path(pack_id, archive_before, self.archive_dir))
+                existing = set(os.listdir(pack_dir)) if os.path.isdir(pack_dir) else set()
+                day = floor_to_bucket(first_timestamp, 86400)
+                while day < archive_before:
+                    if day.strftime('%Y-%m-%d') not in existing:
+                        if written >= ARCHIVE_MAX_PARTITIONS_PER_RUN or self._stop_event.is_set():
+                            break
+                        self._archive_day(conn, pack_id, day)
+                        written += 1
+                    day += timedelta(days=1)
+                archived_until = min(archived_until, day)
+            with self._lock:
+                self._archived_until = archived_until
+            self.last_error = None
+            if written:
+                app.logger.info(f"Archived {written} day partitions. Raw rows are archived up to {archived_until.isoformat()}.")
+        except mariadb.Error as e:
+            self.last_error = str(e)
+            app.logger.error(f"Database error in archive worker: {e}")
+        finally:
+            close_db_resources(cursor, conn, 'ArchiveWorker.run_once')
+
+    def _archive_day(self, conn, pack_id, day):
+        """Read one pack's day from MariaDB and write it as a partition."""
+        chunks = {name: [] for name, _ in ARCHIVE_COLUMNS}
+        # Unbuffered: a day of a large pack is read in batches instead of as one result set.
+        cursor = conn.cursor(buffered=False)
+        try:
+            cursor.execute(
+                "SELECT timestamp, cell_number, voltage FROM voltage_readings WHERE pack_id = %s AND timestamp >= %s AND timestamp < %s",
+                (pack_id, day, day + timedelta(days=1))
+            )
+            while True:
+                rows = cursor.fetchmany(ARCHIVE_FETCH_BATCH_ROWS)
+                if not rows:
+                    break
+                chunks['timestamp_us'].append(np.fromiter((reading_seq(row[0]) for row in rows), dtype=np.int64, count=len(rows)))
+                chunks['cell'].append(np.fromiter((row[1] for row in rows), dtype=np.uint16, count=len(rows)))
+                chunks['voltage'].append(np.fromiter(
+                    (float(row[2]) if row[2] is not None else np.nan for row in rows), dtype=np.float32, count=len(rows)))
+        finally:
+            cursor.close()
+
+        columns = {name: np.concatenate(chunks[name]) if chunks[name] else np.zeros(0, dtype=dtype) for name, dtype in ARCHIVE_COLUMNS}
+        # Sort by cell, then time (the SQL side stays a plain index range scan without a filesort).
+        order = np.lexsort((columns['timestamp_us'], columns['cell']))
+        columns = {name: column[order] for name, column in columns.items()}
+        cells, starts, counts = np.unique(columns['cell'], return_index=True, return_counts=True)
+        index = {
+            'pack_id': pack_id,
+            'day': day.strftime('%Y-%m-%d'),
+            'rows': int(len(order)),
+            'cells': {str(int(cell)): [int(start), int(start + count)] for cell, start, count in zip(cells, starts, counts)},
+            'created_at': datetime.now().isoformat(),
+        }
+
+        final_path = archive_partition_path(pack_id, day, self.archive_dir)
+        temp_path = os.path.join(os.path.dirname(final_path), f".{index['day']}.tmp")
+        old_path = os.path.join(os.path.dirname(final_path), f".{index['day']}.old")
+        for leftover in (temp_path, old_path):
+            if os.path.exists(leftover):
+                shutil.rmtree(leftover) # Left over from an interrupted run
+        os.makedirs(temp_path)
+        for name, _ in ARCHIVE_COLUMNS:
+            np.save(os.path.join(temp_path, f"{name}.npy"), columns[name])
+        with open(os.path.join(temp_path, 'index.json'), 'w') as f:
+            json.dump(index, f)
+        if os.path.exists(final_path):
+            # Rewriting a dirty day; readers that already memory-mapped the old files keep them.
+            os.rename(final_path, old_path)
+        os.rename(temp_path, final_path)
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        self.partitions_written += 1
+        self.rows_written += index['rows']
+        metric_archive_rows.inc(amount=index['rows'])
+
+    def stats(self):
+        archived_until = self.archived_until()
+        return {
+            'enabled': self.enabled,
+            'archive_dir': self.archive_dir,
+            'archived_until': archived_until.isoformat() if archived_until else None,
+            'partitions_written': self.partitions_written,
+            'rows_written': self.rows_written,
+            'last_error': self.last_error,
+        }
+
+
+archive_worker = ArchiveWorker()
+if ARCHIVE_ENABLED and not NUMPY_AVAILABLE:
+    app.logger.warning("numpy not available. The columnar archive is disabled.")
+
+def open_archive_partition(pack_id, day, archive_dir=ARCHIVE_DIR):
+    """Memory-map one archived day. Returns (index, {column: read-only array}) or None if not archived."""
+    path = archive_partition_path(pack_id, day, archive_dir)
+    if not os.path.isdir(path):
+        return None
+    with open(os.path.join(path, 'index.json')) as f:
+        index = json.load(f)
+    columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name, _ in ARCHIVE_COLUMNS}
+    return index, columns
+
+def read_archive_range(pack_id, start, end, cells=None, archive_dir=ARCHIVE_DIR):
+    """Read a pack's archived rows with start <= timestamp < end, without touching MariaDB.
+
+    Returns (slices, missing_days): slices is a list of {column: array} views into the memory-mapped
+    partitions, one per day and cell, in day then cell order (no data is copied). missing_days lists
+    the days in the range that are not archived (yet).
+    """
+    start_us, end_us = reading_seq(start), reading_seq(end)
+    slices = []
+    missing_days = []
+    day = floor_to_bucket(start, 86400)
+    while day < end:
+        partition = open_archive_partition(pack_id, day, archive_dir)
+        if partition is None:
+            missing_days.append(day.strftime('%Y-%m-%d'))
+        else:
+            index, columns = partition
+            for cell, (row_start, row_stop) in sorted(index['cells'].items(), key=lambda item: int(item[0])):
+                if cells and int(cell) not in cells:
+                    continue
+                timestamps = columns['timestamp_us'][row_start:row_stop]
+                lo = row_start + int(np.searchsorted(timestamps, start_us, side='left'))
+                hi = row_start + int(np.searchsorted(timestamps, end_us, side='left'))
+                if hi > lo:
+                    slices.append({name: column[lo:hi] for name, column in columns.items()})
+        day += timedelta(days=1)
+    return slices, missing_days
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable file object that collects written bytes for a streaming response."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_archive_export(slices):
+    """Yield a compressed .npz (timestamp_us, cell, voltage columns) of the given archive slices.
+
+    Each column is written as one .npy member whose header is computed up front, so the export is
+    streamed slice by slice and memory stays flat for any range.
+    """
+    total_rows = sum(len(item['cell']) for item in slices)
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        for name, dtype in ARCHIVE_COLUMNS:
+            with archive.open(f"{name}.npy", 'w', force_zip64=True) as member:
+                np.lib.format.write_array_header_1_0(member, {
+                    'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                    'fortran_order': False,
+                    'shape': (total_rows,),
+                })
+                for item in slices:
+                    column = item[name]
+                    for offset in range(0, len(column), ARCHIVE_EXPORT_CHUNK_ROWS):
+                        member.write(np.ascontiguousarray(column[offset:offset + ARCHIVE_EXPORT_CHUNK_ROWS]).data)
+                        data = sink.take()
+                        if data:
+                            yield data
+    yield sink.take()
+
+
+def next_bucket_start(dt, bucket_seconds):
+    """Return the first minute, hour or day bucket boundary at or after a local datetime."""
+    floored = floor_to_bucket(dt, bucket_seconds)
+    if floored == dt:
+        return dt
+    return floored + (timedelta(days=1) if bucket_seconds >= 86400 else timedelta(seconds=bucket_seconds))
+
+def rollup_level_fits(level_seconds, bucket_seconds, origin, start, end):
+    """True if every rollup bucket of the level in [start, end) lies inside one requested bucket.
+
+    Requested buckets are bucket_seconds wide on a grid starting at Unix time `origin`, while rollup
+    buckets start at local minute, hour or midnight boundaries. A level therefore only fits when
+    bucket_seconds is a multiple of it and its boundaries sit on the grid, which depends on the
+    server's UTC offset and, for days, on DST changes inside the range.
+    """
+    if bucket_seconds % level_seconds:
+        return False
+    if level_seconds < 86400:
+        # Local minutes / hours are a fixed UTC offset away from Unix ones; check it at both ends (DST).
+        return all((floor_to_bucket(moment, level_seconds).timestamp() - origin) % level_seconds == 0
+                   for moment in (start, end - timedelta(microseconds=1)))
+    day = start
+    while day < end:
+        next_day = day + timedelta(days=1)
+        if (day.timestamp() - origin) // bucket_seconds != (next_day.timestamp() - 1 - origin) // bucket_seconds:
+            return False
+        day = next_day
+    return True
+
+def choose_bucket_source(bucket_seconds, start, end, origin=0, pack_id=LOCAL_PACK_ID):
+    """Pick the coarsest rollup that covers part of [start, end) and whose buckets fit the requested grid.
+
+    Returns (table, rollup_start, rollup_end): the rollup answers [rollup_start, rollup_end), both on its
+    bucket boundaries, and the rest of the range comes from voltage_readings. table is
+    'voltage_readings' (bounds None) if no rollup qualifies.
+    """
+    for table, level_seconds, _, _ in reversed(ROLLUP_LEVELS):
+        watermark = rollup_worker.final_until(table, pack_id)
+        if watermark is None:
+            continue
+        rollup_start = next_bucket_start(start, level_seconds)
+        rollup_end = floor_to_bucket(min(end, watermark), level_seconds)
+        if rollup_start < rollup_end and rollup_level_fits(level_seconds, bucket_seconds, origin, rollup_start, rollup_end):
+            return table, rollup_start, rollup_end
+    return 'voltage_readings', None, None
+
+def downsample_grid(start, end, points):
+    """Choose (bucket_seconds, origin) so that [start, end) spans at most `points` buckets.
+
+    Buckets of a minute or longer are rounded up to whole minutes, hours or days, and the grid is
+    counted from the Unix epoch, so rollups can answer them (see rollup_level_fits). An epoch-aligned
+    grid can cut the range into one more bucket than range / bucket_seconds; the size then grows
+    until the count fits. A single point is one bucket starting at `start`.
+    """
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    span = end_ts - start_ts
+    if points == 1:
+        return max(1, math.ceil(span)), start_ts
+    bucket_seconds = max(1, math.ceil(span / points))
+    while True:
+        for level_seconds in (86400, 3600, 60):
+            if bucket_seconds > level_seconds:
+                bucket_seconds = math.ceil(bucket_seconds / level_seconds) * level_seconds
+                break
+        # Buckets touched by [start, end): the first and the last one both count.
+        if math.ceil(end_ts / bucket_seconds) - math.floor(start_ts / bucket_seconds) <= points:
+            return bucket_seconds, 0
+        bucket_seconds = max(bucket_seconds + 1, math.ceil(span / (points - 1)))
+
+def get_voltage_buckets(start, end, bucket_seconds, cells=None, pack_id=LOCAL_PACK_ID, origin=0):
+    """Aggregate a pack's readings in [start, end) into fixed time buckets per cell, inside the database.
+
+    Buckets are bucket_seconds wide, counted from Unix time `origin`. The whole buckets of the coarsest
+    fitting rollup (see choose_bucket_source) are read from that rollup, the partial ones at either end
+    and everything after its watermark from voltage_readings. Returns (rows, sources), where rows are
+    (cell_number, bucket, min_voltage, avg_voltage, max_voltage, samples), avg_voltage time-weighted
+    (see AVERAGE_MAX_HOLD_SECONDS), and origin + bucket * bucket_seconds is the bucket start as a Unix
+    timestamp. Returns (None, sources) on a DB error.
+    """
+    source, rollup_start, rollup_end = choose_bucket_source(bucket_seconds, start, end, origin, pack_id)
+    if rollup_start is None:
+        segments = [('voltage_readings', start, end)]
+    else:
+        segments = [(source, rollup_start, rollup_end)]
+        if start < rollup_start:
+            segments.insert(0, ('voltage_readings', start, rollup_start))
+        if rollup_end < end:
+            segments.append(('voltage_readings', rollup_end, end))
+    sources = list(dict.fromkeys(segment[0] for segment in segments))
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            app.logger.error("Failed to get DB connection for get_voltage_buckets.")
+            return None, sources
+
+        cursor = conn.cursor()
+        merged = {}
+        for table, segment_start, segment_end in segments:
+            if table == 'voltage_readings':
+                # Rows after the segment end the holds of its last rows (time-weighted averages).
+                lookahead_end = segment_end + timedelta(seconds=AVERAGE_MAX_HOLD_SECONDS)
+                where_clause, params = build_reading_filters(segment_start, lookahead_end, cells, end_inclusive=False, pack_id=pack_id)
+                cursor.execute(f"""
+                    SELECT cell_number, FLOOR((UNIX_TIMESTAMP(timestamp) - %s) / %s) AS bucket,
+                           MIN(voltage), MAX(voltage), SUM(voltage * hold), SUM(hold), COUNT(voltage)
+                    FROM ({HELD_READINGS_SQL.format(where_clause=where_clause + ' AND voltage IS NOT NULL')}) AS held
+                    WHERE timestamp < %s
+                    GROUP BY cell_number, bucket
+                """, (origin, bucket_seconds, *HELD_READINGS_PARAMS, *params, segment_end))
+            else:
+                where_clause, params = build_reading_filters(segment_start, segment_end, cells, 'bucket_start', end_inclusive=False, pack_id=pack_id)
+                cursor.execute(f"""
+                    SELECT cell_number, FLOOR((UNIX_TIMESTAMP(bucket_start) - %s) / %s) AS bucket,
+                           MIN(min_voltage), MAX(max_voltage), SUM(weighted_sum), SUM(weight_seconds), SUM(sample_count)
+                    FROM {table}
+                    {where_clause}
+                    GROUP BY cell_number, bucket
+                """, (origin, bucket_seconds, *params))
+            # A bucket straddling a segment boundary gets rows from both segments; merge them.
+            for cell_number, bucket, min_voltage, max_voltage, weighted_sum, weight_seconds, samples in cursor.fetchall():
+                key = (int(cell_number), int(bucket))
+                samples = int(samples or 0)
+                weighted_sum = float(weighted_sum or 0)
+                weight_seconds = float(weight_seconds or 0)
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = [min_voltage, max_voltage, weighted_sum, weight_seconds, samples]
+                    continue
+                current[0] = combine_optional(min, current[0], min_voltage)
+                current[1] = combine_optional(max, current[1], max_voltage)
+                current[2] += weighted_sum
+                current[3] += weight_seconds
+                current[4] += samples
+
+        rows = []
+        for (cell, bucket), (min_voltage, max_voltage, weighted_sum, weight_seconds, samples) in sorted(merged.items()):
+            avg_voltage = weighted_sum / weight_seconds if weight_seconds else None
+            rows.append((cell, bucket, min_voltage, avg_voltage, max_voltage, samples))
+        return rows, sources
+    except mariadb.Error as e:
+        app.logger.error(f"Database query error in get_voltage_buckets: {e}")
+        return None, sources
+    finally:
+        close_db_resources(cursor, conn, 'get_voltage_buckets')
+
+def parse_cells_param(name='cells'):
+    """Parse an optional comma-separated list of cell numbers, e.g. cells=1,2,5."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        cells = sorted({int(part) for part in value.split(',') if part.strip()})
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' parameter '{value}'. Expected comma-separated cell numbers.")
+    if any(cell < 1 for cell in cells):
+        raise ValueError(f"Invalid '{name}' parameter '{value}'. Cell numbers start at 1.")
+    return cells or None
+
+def parse_ingest_timestamp(value):
+    """Parse a frame timestamp: ISO-8601 string or Unix seconds. Returns a naive local datetime like the sampler's."""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"Invalid frame timestamp {value!r}.")
+    if isinstance(value, str):
+        timestamp = datetime.fromisoformat(value)
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+        return timestamp
+    return datetime.fromtimestamp(value)
+
+def parse_ingest_frames(payload):
+    """Validate an /api/ingest payload and return {pack_id: [(seq, cell, voltage, timestamp), ...]}.
+
+    Rows repeated within the payload (same pack, seq and cell) are collapsed. Raises ValueError.
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('frames'), list):
+        raise ValueError("Expected a JSON object with a 'frames' list.")
+    frames = payload['frames']
+    if len(frames) > INGEST_MAX_FRAMES:
+        raise ValueError(f"Too many frames ({len(frames)}). At most {INGEST_MAX_FRAMES} per request.")
+
+    rows = {}
+    for index, frame in enumerate(frames):
+        if not isinstance(frame, dict):
+            raise ValueError(f"Frame {index} is not an object.")
+        pack_id = frame.get('pack_id', payload.get('pack_id'))
+        if isinstance(pack_id, bool) or not isinstance(pack_id, int) or not 0 <= pack_id <= MAX_PACK_ID:
+            raise ValueError(f"Frame {index}: 'pack_id' must be an integer from 0 to {MAX_PACK_ID}.")
+        if pack_id == LOCAL_PACK_ID:
+            raise ValueError(f"Frame {index}: pack_id {LOCAL_PACK_ID} is reserved for this node's own cells.")
+        try:
+            timestamp = parse_ingest_timestamp(frame.get('timestamp'))
+        except (ValueError, OverflowError, OSError):
+            raise ValueError(f"Frame {index}: invalid 'timestamp' {frame.get('timestamp')!r}.")
+        seq = frame.get('seq', reading_seq(timestamp))
+        if isinstance(seq, bool) or not isinstance(seq, int) or not 0 <= seq < 2 ** 64:
+            raise ValueError(f"Frame {index}: 'seq' must be a non-negative integer.")
+        voltages = frame.get('voltages')
+        if not isinstance(voltages, list) or len(voltages) > INGEST_MAX_CELLS_PER_FRAME:
+            raise ValueError(f"Frame {index}: 'voltages' must be a list of at most {INGEST_MAX_CELLS_PER_FRAME} values.")
+        cells = frame.get('cells', range(1, len(voltages) + 1))
+        if not isinstance(cells, (list, range)) or len(cells) != len(voltages):
+            raise ValueError(f"Frame {index}: 'cells' must list one cell number per voltage.")
+
+        for cell, voltage in zip(cells, voltages):
+            if isinstance(cell, bool) or not isinstance(cell, int) or not 1 <= cell <= INGEST_MAX_CELLS_PER_FRAME:
+                raise ValueError(f"Frame {index}: invalid cell number {cell!r}.")
+            if voltage is None:
+                continue # Failed read on the sampler; not stored, as for local I2C errors
+            if isinstance(voltage, bool) or not isinstance(voltage, (int, float)) or not 0 <= voltage < 100:
+                raise ValueError(f"Frame {index}: invalid voltage {voltage!r} for cell {cell}.")
+            rows.setdefault(pack_id, {})[(seq, cell)] = (seq, cell, round(float(voltage), 3), timestamp)
+    return {pack_id: list(pack_rows.values()) for pack_id, pack_rows in rows.items()}
+
+def parse_pack_param(name='pack'):
+    """Parse the optional pack id query parameter. Defaults to LOCAL_PACK_ID."""
+    value = request.args.get(name)
+    if not value:
+        return LOCAL_PACK_ID
+    try:
+        pack_id = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' parameter '{value}'. Expected a pack id.")
+    if not 0 <= pack_id <= MAX_PACK_ID:
+        raise ValueError(f"Invalid '{name}' parameter '{value}'. Pack ids range from 0 to {MAX_PACK_ID}.")
+    return pack_id
+
+def parse_cursor_param(name):
+    """Parse an optional history page cursor: 'ISO-8601 timestamp,id' or a bare ISO-8601 timestamp."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    timestamp_part, _, id_part = value.rpartition(',')
+    if not timestamp_part:
+        timestamp_part, id_part = value, None
+    try:
+        return datetime.fromisoformat(timestamp_part), int(id_part) if id_part is not None else None
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' parameter '{value}'. Expected 'timestamp,id' or an ISO-8601 timestamp.")
+
+UNENCODED_PLUS_OFFSET = re.compile(r'(\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?) (\d{2}:\d{2})$')
+
+def parse_datetime_param(name):
+    """Parse an optional ISO-8601 query parameter into a naive local datetime like the stored timestamps.
+
+    Values with a UTC offset (or Z) are converted to local time. An unencoded '+' in the offset
+    arrives as a space and is accepted too. Raises ValueError with a readable message.
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    value = UNENCODED_PLUS_OFFSET.sub(r'\1+\2', value)  # "...T10:00:00 02:00" was "...T10:00:00+02:00"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' parameter '{value}'. Expected an ISO-8601 timestamp.")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+def load_alert_rules(path=ALERT_RULES_FILE):
+    """Load and normalize alert rules. Falls back to DEFAULT_ALERT_RULES. Raises ValueError on an invalid rule."""
+    if os.path.exists(path):
+        with open(path) as f:
+            raw_rules = json.load(f)
+    else:
+        raw_rules = DEFAULT_ALERT_RULES
+
+    rules = []
+    names = set()
+    for raw in raw_rules:
+        rule = dict(raw)
+        name = rule.get('name')
+        if not name or name in names:
+            raise ValueError(f"Alert rules: every rule needs a unique 'name', got {name!r}.")
+        names.add(name)
+        rule.setdefault('severity', 'warning')
+        if rule['severity'] not in ALERT_SEVERITIES:
+            raise ValueError(f"Alert rule '{name}': severity must be one of {', '.join(ALERT_SEVERITIES)}.")
+        rule['cells'] = [int(cell) for cell in rule['cells']] if rule.get('cells') else None
+        rule['include_zero'] = bool(rule.get('include_zero', False))
+        rule_type = rule.get('type')
+        if rule_type == 'threshold':
+            if ('above' in rule) == ('below' in rule):
+                raise ValueError(f"Alert rule '{name}': a threshold rule needs exactly one of 'above' or 'below'.")
+            rule['direction'] = 'above' if 'above' in rule else 'below'
+            rule['limit'] = float(rule[rule['direction']])
+            rule['clear'] = float(rule.get('clear', rule['limit']))
+            if (rule['direction'] == 'above' and rule['clear'] > rule['limit']) or (rule['direction'] == 'below' and rule['clear'] < rule['limit']):
+                raise ValueError(f"Alert rule '{name}': 'clear' must be on the normal side of the limit.")
+        elif rule_type == 'rate':
+            rule['limit'] = float(rule['max_volts_per_second'])
+            rule['window_seconds'] = float(rule.get('window_seconds', 10))
+        elif rule_type == 'spread':
+            rule['limit'] = float(rule['max_spread'])
+            rule['clear'] = float(rule.get('clear', rule['limit']))
+        elif rule_type == 'stale':
+            rule['limit'] = float(rule['timeout_seconds'])
+        else:
+            raise ValueError(f"Alert rule '{name}': unknown type {rule_type!r}. Expected threshold, rate, spread or stale.")
+        rules.append(rule)
+    return rules
+
+
+class AlertEngine:
+    """Evaluates alert rules incrementally on every acquisition frame.
+
+    All state (active alerts, last valid reading per cell, rate windows) lives in memory, so a
+    frame costs a few comparisons per rule and cell and never touches the database. evaluate()
+    returns only the state changes of this frame; they are queued for storage by alert_writer.
+    """
+
+    def __init__(self, rules, cells):
+        self.rules = rules
+        self.cells = list(cells)
+        self._lock = threading.Lock()
+        self._active = {}  # (rule name, cell or None) -> event that activated it
+        self._last_seen = {}  # cell -> time of the last valid reading
+        self._windows = {}  # (rule name, cell) -> deque of decimated (time, voltage) within the rate window
+        self._recent = deque(maxlen=ALERT_RECENT_EVENTS)
+        self._started = None
+        self._evaluators = {
+            'threshold': self._evaluate_threshold,
+            'rate': self._evaluate_rate,
+            'spread': self._evaluate_spread,
+            'stale': self._evaluate_stale,
+        }
+
+    def _transition(self, rule, cell, state, value, now, message, events):
+        event = {
+            'rule': rule['name'],
+            'severity': rule['severity'],
+            'cell': cell,
+            'state': state,
+            'value': round(value, 3) if value is not None else None,
+            'message': message,
+            'timestamp': datetime.fromtimestamp(now).isoformat(),
+        }
+        if state == 'active':
+            self._active[(rule['name'], cell)] = event
+        else:
+            self._active.pop((rule['name'], cell), None)
+        events.append(event)
+
+    @staticmethod
+    def _usable(rule, value):
+        return value is not None and (value != 0.0 or rule['include_zero'])
+
+    def _evaluate_threshold(self, rule, now, values, events):
+        above = rule['direction'] == 'above'
+        limit, clear = rule['limit'], rule['clear']
+        for cell in rule['cells'] or self.cells:
+            value = values.get(cell)
+            if not self._usable(rule, value):
+                continue
+            if (rule['name'], cell) in self._active:
+                if (value <= clear) if above else (value >= clear):
+                    self._transition(rule, cell, 'cleared', value, now, f"Cell {cell} voltage {value:.3f}V back within limits.", events)
+            elif (value > limit) if above else (value < limit):
+                self._transition(rule, cell, 'active', value, now, f"Cell {cell} voltage {value:.3f}V is {rule['direction']} {limit}V.", events)
+
+    def _evaluate_rate(self, rule, now, values, events):
+        window_seconds = rule['window_seconds']
+        for cell in rule['cells'] or self.cells:
+            value = values.get(cell)
+            if not self._usable(rule, value):
+                continue
+            window = self._windows.get((rule['name'], cell))
+            if window is None:
+                window = self._windows[(rule['name'], cell)] = deque()
+            # Keep one sample per window_seconds / ALERT_RATE_WINDOW_POINTS; the slope runs from the
+            # oldest kept sample to the current value, so skipping the ones in between loses nothing.
+            if not window or now - window[-1][0] >= window_seconds / ALERT_RATE_WINDOW_POINTS:
+                window.append((now, value))
+            while now - window[0][0] > window_seconds:
+                window.popleft()
+            elapsed = now - window[0][0]
+            if elapsed < window_seconds / 2:
+                continue # Not enough history yet for a meaningful slope
+            rate = (value - window[0][1]) / elapsed
+            if (rule['name'], cell) in self._active:
+                if abs(rate) <= rule['limit'] * ALERT_RATE_CLEAR_RATIO:
+                    self._transition(rule, cell, 'cleared', rate, now, f"Cell {cell} voltage change rate back to {rate:+.3f}V/s.", events)
+            elif abs(rate) > rule['limit']:
+                self._transition(rule, cell, 'active', rate, now, f"Cell {cell} voltage changing at {rate:+.3f}V/s (limit {rule['limit']}V/s).", events)
+
+    def _evaluate_spread(self, rule, now, values, events):
+        usable = [values[cell] for cell in (rule['cells'] or self.cells) if self._usable(rule, values.get(cell))]
+        if len(usable) < 2:
+            return
+        spread = max(usable) - min(usable)
+        if (rule['name'], None) in self._active:
+            if spread <= rule['clear']:
+                self._transition(rule, None, 'cleared', spread, now, f"Cell spread back to {spread:.3f}V.", events)
+        elif spread > rule['limit']:
+            self._transition(rule, None, 'active', spread, now, f"Cell spread {spread:.3f}V exceeds {rule['limit']}V.", events)
+
+    def _evaluate_stale(self, rule, now, values, events):
+        for cell in rule['cells'] or self.cells:
+            last_seen = self._last_seen.get(cell, self._started)
+            age = now - last_seen
+            if (rule['name'], cell) in self._active:
+                if age <= rule['limit']:
+                    self._transition(rule, cell, 'cleared', age, now, f"Cell {cell} is reporting again.", events)
+            elif age > rule['limit']:
+                self._transition(rule, cell, 'active', age, now, f"No valid reading from cell {cell} for {age:.0f}s.", events)
+
+    def evaluate(self, sample_time, readings):
+        """Evaluate every rule against one frame. Returns the alert events (state changes) it caused."""
+        started = time.perf_counter()
+        now = sample_time.timestamp()
+        values = {reading['cell']: reading['voltage'] for reading in readings}
+        events = []
+        with self._lock:
+            if self._started is None:
+                self._started = now
+            for cell, value in values.items():
+                if value is not None:
+                    self._last_seen[cell] = now
+            for rule in self.rules:
+                self._evaluators[rule['type']](rule, now, values, events)
+            self._recent.extend(events)
+        for event in events:
+            alert_writer.submit(event)
+        metric_alert_evaluate_seconds.observe(time.perf_counter() - started)
+        return events
+
+    def check_stale(self, now_time):
+        """Run only the stale rules, for when no frame arrives at all (e.g. the ADC is unreachable)."""
+        now = now_time.timestamp()
+        events = []
+        with self._lock:
+            if self._started is None:
+                self._started = now
+            for rule in self.rules:
+                if rule['type'] == 'stale':
+                    self._evaluate_stale(rule, now, {}, events)
+            self._recent.extend(events)
+        for event in events:
+            alert_writer.submit(event)
+        return events
+
+    def active(self):
+        with self._lock:
+            return sorted(self._active.values(), key=lambda event: event['timestamp'])
+
+    def recent(self, limit):
+        with self._lock:
+            return list(self._recent)[-limit:][::-1]
+
+
+class AlertWriter(threading.Thread):
+    """Stores alert events in voltage_alerts off the acquisition path.
+
+    Events stay queued while the database is unreachable and are written once it is back.
+    """
+
+    def __init__(self, max_events=ALERT_WRITE_QUEUE_MAX):
+        super().__init__(name='AlertWriter', daemon=True)
+        self._queue = queue.Queue(maxsize=max_events)
+        self._stop_event = threading.Event()
+        self.dropped = 0
+
+    def submit(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, batch):
+        conn = None
+        cursor = None
+        try:
+            conn = get_db_connection()
+            if not conn:
+                return False
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT INTO voltage_alerts (rule_name, severity, cell_number, state, value, message, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                [(e['rule'], e['severity'], e['cell'], e['state'], e['value'], e['message'][:255],
+                  datetime.fromisoformat(e['timestamp'])) for e in batch]
+            )
+            conn.commit()
+            return True
+        except mariadb.Error as e:
+            log_rate_limited('alert_write', logging.ERROR, f"Database error storing {len(batch)} alert events: {e}")
+            return False
+        finally:
+            close_db_resources(cursor, conn, 'AlertWriter._write')
+
+    def run(self):
+        pending = []
+        while not self._stop_event.is_set() or not self._queue.empty():
+            if not pending:
+                try:
+                    pending.append(self._queue.get(timeout=0.5))
+                except queue.Empty:
+                    continue
+            while len(pending) < DB_WRITE_BATCH_SIZE:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self._write(pending):
+                pending = []
+            elif self._stop_event.wait(DB_POOL_RETRY_BACKOFF_SECONDS):
+                break
+
+    def ensure_started(self):
+        """Start the writer thread once; later calls are no-ops."""
+        if self.ident is None:
+            self.start()
+
+    def stop(self, timeout=DB_WRITE_SHUTDOWN_TIMEOUT_SECONDS):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+alert_writer = AlertWriter()
+alert_engine = AlertEngine(load_alert_rules(), [entry['cell'] for entry in DEVICE_MAP])
+
+
+class SampleBroadcaster:
+    """Fan-out point for acquisition frames.
+
+    The sampler publishes each frame exactly once; subscribers only read the shared
+    snapshot, so the cost of a sample does not depend on how many clients are listening.
+    """
+
+    def __init__(self, prepare=None):
+        self._condition = threading.Condition()
+        self._snapshot = None
+        self._seq = 0
+        self._subscriber_count = 0
+        self._listeners = []
+        # prepare(snapshot) runs once per snapshot, after seq is assigned and before anyone can see it.
+        self._prepare = prepare
+
+    def add_listener(self, callback):
+        """Call callback(snapshot) on every publish, e.g. to hand frames to an asyncio event loop."""
+        with self._condition:
+            self._listeners.append(callback)
+
+    def publish(self, snapshot):
+        """Store a new snapshot and wake every waiting subscriber."""
+        with self._condition:
+            self._seq += 1
+            snapshot['seq'] = self._seq
+            if self._prepare:
+                self._prepare(snapshot)
+            self._snapshot = snapshot
+            self._condition.notify_all()
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                app.logger.error(f"Error in snapshot listener: {e}")
+
+    def latest(self):
+        """Return the most recent snapshot, or None if nothing has been published yet."""
+        with self._condition:
+            return self._snapshot
+
+    def wait_for_next(self, last_seq, timeout):
+        """Block until a snapshot newer than last_seq exists. Returns None on timeout."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._snapshot is not None and self._snapshot['seq'] > last_seq,
+                timeout=timeout
+            )
+            if self._snapshot is not None and self._snapshot['seq'] > last_seq:
+                return self._snapshot
+            return None
+
+    def subscribe(self):
+        with self._condition:
+            self._subscriber_count += 1
+
+    def unsubscribe(self):
+        with self._condition:
+            self._subscriber_count = max(0, self._subscriber_count - 1)
+
+    @property
+    def subscriber_count(self):
+        with self._condition:
+            return self._subscriber_count
+
+
+class VoltageSampler(threading.Thread):
+    """Background acquisition thread. The only code path that touches the ADC and stores readings."""
+
+    def __init__(self, broadcaster, interval=SAMPLE_INTERVAL_SECONDS):
+        super().__init__(name='VoltageSampler', daemon=True)
+        self.broadcaster = broadcaster
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        app.logger.info(f"Voltage sampler started (interval {self.interval}s).")
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                # read_all_voltages will propagate IOError if the ADC backend is unavailable
+                readings = read_all_voltages()
+                sample_time = datetime.now()
+                stored = [reading for reading in readings
+                          if insert_voltage_reading(reading['cell'], reading['voltage'], sample_time)]
+                history_ring.append_frame(sample_time, stored)
+                alerts = alert_engine.evaluate(sample_time, readings)
+
+                snapshot = {
+                    'status': 'success',
+                    'readings': readings,
+                    'timestamp': sample_time.isoformat(),
+                    'epoch_ms': int(sample_time.timestamp() * 1000)
+                }
+                if alerts:
+                    snapshot['alerts'] = alerts
+                self.broadcaster.publish(snapshot)
+                delay = self.interval - (time.monotonic() - started)
+            except IOError as e_hw:
+                app.logger.error(f"Hardware interface error in voltage sampler: {e_hw}")
+                snapshot = {
+                    'status': 'error',
+                    'error_kind': 'hardware',
+                    'message': str(e_hw),
+                    'timestamp': datetime.now().isoformat()
+                }
+                alerts = alert_engine.check_stale(datetime.now())
+                if alerts:
+                    snapshot['alerts'] = alerts
+                self.broadcaster.publish(snapshot)
+                delay = HARDWARE_ERROR_RETRY_SECONDS
+            except Exception as e:
+                app.logger.error(f"Error in voltage sampler: {e}", exc_info=True)
+                self.broadcaster.publish({
+                    'status': 'error',
+                    'error_kind': 'general',
+                    'message': str(e),
+                    'timestamp': datetime.now().isoformat()
+                })
+                delay = SAMPLE_ERROR_RETRY_SECONDS
+            self._stop_event.wait(max(0.0, delay))
+        app.logger.info("Voltage sampler stopped.")
+
+
+class StreamFrameEncoder:
+    """Encodes snapshots for the live stream, at most once per snapshot and encoding.
+
+    Encoded frames are cached on the snapshot, so N subscribers share one serialization; the
+    cache is filled under a lock, so concurrent subscribers never encode the same frame twice.
+    Delta frames are relative to a single shared reference that prepare() advances for every
+    snapshot; a subscriber that just connected or missed a frame gets a keyframe of that
+    reference instead, which puts it back in sync.
+    """
+
+    def __init__(self, epsilon=STREAM_DELTA_EPSILON, keyframe_interval=STREAM_KEYFRAME_INTERVAL):
+        self.epsilon = epsilon
+        self.keyframe_interval = keyframe_interval
+        self._reference = None
+        self._frames_since_keyframe = 0
+        self._encode_lock = threading.Lock()
+
+    def _changed(self, value, reference):
+        if value is None or reference is None:
+            return (value is None) != (reference is None)
+        return abs(value - reference) > self.epsilon
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+    def prepare(self, snapshot):
+        """Advance the shared delta reference. Called by the broadcaster once per snapshot."""
+        snapshot['frames'] = {}
+        if snapshot['status'] != 'success':
+            self._reference = None # Next good frame is a keyframe
+            return
 
-# --- Logging Setup ---
-log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'battery_monitor.log')
-logging.basicConfig(
-    filename=log_file_path,
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s:%(name)s:%(threadName)s:%(message)s'
-)
-if not HARDWARE_AVAILABLE:
-    app.logger.warning("smbus not available. ADC communication will not be possible.")
-else:
-    app.logger.info("smbus available. Running with hardware.")
+        values = [reading['voltage'] for reading in snapshot['readings']]
+        if (self._reference is None or len(self._reference) != len(values)
+                or self._frames_since_keyframe >= self.keyframe_interval):
+            self._reference = list(values)
+            self._frames_since_keyframe = 0
+            changes = None
+        else:
+            changes = []
+            for i, value in enumerate(values):
+                if self._changed(value, self._reference[i]):
+                    changes.append([snapshot['readings'][i]['cell'], value])
+                    self._reference[i] = value
+            self._frames_since_keyframe += 1
+        snapshot['delta_reference'] = list(self._reference)
+        snapshot['delta_changes'] = changes # None: this snapshot is a keyframe for everyone
 
-# --- Configuration ---
-PYTHON_NUMBER_OF_CELLS = 4
-VOLTAGE_DIVIDER_COMPENSATION_FACTOR = 1.0  # Adjust as per your circuit
-# Define a threshold below which a cell is considered disconnected or completely depleted,
-# and should be reported as 0.0V. Based on user: "lowest value, which means zero, is 2.51".
-# Set threshold slightly above to catch this range.
-FUNCTIONAL_ZERO_THRESHOLD = 2.6
+    def _encode(self, snapshot, kind):
+        if kind == 'json' or snapshot['status'] != 'success':
+            return format_sse_frame(snapshot)
 
-# Database configuration
-db_config = {
-    'host': 'localhost',
-    'user': 'app_user',
-    'password': 'Ah12345678',
-    'database': 'i2c_db'
-}
+        epoch_ms = snapshot['epoch_ms']
+        if kind == 'columnar':
+            values = [r['voltage'] if r['voltage'] is not None else float('nan') for r in snapshot['readings']]
+            packed = base64.b64encode(struct.pack(f'<{len(values)}e', *values)).decode('ascii')
+            payload = {'seq': snapshot['seq'], 't': epoch_ms, 'n': len(values), 'dtype': 'float16', 'v': packed}
+        elif kind == 'delta_key':
+            payload = {'seq': snapshot['seq'], 't': epoch_ms, 'type': 'key',
+                       'cells': [r['cell'] for r in snapshot['readings']], 'v': snapshot['delta_reference']}
+        else: # 'delta'
+            payload = {'seq': snapshot['seq'], 't': epoch_ms, 'type': 'delta', 'c': snapshot['delta_changes']}
+        if snapshot.get('alerts'):
+            payload['alerts'] = snapshot['alerts']
+        return f"data: {json.dumps(payload, separators=(',', ':'))}\n\n".encode('utf-8')
 
-# I2C Configuration (for Raspberry Pi)
-if HARDWARE_AVAILABLE:
-    BUS = smbus.SMBus(1)  # Use bus 1 for newer Raspberry Pi models
-    PCF8591_ADDRESS = 0x48  # Default address for PCF8591
+    def frame(self, snapshot, encoding='json', last_sent_seq=0):
+        """Return the encoded SSE frame (bytes) of a snapshot for one subscriber."""
+        kind = encoding
+        if encoding == 'delta' and snapshot['status'] == 'success':
+            if snapshot['delta_changes'] is None or last_sent_seq != snapshot['seq'] - 1:
+                kind = 'delta_key'
+        frames = snapshot['frames']
+        encoded = frames.get(kind)
+        if encoded is None:
+            with self._encode_lock:
+                encoded = frames.get(kind) # Another subscriber may have encoded it while we waited
+                if encoded is None:
+                    started = time.perf_counter()
+                    encoded = frames[kind] = self._encode(snapshot, kind)
+                    metric_stream_encode_seconds.observe(time.perf_counter() - started, kind)
+        return encoded
 
-def get_db_connection():
-    """Create and return a database connection."""
-    conn = None
-    try:
-        conn = mariadb.connect(**db_config)
-        return conn
-    except mariadb.Error as e:
-        app.logger.error(f"Database connection error: {e}")
-        return None
 
-def read_voltage(channel):
-    """Read voltage from a specific ADC channel with validation and compensation."""
-    if not HARDWARE_AVAILABLE:
-        app.logger.error(f"smbus (I2C interface) is not available. Cannot read from ADC for channel {channel}.")
-        raise IOError("smbus (I2C interface) is not available. ADC readings are impossible.")
-    
-    # Hardware reading logic
-    try:
-        if not 0 <= channel < PYTHON_NUMBER_OF_CELLS:
-            app.logger.error(f"Invalid channel number: {channel}. Expected 0 to {PYTHON_NUMBER_OF_CELLS - 1}.")
-            raise ValueError(f"Invalid channel number: {channel}. Expected 0 to {PYTHON_NUMBER_OF_CELLS - 1}.")
-        
-        BUS.write_byte(PCF8591_ADDRESS, 0x40 + channel) # Select channel
-        time.sleep(0.02) # Allow ADC to settle
-        BUS.read_byte(PCF8591_ADDRESS)  # Dummy read to discard previous channel's residue
-        time.sleep(0.02) # A bit more settling time
-        raw_value = BUS.read_byte(PCF8591_ADDRESS) # Actual read for the current channel
-        
-        voltage_at_adc_pin = (raw_value / 255.0) * 5.0 # Assuming VREF is 5.0V
-        actual_cell_voltage = voltage_at_adc_pin * VOLTAGE_DIVIDER_COMPENSATION_FACTOR
-        
-        # Check if voltage is below the functional zero threshold
-        if actual_cell_voltage < FUNCTIONAL_ZERO_THRESHOLD:
-            app.logger.info(f"Channel {channel} voltage {actual_cell_voltage:.3f}V is below functional zero threshold {FUNCTIONAL_ZERO_THRESHOLD}V. Reporting as 0.0V.")
-            return 0.0
-        
-        # General sanity check for "impossible" readings (e.g., way above VREF after compensation)
-        # This primarily logs a warning if a value is outside a very broad expected hardware range.
-        max_expected_compensated_voltage = (5.0 * VOLTAGE_DIVIDER_COMPENSATION_FACTOR) + 0.5 # Allow some margin
-        if not (-0.5 <= actual_cell_voltage <= max_expected_compensated_voltage):
-            app.logger.warning(f"Channel {channel} compensated voltage {actual_cell_voltage:.3f}V is outside very broad expected range (-0.5V to {max_expected_compensated_voltage:.1f}V). This might indicate an issue.")
-            # Depending on how strict, could return 0.0 or None here. For now, let it pass if not caught by functional zero.
-        
-        return round(actual_cell_voltage, 3)
+stream_encoder = StreamFrameEncoder()
+voltage_broadcaster = SampleBroadcaster(prepare=stream_encoder.prepare)
+_sampler = None
+_sampler_lock = threading.Lock()
 
-    except IOError as e:
-        app.logger.error(f"I2C Error reading channel {channel}: {e}. Check PCF8591 at address {PCF8591_ADDRESS}. Returning None.")
-        return None 
-    except Exception as e:
-        app.logger.error(f"General error reading channel {channel}: {e}. Returning None.")
-        return None
+def ensure_background_services():
+    """Start the writer, rollup job and shared sampler on first use. Safe to call from any request thread."""
+    global _sampler
+    with _sampler_lock:
+        voltage_writer.ensure_started()
+        if spool_drainer is not None:
+            spool_drainer.ensure_started()
+        rollup_worker.ensure_started()
+        archive_worker.ensure_started()
+        alert_writer.ensure_started()
+        if _sampler is None or not _sampler.is_alive():
+            _sampler = VoltageSampler(voltage_broadcaster)
+            _sampler.start()
+    return _sampler
 
-def read_all_voltages():
-    """Read voltages from all configured battery cells."""
-    readings = []
-    for ch in range(PYTHON_NUMBER_OF_CELLS):
-        # This will now raise IOError if HARDWARE_AVAILABLE is false,
-        # or return None if there's a specific I2C read error during BUS.read_byte.
-        # The calling functions (API endpoints) will handle the IOError.
-        voltage = read_voltage(ch) 
-        readings.append({
-            'cell': ch + 1, 
-            'ain_channel': f'AIN{ch}',
-            'voltage': voltage 
-        })
-    return readings
+@atexit.register
+def shutdown_acquisition():
+    """Stop sampling and flush any buffered readings before the process exits."""
+    with _sampler_lock:
+        if _sampler is not None:
+            _sampler.stop()
+            _sampler.join(SAMPLE_INTERVAL_SECONDS + 1)
+    rollup_worker.stop()
+    archive_worker.stop()
+    voltage_writer.stop()
+    alert_writer.stop()
+    if spool_drainer is not None:
+        spool_drainer.stop()
+        voltage_spool.close()
 
-def insert_voltage_reading(cell, voltage):
-    """Insert voltage reading into the database. Skips None (I2C error)."""
-    # Allow 0.0V to be inserted if it's a functional zero.
-    if voltage is None: # Only skip if it's an actual I2C read error resulting in None
-        app.logger.debug(f"Skipping database insert for cell {cell} due to voltage being None (I2C error).")
-        return True
+def format_sse_frame(snapshot):
+    """Render a sampler snapshot as one JSON SSE 'data:' frame (the default 'json' stream encoding)."""
+    if snapshot['status'] == 'error':
+        payload = {
+            'status': 'error',
+            'message': snapshot['message'],
+            'error_code': 'BSE_STREAM_NO_HW_INTERFACE' if snapshot.get('error_kind') == 'hardware' else 'BSE_STREAM_ERROR'
+        }
+    else:
+        # The frontend will now correctly handle `null` for voltage, so we send it as is.
+        # This prevents the frontend from flickering to 0.0V on a transient read error.
+        payload = {
+            'status': 'success',
+            'readings': snapshot['readings'],
+            'timestamp': snapshot['timestamp']
+        }
+    if snapshot.get('alerts'):
+        payload['alerts'] = snapshot['alerts']
+    return f"data: {json.dumps(payload)}\n\n".encode('utf-8')
 
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        if not conn:
-            app.logger.error("Failed to get DB connection for insert_voltage_reading.")
-            return False
-        
-        cursor = conn.cursor()
-        query = "INSERT INTO voltage_readings (cell_number, voltage) VALUES (%s, %s)"
-        cursor.execute(query, (cell, voltage))
-        conn.commit()
-        return True
-    except mariadb.Error as e:
-        app.logger.error(f"Database insert error for cell {cell} voltage {voltage}: {e}")
-        if conn:
-            try:
-                conn.rollback()
-            except mariadb.Error as rb_err:
-                app.logger.error(f"Error during rollback: {rb_err}")
-        return False
-    except Exception as e_gen:
-        app.logger.error(f"Generic error in insert_voltage_reading for cell {cell}: {e_gen}")
-        return False
-    finally:
-        if cursor:
-            try:
-                cursor.close()
-            except mariadb.Error as e_cur:
-                app.logger.error(f"Error closing cursor in insert_voltage_reading: {e_cur}")
-        if conn:
-            try:
-                if hasattr(conn, '_closed') and not conn._closed:
-                     conn.close()
-                elif not hasattr(conn, '_closed'): # Fallback if _closed does not exist
-                     conn.close()
-            except mariadb.Error as e_conn:
-                app.logger.error(f"Error closing connection in insert_voltage_reading: {e_conn}")
-
-def get_voltage_history(limit=100):
-    """Get historical voltage readings from the database."""
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        if not conn:
-            app.logger.error("Failed to get DB connection for get_voltage_history.")
-            return []
-        
-        cursor = conn.cursor(dictionary=True)
-        query = """
-            SELECT cell_number, voltage, timestamp 
-            FROM voltage_readings 
-            ORDER BY timestamp DESC
-            LIMIT %s
-        """
-        cursor.execute(query, (limit,))
-        result = cursor.fetchall()
-        return result
-    except mariadb.Error as e:
-        app.logger.error(f"Database query error in get_voltage_history: {e}")
-        return []
-    except Exception as e_gen:
-        app.logger.error(f"Generic error in get_voltage_history: {e_gen}")
-        return []
-    finally:
-        if cursor:
-            try:
-                cursor.close()
-            except mariadb.Error as e_cur:
-                app.logger.error(f"Error closing cursor in get_voltage_history: {e_cur}")
-        if conn:
-            try:
-                if hasattr(conn, '_closed') and not conn._closed:
-                     conn.close()
-                elif not hasattr(conn, '_closed'):
-                     conn.close()
-            except mariadb.Error as e_conn:
-                app.logger.error(f"Error closing connection in get_voltage_history: {e_conn}")
+def get_latest_snapshot(timeout=SNAPSHOT_WAIT_TIMEOUT_SECONDS):
+    """Return the latest sampler snapshot, waiting up to `timeout` seconds for the first one."""
+    ensure_background_services()
+    snapshot = voltage_broadcaster.latest()
+    if snapshot is None:
+        snapshot = voltage_broadcaster.wait_for_next(0, timeout)
+    return snapshot
 
 @app.route('/')
 def index_route(): # Renamed from index
@@ -215,26 +2796,34 @@ def index_route(): # Renamed from index
 def get_voltage_api():
     """API endpoint to get current voltage readings (for initial load/manual refresh)."""
     try:
-        # read_all_voltages will propagate IOError if HARDWARE_AVAILABLE is False
-        current_readings_raw = read_all_voltages() 
-        
-        for reading in current_readings_raw:
-            # insert_voltage_reading now handles storing 0.0V, but skips None
-            insert_voltage_reading(reading['cell'], reading['voltage']) 
-        
+        # Served from the shared sampler; this endpoint never touches the I2C bus itself.
+        snapshot = get_latest_snapshot()
+        if snapshot is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'No voltage sample is available yet. The sampler may still be starting.',
+                'error_code': 'BSE5009'
+            }), 503
+
+        if snapshot['status'] == 'error':
+            if snapshot.get('error_kind') == 'hardware':
+                return jsonify({
+                    'status': 'error',
+                    'message': snapshot['message'], # Should be "smbus (I2C interface) is not available..."
+                    'error_code': 'BSE_NO_HW_INTERFACE'
+                }), 500
+            return jsonify({
+                'status': 'error',
+                'message': 'An internal server error occurred while fetching voltages.',
+                'error_code': 'BSE5001'
+            }), 500
+
         # Return all readings, including 0.0V or None, frontend will handle display.
         return jsonify({
             'status': 'success',
-            'readings': current_readings_raw, 
-            'timestamp': datetime.now().isoformat()
+            'readings': snapshot['readings'],
+            'timestamp': snapshot['timestamp']
         })
-    except IOError as e: # Specifically catch the IOError from read_voltage via read_all_voltages
-        app.logger.error(f"Error in /api/voltage due to hardware interface: {e}", exc_info=True)
-        return jsonify({
-            'status': 'error',
-            'message': str(e), # Should be "smbus (I2C interface) is not available..."
-            'error_code': 'BSE_NO_HW_INTERFACE' 
-        }), 500
     except Exception as e:
         app.logger.error(f"Error in /api/voltage: {e}", exc_info=True)
         return jsonify({
@@ -245,73 +2834,93 @@ def get_voltage_api():
 
 @app.route('/api/voltage/stream')
 def voltage_stream():
-    """Streams live voltage readings using Server-Sent Events."""
+    """Streams live voltage readings using Server-Sent Events.
+
+    Optional query param: encoding = json (default) | columnar | delta.
+    """
+    encoding = request.args.get('encoding', 'json')
+    if encoding not in STREAM_ENCODINGS:
+        return jsonify({
+            'status': 'error',
+            'message': f"Unknown stream encoding '{encoding}'. Expected one of: {', '.join(STREAM_ENCODINGS)}.",
+            'error_code': 'BSE4011'
+        }), 400
+    ensure_background_services()
+
     def generate_voltage_data():
-        app.logger.info("Starting SSE voltage stream.")
-        while True:
-            try:
-                # read_all_voltages will propagate IOError if HARDWARE_AVAILABLE is False
-                current_readings_stream = read_all_voltages()
-
-                for reading in current_readings_stream:
-                    insert_voltage_reading(reading['cell'], reading['voltage'])
-                
-                # The frontend will now correctly handle `null` for voltage, so we send it as is.
-                # This prevents the frontend from flickering to 0.0V on a transient read error.
-                sse_payload_readings = []
-                for r in current_readings_stream:
-                    sse_payload_readings.append({
-                        'cell': r['cell'],
-                        'ain_channel': r['ain_channel'],
-                        'voltage': r['voltage'] # Send null as is
-                    })
-                
-                data_payload = {
-                    'status': 'success',
-                    'readings': sse_payload_readings, 
-                    'timestamp': datetime.now().isoformat()
-                }
-                yield f"data: {json.dumps(data_payload)}\n\n"
-                time.sleep(1)
+        log_rate_limited('sse_connect', logging.INFO, "Starting SSE voltage stream.")
+        voltage_broadcaster.subscribe()
+        last_seq = 0
+        try:
+            while True:
+                # Every client waits on the same shared snapshot instead of polling the ADC.
+                snapshot = voltage_broadcaster.wait_for_next(last_seq, SSE_KEEPALIVE_SECONDS)
+                if snapshot is None:
+                    yield b": keep-alive\n\n"
+                    continue
+                frame = stream_encoder.frame(snapshot, encoding, last_seq)
+                last_seq = snapshot['seq']
+                yield frame
+        except GeneratorExit:
+            log_rate_limited('sse_disconnect', logging.INFO, "SSE voltage stream client disconnected.")
+        finally:
+            voltage_broadcaster.unsubscribe()
 
-            except IOError as e_hw: # Catch IOError from read_all_voltages
-                app.logger.error(f"Hardware interface error in SSE voltage stream generator: {e_hw}", exc_info=True)
-                error_payload = {
-                    'status': 'error',
-                    'message': str(e_hw),
-                    'error_code': 'BSE_STREAM_NO_HW_INTERFACE'
-                }
-                try:
-                    yield f"data: {json.dumps(error_payload)}\n\n"
-                except Exception as yield_err: 
-                    app.logger.error(f"Error yielding hardware error payload in SSE stream: {yield_err}")
-                # Wait longer before retrying if hardware interface is the issue
-                # Or potentially break, depending on desired behavior. For now, retry after delay.
-                time.sleep(10) 
-            except GeneratorExit:
-                app.logger.info("SSE voltage stream client disconnected.")
-                return 
-            except Exception as e:
-                app.logger.error(f"Error in SSE voltage stream generator: {e}", exc_info=True)
-                error_payload = {
-                    'status': 'error',
-                    'message': str(e),
-                    'error_code': 'BSE_STREAM_ERROR'
-                }
-                try:
-                    yield f"data: {json.dumps(error_payload)}\n\n"
-                except Exception as yield_err: 
-                    app.logger.error(f"Error yielding error payload in SSE stream: {yield_err}")
-                time.sleep(5) 
-                
     return Response(generate_voltage_data(), mimetype='text/event-stream')
 
 
 @app.route('/api/history', methods=['GET'])
 def get_history_api():
-    """API endpoint to get voltage history."""
+    """API endpoint to get voltage history.
+
+    Optional query params: limit, start, end (ISO-8601), cells=1,2,5, pack (default LOCAL_PACK_ID),
+    before / after (page cursors), fill=step. With fill=step and a start, each cell's last stored value before start is added,
+    stamped at start and marked 'carried', so deadband-compressed data can be drawn as a complete
+    step series.
+
+    Pages are cut on (timestamp, id): the X-Next-Before header holds the cursor for the next older
+    page and X-Next-After the one for newer rows. The latest rows of the local pack are served from
+    the in-memory ring when it covers them; those pages hold whole seconds and carry only
+    X-Next-Before, as a bare timestamp (the newest second may still receive rows).
+
+    Raw rows older than RETENTION_DAYS['voltage_readings'] are not served here; they are in the
+    columnar archive (/api/archive/export, archive_export.py) and, summarized, in the rollups.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_DEFAULT_LIMIT)), 1), HISTORY_MAX_LIMIT)
+        start = parse_datetime_param('start')
+        end = parse_datetime_param('end')
+        cells = parse_cells_param()
+        pack_id = parse_pack_param()
+        before = parse_cursor_param('before')
+        after = parse_cursor_param('after')
+        fill = request.args.get('fill')
+        if fill not in (None, 'step'):
+            raise ValueError(f"Invalid 'fill' parameter '{fill}'. Expected 'step'.")
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'error_code': 'BSE4002'}), 400
+
     try:
-        history_data = get_voltage_history()
+        paged = cells is not None or before is not None or after is not None
+        history_data = None
+        if not paged and pack_id == LOCAL_PACK_ID:
+            # Ring rows carry no id, so only the plain "latest rows" request is served from memory.
+            history_data = history_ring.query(limit, start, end)
+        from_db = history_data is None
+        if from_db:
+            history_data = get_voltage_history_page(limit, start, end, cells, before, after, pack_id) or []
+        history_data = list(history_data)
+        cursor_headers = {}
+        if from_db and history_data:
+            cursor_headers['X-Next-Before'] = format_history_cursor(history_data[-1])
+            cursor_headers['X-Next-After'] = format_history_cursor(history_data[0])
+        elif history_data:
+            # Ring rows have no id, but a ring page ends on a whole second (see VoltageRingBuffer.query).
+            cursor_headers['X-Next-Before'] = history_data[-1]['timestamp'].isoformat()
+        if fill == 'step' and start is not None and before is None and after is None and len(history_data) < limit:
+            # The window is complete, so the value in effect at `start` is the last row before it.
+            for row in get_values_before(start, cells or known_pack_cells(pack_id), pack_id):
+                history_data.append(dict(row, timestamp=start, carried=True))
         processed_history = []
         for row in history_data:
             voltage = None
@@ -328,13 +2937,16 @@ def get_history_api():
             elif ts_value is not None:
                 timestamp_str = str(ts_value)
 
-            processed_history.append({
+            entry = {
                 'cell': int(row['cell_number']),
-                'ain_channel': f'AIN{int(row["cell_number"]) - 1}',
+                'ain_channel': ain_channel_for_cell(int(row['cell_number'])),
                 'voltage': voltage, 
                 'timestamp': timestamp_str
-            })
-        return jsonify(processed_history)
+            }
+            if row.get('carried'):
+                entry['carried'] = True
+            processed_history.append(entry)
+        return jsonify(processed_history), 200, cursor_headers
     except Exception as e:
         app.logger.error(f"Error in /api/history: {e}", exc_info=True)
         return jsonify({
@@ -343,12 +2955,151 @@ def get_history_api():
             'error_code': 'BSE5002'
         }), 500
 
+@app.route('/api/history/downsampled', methods=['GET'])
+def get_downsampled_history_api():
+    """API endpoint for long-range charts: per-bucket min/avg/max per cell.
+
+    Query params: start, end (ISO-8601, default the last 24 h), cells (e.g. 1,2,3),
+    pack (default LOCAL_PACK_ID), points (target buckets per cell, default 500). The response size depends on
+    `points` and the number of cells, not on how many raw rows the range contains.
+    """
+    try:
+        end = parse_datetime_param('end') or datetime.now()
+        start = parse_datetime_param('start') or datetime.fromtimestamp(end.timestamp() - DOWNSAMPLE_DEFAULT_RANGE_SECONDS)
+        cells = parse_cells_param()
+        pack_id = parse_pack_param()
+        points = int(request.args.get('points', DOWNSAMPLE_DEFAULT_POINTS))
+        if not 1 <= points <= DOWNSAMPLE_MAX_POINTS:
+            raise ValueError(f"'points' must be between 1 and {DOWNSAMPLE_MAX_POINTS}.")
+        if end <= start:
+            raise ValueError("'end' must be after 'start'.")
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'error_code': 'BSE4009'}), 400
+
+    try:
+        bucket_seconds, origin = downsample_grid(start, end, points)
+        rows, sources = get_voltage_buckets(start, end, bucket_seconds, cells, pack_id, origin)
+        if rows is None:
+            return jsonify({'status': 'error', 'message': 'Database error fetching downsampled history.', 'error_code': 'BSEDB009'}), 500
+
+        series = {}
+        for cell_number, bucket, min_voltage, avg_voltage, max_voltage, samples in rows:
+            cell = int(cell_number)
+            if cell not in series:
+                series[cell] = {'cell': cell, 'ain_channel': ain_channel_for_cell(cell), 'points': []}
+            series[cell]['points'].append({
+                'timestamp': datetime.fromtimestamp(origin + int(bucket) * bucket_seconds).isoformat(),
+                'min_voltage': float(min_voltage) if min_voltage is not None else None,
+                'avg_voltage': round(float(avg_voltage), 3) if avg_voltage is not None else None,
+                'max_voltage': float(max_voltage) if max_voltage is not None else None,
+                'samples': int(samples)
+            })
+
+        return jsonify({
+            'status': 'success',
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'bucket_seconds': bucket_seconds,
+            'sources': sources,
+            'series': [series[cell] for cell in sorted(series)]
+        })
+    except Exception as e:
+        app.logger.error(f"Error in /api/history/downsampled: {e}", exc_info=True)
+        return jsonify({
+            'status': 'error',
+            'message': 'An internal server error occurred while fetching downsampled history.',
+            'error_code': 'BSE5010'
+        }), 500
+
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts_api():
+    """API endpoint for alerts.
+
+    Always returns the currently active alerts (from memory). The stored alert events, newest
+    first, are filtered by optional start, end (ISO-8601), cells and limit; if the database is
+    unavailable the most recent events kept in memory are returned instead ('source': 'memory').
+    Live changes are also pushed to stream subscribers in the 'alerts' field of the frame.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', ALERT_HISTORY_DEFAULT_LIMIT)), 1), ALERT_HISTORY_MAX_LIMIT)
+        start = parse_datetime_param('start')
+        end = parse_datetime_param('end')
+        cells = parse_cells_param()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'error_code': 'BSE4012'}), 400
+
+    conn = None
+    cursor = None
+    try:
+        events = None
+        source = 'database'
+        conn = get_db_connection()
+        if conn:
+            try:
+                cursor = conn.cursor(dictionary=True)
+                where_clause, params = build_reading_filters(start, end, cells, time_column='created_at')
+                cursor.execute(f"""
+                    SELECT rule_name, severity, cell_number, state, value, message, created_at
+                    FROM voltage_alerts
+                    {where_clause}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (*params, limit))
+                events = [{
+                    'rule': row['rule_name'],
+                    'severity': row['severity'],
+                    'cell': row['cell_number'],
+                    'state': row['state'],
+                    'value': row['value'],
+                    'message': row['message'],
+                    'timestamp': row['created_at'].isoformat()
+                } for row in cursor.fetchall()]
+            except mariadb.Error as e:
+                app.logger.error(f"Database query error in /api/alerts: {e}")
+        if events is None:
+            source = 'memory'
+            events = []
+            for event in alert_engine.recent(ALERT_RECENT_EVENTS):
+                created_at = datetime.fromisoformat(event['timestamp'])
+                if ((start is None or created_at >= start) and (end is None or created_at <= end)
+                        and (cells is None or event['cell'] in cells)):
+                    events.append(event)
+                    if len(events) == limit:
+                        break
+        return jsonify({
+            'status': 'success',
+            'active': alert_engine.active(),
+            'events': events,
+            'source': source,
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        app.logger.error(f"Error in /api/alerts: {e}", exc_info=True)
+        return jsonify({
+            'status': 'error',
+            'message': 'An internal server error occurred while fetching alerts.',
+            'error_code': 'BSE5012'
+        }), 500
+    finally:
+        close_db_resources(cursor, conn, 'get_alerts_api')
+
 @app.route('/api/connect', methods=['POST']) 
 def connect_api():
     """API endpoint to test connection to the ADC/hardware."""
     try:
-        # This will now raise IOError if HARDWARE_AVAILABLE is False
-        voltage_val = read_voltage(0) 
+        # Reports on the sampler's latest frame instead of issuing a separate I2C read.
+        snapshot = get_latest_snapshot()
+        if snapshot is not None and snapshot['status'] == 'error' and snapshot.get('error_kind') == 'hardware':
+            app.logger.error(f"Error in /api/connect due to hardware interface: {snapshot['message']}")
+            return jsonify({
+                'status': 'error',
+                'message': snapshot['message'],
+                'error_code': 'BSE_NO_HW_INTERFACE_CONNECT'
+            }), 500
+
+        voltage_val = None
+        if snapshot is not None and snapshot['status'] == 'success' and snapshot['readings']:
+            voltage_val = snapshot['readings'][0]['voltage']
         if voltage_val is not None: 
             return jsonify({
                 'status': 'success',
@@ -360,13 +3111,6 @@ def connect_api():
                 'message': 'Could not read valid voltage from ADC. Check hardware or I2C connection. Reading was None.',
                 'error_code': 'BSEHW001'
             }), 500
-    except IOError as e_hw: # Catch the specific IOError
-        app.logger.error(f"Error in /api/connect due to hardware interface: {e_hw}", exc_info=True)
-        return jsonify({
-            'status': 'error',
-            'message': str(e_hw), 
-            'error_code': 'BSE_NO_HW_INTERFACE_CONNECT'
-        }), 500
     except Exception as e:
         app.logger.error(f"Error in /api/connect: {e}", exc_info=True)
         return jsonify({
@@ -377,93 +3121,273 @@ def connect_api():
 
 @app.route('/api/download', methods=['GET'])
 def download_csv_api():
-    """API endpoint to download voltage history as CSV."""
-    csv_file_path = os.path.join(os.getcwd(), 'voltage_history.csv')
+    """API endpoint to download voltage history as CSV.
+
+    Rows are streamed straight from an unbuffered cursor, so memory stays flat for any export size.
+    Optional query params: start, end (ISO-8601), cells (e.g. 1,2,3), pack (default LOCAL_PACK_ID),
+    gzip (1 for a .csv.gz download).
+    """
     try:
-        history_data = get_voltage_history(limit=1000) 
-        
-        with open(csv_file_path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Cell', 'AIN Channel', 'Voltage (V)', 'Timestamp'])
-            for row in history_data:
-                ain_channel = f'AIN{int(row["cell_number"]) - 1}'
-                voltage_val = ''
-                if row.get('voltage') is not None:
-                    try:
-                        voltage_val = float(row['voltage'])
-                    except (ValueError, TypeError):
-                        pass 
-                
-                timestamp_str = str(row.get('timestamp', '')) 
-                if isinstance(row.get('timestamp'), datetime):
-                    timestamp_str = row['timestamp'].isoformat()
-                
-                writer.writerow([
-                    int(row['cell_number']), 
-                    ain_channel, 
-                    voltage_val, 
-                    timestamp_str
-                ])
-        
-        return send_file(csv_file_path, as_attachment=True, download_name='voltage_history.csv')
+        start = parse_datetime_param('start')
+        end = parse_datetime_param('end')
+        cells = parse_cells_param()
+        pack_id = parse_pack_param()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'error_code': 'BSE4006'}), 400
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'status': 'error', 'message': 'Database connection failed for CSV export.', 'error_code': 'BSEDB006'}), 500
+
+        where_clause, params = build_reading_filters(start, end, cells, pack_id=pack_id)
+        # Unbuffered: the server streams the result set instead of the client loading it all into memory.
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(f"""
+            SELECT cell_number, voltage, timestamp
+            FROM voltage_readings
+            {where_clause}
+            ORDER BY timestamp
+        """, params)
     except Exception as e:
         app.logger.error(f"Error in /api/download: {e}", exc_info=True)
+        close_db_resources(cursor, conn, 'download_csv_api')
         return jsonify({
             'status': 'error',
             'message': 'Failed to generate or send CSV file.',
             'error_code': 'BSE5006'
         }), 500
 
+    def generate_csv(cursor, conn):
+        compressor = zlib.compressobj(CSV_EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if use_gzip else None # wbits 31 = gzip container
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def take_chunk():
+            data = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+            return compressor.compress(data) if compressor else data
+
+        try:
+            writer.writerow(['Cell', 'AIN Channel', 'Voltage (V)', 'Timestamp'])
+            yield take_chunk()
+            while True:
+                rows = cursor.fetchmany(CSV_EXPORT_BATCH_ROWS)
+                if not rows:
+                    break
+                for cell_number, voltage, timestamp in rows:
+                    voltage_val = ''
+                    if voltage is not None:
+                        try:
+                            voltage_val = float(voltage)
+                        except (ValueError, TypeError):
+                            pass
+                    timestamp_str = timestamp.isoformat() if isinstance(timestamp, datetime) else str(timestamp or '')
+                    writer.writerow([int(cell_number), ain_channel_for_cell(int(cell_number)), voltage_val, timestamp_str])
+                chunk = take_chunk()
+                if chunk:
+                    yield chunk
+            if compressor:
+                yield compressor.flush()
+        except mariadb.Error as e:
+            # Headers are already sent at this point; the truncated download is all we can signal.
+            app.logger.error(f"Database error while streaming CSV export: {e}")
+        except GeneratorExit:
+            app.logger.info("CSV export client disconnected.")
+        finally:
+            close_db_resources(cursor, conn, 'download_csv_api')
+
+    download_name = 'voltage_history.csv.gz' if use_gzip else 'voltage_history.csv'
+    return Response(
+        generate_csv(cursor, conn),
+        mimetype='application/gzip' if use_gzip else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename={download_name}'}
+    )
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_api():
+    """Bulk ingest of frames pushed by remote sampler nodes (see remote_sampler.py).
+
+    Body: JSON, optionally compressed (Content-Encoding: gzip or deflate):
+        {"pack_id": 3, "frames": [{"seq": 1714557600000000, "timestamp": "2024-05-01T12:00:00",
+                                   "voltages": [3.712, 3.705, null, 3.698]}, ...]}
+    voltages[i] is cell i + 1 unless the frame lists its own 'cells'; a frame may also override
+    pack_id. Null voltages (failed reads) are skipped. Rows are keyed by (pack_id, seq, cell), so a
+    sampler can resend a batch whose response it never received without creating duplicates.
+    """
+    if INGEST_TOKEN is not None:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {INGEST_TOKEN}".encode()):
+            metric_ingest_requests.inc('unauthorized')
+            return jsonify({'status': 'error', 'message': 'Missing or invalid ingest token.', 'error_code': 'BSE4013'}), 401
+
+    body = request.stream.read(INGEST_MAX_BODY_BYTES + 1)
+    if len(body) > INGEST_MAX_BODY_BYTES:
+        metric_ingest_requests.inc('too_large')
+        return jsonify({'status': 'error', 'message': f'Request body exceeds {INGEST_MAX_BODY_BYTES} bytes.', 'error_code': 'BSE4015'}), 413
+    try:
+        encoding = request.headers.get('Content-Encoding', '').lower()
+        if encoding in ('gzip', 'deflate'):
+            decompressor = zlib.decompressobj(47) # wbits 47 = detect gzip or zlib container
+            body = decompressor.decompress(body, INGEST_MAX_DECOMPRESSED_BYTES)
+            if decompressor.unconsumed_tail:
+                metric_ingest_requests.inc('too_large')
+                return jsonify({
+                    'status': 'error',
+                    'message': f'Decompressed body exceeds {INGEST_MAX_DECOMPRESSED_BYTES} bytes.',
+                    'error_code': 'BSE4015'
+                }), 413
+            if not decompressor.eof:
+                raise ValueError("Truncated compressed body.")
+        elif encoding not in ('', 'identity'):
+            raise ValueError(f"Unsupported Content-Encoding '{encoding}'.")
+        payload = json.loads(body)
+        rows_by_pack = parse_ingest_frames(payload)
+    except (ValueError, zlib.error) as e:
+        metric_ingest_requests.inc('invalid')
+        return jsonify({'status': 'error', 'message': str(e), 'error_code': 'BSE4014'}), 400
+
+    try:
+        row_count = 0
+        for pack_id, rows in rows_by_pack.items():
+            rows.sort(key=lambda row: row[0])
+            for offset in range(0, len(rows), INGEST_INSERT_BATCH_ROWS):
+                if not insert_keyed_voltage_batch(rows[offset:offset + INGEST_INSERT_BATCH_ROWS], pack_id=pack_id, raise_permanent=True):
+                    metric_ingest_requests.inc('unavailable')
+                    return jsonify({
+                        'status': 'error',
+                        'message': 'Database unavailable. Resend the batch later.',
+                        'error_code': 'BSEDB013'
+                    }), 503
+            row_count += len(rows)
+        frame_count = len(payload['frames'])
+        metric_ingest_requests.inc('ok')
+        metric_ingest_frames.inc(amount=frame_count)
+        return jsonify({'status': 'success', 'frames': frame_count, 'rows': row_count, 'packs': sorted(rows_by_pack)})
+    except PermanentBatchError as e:
+        # The database rejects these rows themselves; resending them cannot help.
+        metric_ingest_requests.inc('invalid')
+        return jsonify({'status': 'error', 'message': f'Rows rejected by the database: {e}', 'error_code': 'BSE4014'}), 400
+    except Exception as e:
+        app.logger.error(f"Error in /api/ingest: {e}", exc_info=True)
+        metric_ingest_requests.inc('error')
+        return jsonify({'status': 'error', 'message': 'Failed to ingest frames.', 'error_code': 'BSE5013'}), 500
+
+@app.route('/api/archive', methods=['GET'])
+def get_archive_api():
+    """API endpoint listing archived day partitions per pack, plus the archive job's state.
+
+    Optional query param: pack (only that pack's days).
+    """
+    try:
+        pack_id = parse_pack_param() if request.args.get('pack') else None
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'error_code': 'BSE4016'}), 400
+
+    try:
+        packs = {}
+        if os.path.isdir(archive_worker.archive_dir):
+            for name in sorted(os.listdir(archive_worker.archive_dir)):
+                if not name.startswith('pack_') or (pack_id is not None and name != f"pack_{pack_id}"):
+                    continue
+                days = [day for day in os.listdir(os.path.join(archive_worker.archive_dir, name)) if not day.startswith('.')]
+                packs[name[len('pack_'):]] = sorted(days)
+        return jsonify({'status': 'success', 'archive': archive_worker.stats(), 'packs': packs})
+    except OSError as e:
+        app.logger.error(f"Error in /api/archive: {e}", exc_info=True)
+        return jsonify({'status': 'error', 'message': 'Failed to list archive partitions.', 'error_code': 'BSE5014'}), 500
+
+@app.route('/api/archive/export', methods=['GET'])
+def export_archive_api():
+    """API endpoint to download a date range of archived readings as one compressed .npz file.
+
+    Query params: start, end (ISO-8601, end exclusive, at most ARCHIVE_EXPORT_MAX_DAYS apart),
+    pack (default LOCAL_PACK_ID), cells (e.g. 1,2,3). Served from the memory-mapped partitions only,
+    MariaDB is never queried. Days without a partition are listed in X-Archive-Missing-Days.
+    The file holds timestamp_us (int64 Unix microseconds), cell (uint16) and voltage (float32):
+        data = numpy.load('voltage_archive.npz')
+    """
+    if not NUMPY_AVAILABLE:
+        return jsonify({'status': 'error', 'message': 'The columnar archive requires numpy.', 'error_code': 'BSE5015'}), 501
+    try:
+        start = parse_datetime_param('start')
+        end = parse_datetime_param('end')
+        if start is None or end is None:
+            raise ValueError("'start' and 'end' are required.")
+        if end <= start:
+            raise ValueError("'end' must be after 'start'.")
+        if end - start > timedelta(days=ARCHIVE_EXPORT_MAX_DAYS):
+            raise ValueError(f"The range may span at most {ARCHIVE_EXPORT_MAX_DAYS} days.")
+        pack_id = parse_pack_param()
+        cells = parse_cells_param()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'error_code': 'BSE4016'}), 400
+
+    try:
+        slices, missing_days = read_archive_range(pack_id, start, end, cells, archive_worker.archive_dir)
+    except (OSError, ValueError) as e:
+        app.logger.error(f"Error in /api/archive/export: {e}", exc_info=True)
+        return jsonify({'status': 'error', 'message': 'Failed to read archive partitions.', 'error_code': 'BSE5015'}), 500
+
+    download_name = f"voltage_archive_pack{pack_id}_{start.strftime('%Y%m%d')}_{end.strftime('%Y%m%d')}.npz"
+    return Response(
+        iter_archive_export(slices),
+        mimetype='application/octet-stream',
+        headers={
+            'Content-Disposition': f'attachment; filename={download_name}',
+            'X-Archive-Rows': str(sum(len(item['cell']) for item in slices)),
+            'X-Archive-Missing-Days': ','.join(missing_days),
+        }
+    )
+
 @app.route('/api/dashboard', methods=['GET'])
 def get_dashboard_data_api():
-    """API endpoint for aggregate statistics."""
-    conn = None
-    cursor = None
+    """API endpoint for aggregate statistics of one pack (?pack=, default the local pack).
+
+    Answered from the running per-cell aggregates in O(cells of the pack), independent of table size
+    and of the number of packs. They are loaded at startup (or by the rollup job once the DB is
+    reachable), never by a request.
+    """
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'status': 'error', 'message': 'Database connection failed for dashboard data.', 'error_code': 'BSEDB003'}), 500
-    
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("SELECT COUNT(*) as total FROM voltage_readings WHERE voltage IS NOT NULL") 
-        total_readings_row = cursor.fetchone()
-        total_readings = total_readings_row.get('total', 0) if total_readings_row else 0
-        
-        cursor.execute("""
-            SELECT cell_number, AVG(voltage) as avg_voltage
-            FROM voltage_readings
-            WHERE voltage IS NOT NULL AND voltage > 0  
-            GROUP BY cell_number
-        """)
-        avg_voltages_rows = cursor.fetchall()
+        pack_id = parse_pack_param()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'error_code': 'BSE4017'}), 400
+
+    try:
+        if not cell_aggregates.loaded:
+            return jsonify({'status': 'error', 'message': 'Dashboard aggregates are not loaded yet (database unreachable at startup).', 'error_code': 'BSEDB003'}), 503
+
+        aggregates = cell_aggregates.snapshot(pack_id)
+        total_readings = 0
         avg_voltages_processed = []
-        for row in avg_voltages_rows:
-            avg_voltage_val = None
-            if row.get('avg_voltage') is not None:
-                try:
-                    avg_voltage_val = round(float(row['avg_voltage']), 3)
-                except (ValueError, TypeError):
-                    app.logger.warning(f"Could not convert avg_voltage {row['avg_voltage']} to float for dashboard.")
-            avg_voltages_processed.append({
-                'cell': int(row['cell_number']),
-                'avg_voltage': avg_voltage_val
-            })
-        
-        cursor.execute("SELECT MAX(timestamp) as latest FROM voltage_readings WHERE voltage IS NOT NULL") 
-        latest_timestamp_row = cursor.fetchone()
+        latest_dt_object = None
+        for cell in sorted(aggregates):
+            values = aggregates[cell]
+            total_readings += values['reading_count']
+            if values['last_timestamp'] is not None and (latest_dt_object is None or values['last_timestamp'] > latest_dt_object):
+                latest_dt_object = values['last_timestamp']
+            if values['nonzero_count'] > 0:
+                # Time-weighted (see AVERAGE_MAX_HOLD_SECONDS) once a nonzero value has been held.
+                if values['held_seconds'] > 0:
+                    avg_voltage = values['held_sum'] / values['held_seconds']
+                else:
+                    avg_voltage = values['nonzero_sum'] / values['nonzero_count']
+                avg_voltages_processed.append({
+                    'cell': cell,
+                    'avg_voltage': round(avg_voltage, 3),
+                    'min_voltage': values['min_voltage'],
+                    'max_voltage': values['max_voltage']
+                })
+
         latest_timestamp_iso = None
-        if latest_timestamp_row and latest_timestamp_row.get('latest'):
-            latest_dt_object = latest_timestamp_row['latest']
-            if isinstance(latest_dt_object, datetime):
-                latest_timestamp_iso = latest_dt_object.isoformat()
-            else: 
-                try:
-                    parsed_dt = datetime.fromisoformat(str(latest_dt_object))
-                    latest_timestamp_iso = parsed_dt.isoformat()
-                except ValueError:
-                    app.logger.warning(f"Could not parse latest_timestamp '{latest_dt_object}' as datetime.")
-                    latest_timestamp_iso = str(latest_dt_object) 
+        if isinstance(latest_dt_object, datetime):
+            latest_timestamp_iso = latest_dt_object.isoformat()
+        elif latest_dt_object is not None:
+            latest_timestamp_iso = str(latest_dt_object)
         
         return jsonify({
             'status': 'success',
@@ -472,28 +3396,64 @@ def get_dashboard_data_api():
             'latest_reading_timestamp': latest_timestamp_iso,    
             'timestamp': datetime.now().isoformat() 
         })
-    except mariadb.Error as e:
-        app.logger.error(f"Database error in /api/dashboard: {e}", exc_info=True)
-        return jsonify({'status': 'error', 'message': 'Database error fetching dashboard data.', 'error_code': 'BSEDB004'}), 500
     except Exception as e:
         app.logger.error(f"Error in /api/dashboard: {e}", exc_info=True)
         return jsonify({'status': 'error', 'message': 'An internal server error fetching dashboard data.', 'error_code': 'BSE5008'}), 500
-    finally:
-        if cursor:
-            try:
-                cursor.close()
-            except mariadb.Error as e_cur:
-                app.logger.error(f"Error closing cursor in get_dashboard_data_api: {e_cur}")
-        if conn:
-            try:
-                if hasattr(conn, '_closed') and not conn._closed:
-                     conn.close()
-                elif not hasattr(conn, '_closed'):
-                     conn.close()
-            except mariadb.Error as e_conn:
-                app.logger.error(f"Error closing connection in get_dashboard_data_api: {e_conn}")
 
 
+@app.route('/api/db/pool', methods=['GET'])
+def get_db_pool_stats_api():
+    """API endpoint exposing connection pool counters, used to size DB_POOL_SIZE."""
+    return jsonify({
+        'status': 'success',
+        'pool': db_pool.stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/api/db/writer', methods=['GET'])
+def get_db_writer_stats_api():
+    """API endpoint exposing write-behind buffer and spool counters (queue depth, spool depth, drops)."""
+    return jsonify({
+        'status': 'success',
+        'writer': voltage_writer.stats(),
+        'spool': {**voltage_spool.stats(), 'drainer': spool_drainer.stats()} if voltage_spool is not None else None,
+        'storage_policy': storage_policy.stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+metrics.gauge('writer_queue_depth', 'Rows waiting in the write-behind buffer.', lambda: voltage_writer.stats()['queue_depth'])
+metrics.gauge('writer_rows_dropped_total', 'Rows the write-behind buffer dropped.',
+              lambda: {('queue_full',): voltage_writer.stats()['dropped_queue_full'],
+                       ('sink_error',): voltage_writer.stats()['dropped_db_error']},
+              ('reason',), metric_type='counter')
+metrics.gauge('spool_depth', 'Rows waiting in the local spool for replay into MariaDB.',
+              lambda: voltage_spool.stats()['depth'] if voltage_spool is not None else 0)
+metrics.gauge('spool_rows_dropped_total', 'Oldest spooled rows discarded because the spool was full.',
+              lambda: voltage_spool.stats()['dropped_full'] if voltage_spool is not None else 0, metric_type='counter')
+metrics.gauge('spool_rows_dead_lettered_total', 'Spooled rows MariaDB rejected for good, kept in the dead letter table.',
+              lambda: voltage_spool.stats()['dead_lettered'] if voltage_spool is not None else 0, metric_type='counter')
+metrics.gauge('sse_subscribers', 'Open live stream connections.', lambda: voltage_broadcaster.subscriber_count)
+metrics.gauge('alerts_active', 'Currently active alerts.', lambda: len(alert_engine.active()))
+metrics.gauge('archive_partitions_written_total', 'Day partitions written by the archive job.',
+              lambda: archive_worker.partitions_written, metric_type='counter')
+metrics.gauge('db_pool_up', '1 while the database connection pool exists, 0 while MariaDB is unreachable.',
+              lambda: int(db_pool.stats()['pool_active']))
+metrics.gauge('db_pool_timeouts_total', 'Pool checkouts that timed out.', lambda: db_pool.stats()['timeouts'],
+              metric_type='counter')
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics_api():
+    """API endpoint exposing counters and timing histograms in Prometheus text format."""
+    try:
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        app.logger.error(f"Error in /api/metrics: {e}", exc_info=True)
+        return jsonify({
+            'status': 'error',
+            'message': 'An internal server error occurred while collecting metrics.',
+            'error_code': 'BSE5011'
+        }), 500
+
 def create_db_and_table():
     """Creates the database and table if they don't exist."""
     conn_no_db = None
@@ -515,7 +3475,7 @@ def create_db_and_table():
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS voltage_readings (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
                     cell_number TINYINT NOT NULL,
                     voltage DECIMAL(5, 3), 
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -523,6 +3483,164 @@ def create_db_and_table():
                 )
             """)
             app.logger.info("Table 'voltage_readings' ensured (voltage as DECIMAL(5,3)) with index.")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS voltage_cell_summary (
+                    pack_id SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+                    cell_number SMALLINT UNSIGNED NOT NULL,
+                    reading_count BIGINT UNSIGNED NOT NULL DEFAULT 0,
+                    nonzero_count BIGINT UNSIGNED NOT NULL DEFAULT 0,
+                    nonzero_sum DOUBLE NOT NULL DEFAULT 0,
+                    min_voltage DECIMAL(5, 3),
+                    max_voltage DECIMAL(5, 3),
+                    last_timestamp TIMESTAMP NULL,
+                    held_sum DOUBLE NOT NULL DEFAULT 0,
+                    held_seconds DOUBLE NOT NULL DEFAULT 0,
+                    last_voltage DECIMAL(5, 3) NULL,
+                    PRIMARY KEY (pack_id, cell_number)
+                )
+            """)
+            cursor.execute("""
+                SELECT COUNT(*) FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'voltage_cell_summary' AND COLUMN_NAME = 'pack_id'
+            """)
+            if cursor.fetchone()[0] == 0:
+                # Existing rows summarize the local pack; other packs are seeded by cell_aggregates.load().
+                app.logger.warning("Adding pack_id to voltage_cell_summary.")
+                cursor.execute("""
+                    ALTER TABLE voltage_cell_summary
+                        ADD COLUMN pack_id SMALLINT UNSIGNED NOT NULL DEFAULT 0 FIRST,
+                        DROP PRIMARY KEY,
+                        ADD PRIMARY KEY (pack_id, cell_number)
+                """)
+            cursor.execute("""
+                SELECT COUNT(*) FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'voltage_cell_summary' AND COLUMN_NAME = 'held_seconds'
+            """)
+            if cursor.fetchone()[0] == 0:
+                # Rows summarized before time-weighted averages count one sample interval each.
+                app.logger.warning("Adding time-weighted columns to voltage_cell_summary.")
+                cursor.execute("""
+                    ALTER TABLE voltage_cell_summary
+                        ADD COLUMN held_sum DOUBLE NOT NULL DEFAULT 0,
+                        ADD COLUMN held_seconds DOUBLE NOT NULL DEFAULT 0,
+                        ADD COLUMN last_voltage DECIMAL(5, 3) NULL
+                """)
+                cursor.execute("UPDATE voltage_cell_summary SET held_sum = nonzero_sum * %s, held_seconds = nonzero_count * %s",
+                               (SAMPLE_INTERVAL_SECONDS, SAMPLE_INTERVAL_SECONDS))
+                conn.commit()
+            app.logger.info("Table 'voltage_cell_summary' ensured.")
+            # Plain timestamp index for retention deletes across all packs.
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON voltage_readings (timestamp)")
+            cursor.execute("ALTER TABLE voltage_readings ADD COLUMN IF NOT EXISTS seq BIGINT UNSIGNED NULL")
+            cursor.execute("ALTER TABLE voltage_readings ADD COLUMN IF NOT EXISTS pack_id SMALLINT UNSIGNED NOT NULL DEFAULT 0")
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_pack_seq_cell ON voltage_readings (pack_id, seq, cell_number)")
+            cursor.execute("""
+                SELECT DATA_TYPE FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'voltage_readings' AND COLUMN_NAME = 'id'
+            """)
+            column = cursor.fetchone()
+            if column and column[0].lower() != 'bigint':
+                # A signed INT runs out after about 2.1e9 rows (days with hundreds of packs at 1 Hz), and
+                # retention deletes never give ids back.
+                app.logger.warning("Widening voltage_readings.id to BIGINT UNSIGNED (rebuilds the table).")
+                cursor.execute("ALTER TABLE voltage_readings MODIFY id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT")
+            cursor.execute("DROP INDEX IF EXISTS uq_seq_cell ON voltage_readings")
+            # Every read is scoped to one pack. InnoDB appends the primary key to secondary indexes, so these
+            # are also the (timestamp, id) keys of /api/history pages, for all cells and per cell.
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_pack_timestamp ON voltage_readings (pack_id, timestamp)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_pack_cell_timestamp ON voltage_readings (pack_id, cell_number, timestamp)")
+            if PYTHON_NUMBER_OF_CELLS > 127:
+                # The original TINYINT column tops out at cell 127; widen it once for large device maps.
+                cursor.execute("""
+                    SELECT DATA_TYPE FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'voltage_readings' AND COLUMN_NAME = 'cell_number'
+                """)
+                column = cursor.fetchone()
+                if column and column[0].lower() == 'tinyint':
+                    app.logger.warning("Widening voltage_readings.cell_number to SMALLINT UNSIGNED (rebuilds the table).")
+                    cursor.execute("ALTER TABLE voltage_readings MODIFY cell_number SMALLINT UNSIGNED NOT NULL")
+            for table, _, _, _ in ROLLUP_LEVELS:
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        pack_id SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+                        cell_number SMALLINT UNSIGNED NOT NULL,
+                        bucket_start DATETIME NOT NULL,
+                        min_voltage DECIMAL(5, 3),
+                        max_voltage DECIMAL(5, 3),
+                        sum_voltage DOUBLE NOT NULL DEFAULT 0,
+                        sample_count INT UNSIGNED NOT NULL DEFAULT 0,
+                        weighted_sum DOUBLE NOT NULL DEFAULT 0,
+                        weight_seconds DOUBLE NOT NULL DEFAULT 0,
+                        PRIMARY KEY (pack_id, cell_number, bucket_start),
+                        INDEX idx_bucket_start (bucket_start)
+                    )
+                """)
+                cursor.execute("""
+                    SELECT COUNT(*) FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'pack_id'
+                """, (table,))
+                if cursor.fetchone()[0] == 0:
+                    app.logger.warning(f"Adding pack_id to {table} (rebuilds the table).")
+                    cursor.execute(f"""
+                        ALTER TABLE {table}
+                            ADD COLUMN pack_id SMALLINT UNSIGNED NOT NULL DEFAULT 0 FIRST,
+                            DROP PRIMARY KEY,
+                            ADD PRIMARY KEY (pack_id, cell_number, bucket_start)
+                    """)
+                cursor.execute("""
+                    SELECT COUNT(*) FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'weight_seconds'
+                """, (table,))
+                if cursor.fetchone()[0] == 0:
+                    # Buckets built before time-weighted averages count one sample interval per row.
+                    app.logger.warning(f"Adding time-weighted columns to {table}.")
+                    cursor.execute(f"""
+                        ALTER TABLE {table}
+                            ADD COLUMN weighted_sum DOUBLE NOT NULL DEFAULT 0,
+                            ADD COLUMN weight_seconds DOUBLE NOT NULL DEFAULT 0
+                    """)
+                    cursor.execute(f"UPDATE {table} SET weighted_sum = sum_voltage * %s, weight_seconds = sample_count * %s",
+                                   (SAMPLE_INTERVAL_SECONDS, SAMPLE_INTERVAL_SECONDS))
+                    conn.commit()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS voltage_alerts (
+                    id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+                    rule_name VARCHAR(64) NOT NULL,
+                    severity VARCHAR(16) NOT NULL,
+                    cell_number SMALLINT UNSIGNED NULL,
+                    state VARCHAR(16) NOT NULL,
+                    value DOUBLE NULL,
+                    message VARCHAR(255) NOT NULL,
+                    created_at DATETIME(3) NOT NULL,
+                    INDEX idx_created_at (created_at)
+                )
+            """)
+            app.logger.info("Table 'voltage_alerts' ensured.")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS voltage_rollup_state (
+                    table_name VARCHAR(64) NOT NULL PRIMARY KEY,
+                    rolled_up_to DATETIME NOT NULL
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS voltage_rollup_dirty (
+                    table_name VARCHAR(64) NOT NULL,
+                    pack_id SMALLINT UNSIGNED NOT NULL,
+                    dirty_since DATETIME NOT NULL,
+                    marked_at DATETIME(6) NOT NULL,
+                    PRIMARY KEY (table_name, pack_id)
+                )
+            """)
+            app.logger.info("Rollup tables ensured.")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS voltage_archive_dirty (
+                    pack_id SMALLINT UNSIGNED NOT NULL,
+                    day DATE NOT NULL,
+                    marked_at DATETIME(6) NOT NULL,
+                    PRIMARY KEY (pack_id, day)
+                )
+            """)
+            app.logger.info("Table 'voltage_archive_dirty' ensured.")
         else:
             app.logger.error("Failed to connect to database to create table 'voltage_readings'.")
 
@@ -531,32 +3649,17 @@ def create_db_and_table():
     except Exception as e_gen:
         app.logger.error(f"A non-MariaDB error occurred during database/table setup: {e_gen}")
     finally:
-        if cursor_no_db:
-            try:
-                cursor_no_db.close()
-            except mariadb.Error as e_cur_ndb: app.logger.error(f"Error closing no_db cursor: {e_cur_ndb}")
-        if conn_no_db:
-            try:
-                if hasattr(conn_no_db, '_closed') and not conn_no_db._closed:
-                     conn_no_db.close()
-                elif not hasattr(conn_no_db, '_closed'):
-                     conn_no_db.close() 
-            except mariadb.Error as e_conn_ndb: app.logger.error(f"Error closing no_db connection: {e_conn_ndb}")
-        if cursor:
-            try:
-                cursor.close()
-            except mariadb.Error as e_cur_db: app.logger.error(f"Error closing db cursor: {e_cur_db}")
-        if conn:
-            try:
-                if hasattr(conn, '_closed') and not conn._closed:
-                     conn.close()
-                elif not hasattr(conn, '_closed'):
-                     conn.close()
-            except mariadb.Error as e_conn_db: app.logger.error(f"Error closing db connection: {e_conn_db}")
+        close_db_resources(cursor_no_db, conn_no_db, 'create_db_and_table (no database)')
+        close_db_resources(cursor, conn, 'create_db_and_table')
 
 
 if __name__ == '__main__':
     create_db_and_table() 
+    cell_aggregates.load()
+    # With the debug reloader, only the serving child process (WERKZEUG_RUN_MAIN) owns the I2C bus.
+    # Otherwise the sampler is started lazily by the first API request.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        ensure_background_services()
     app.logger.info("Battery Monitor Flask API starting...")
     app.run(debug=True, host='0.0.0.0', port=5000)
 
@@ -0,0 +1,55 @@
+"""Export a date range of the columnar archive as one compressed .npz file, without MariaDB.
+
+Run from the repository root (or anywhere ARCHIVE_DIR is readable):
+
+    python archive_export.py --start 2024-05-01 --end 2024-06-01 --pack 3 --out may.npz
+
+--end is exclusive. The file holds timestamp_us (int64 Unix microseconds), cell (uint16) and
+voltage (float32) columns; load it with numpy.load('may.npz'). For analysis in place, the day
+partitions can also be memory-mapped directly with app.read_archive_range().
+
+With --archive-now, finished days are archived first (this needs MariaDB).
+"""
+import argparse
+import sys
+from datetime import datetime
+
+import app as battery_app
+
+
+def parse_cells(value):
+    return sorted({int(part) for part in value.split(',') if part.strip()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--start', type=datetime.fromisoformat, required=True, help='ISO-8601 date or timestamp')
+    parser.add_argument('--end', type=datetime.fromisoformat, required=True, help='ISO-8601 date or timestamp (exclusive)')
+    parser.add_argument('--pack', type=int, default=battery_app.LOCAL_PACK_ID, help='Pack id (default: the local pack)')
+    parser.add_argument('--cells', type=parse_cells, default=None, help='Comma-separated cell numbers (default: all)')
+    parser.add_argument('--out', required=True, help='Output .npz path')
+    parser.add_argument('--archive-dir', default=battery_app.ARCHIVE_DIR, help='Archive directory (default: ARCHIVE_DIR)')
+    parser.add_argument('--archive-now', action='store_true', help='Archive finished days from MariaDB first')
+    args = parser.parse_args()
+    if not battery_app.NUMPY_AVAILABLE:
+        parser.error('the columnar archive requires numpy')
+    if args.end <= args.start:
+        parser.error('--end must be after --start')
+
+    if args.archive_now:
+        worker = battery_app.ArchiveWorker(archive_dir=args.archive_dir)
+        worker.run_once()
+        print(f"Archive: {worker.partitions_written} partitions written, archived until {worker.stats()['archived_until']}")
+
+    slices, missing_days = battery_app.read_archive_range(args.pack, args.start, args.end, args.cells, args.archive_dir)
+    with open(args.out, 'wb') as f:
+        for chunk in battery_app.iter_archive_export(slices):
+            f.write(chunk)
+    rows = sum(len(item['cell']) for item in slices)
+    print(f"Wrote {rows} rows of pack {args.pack} to {args.out}.")
+    if missing_days:
+        print(f"Not archived (yet): {', '.join(missing_days)}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
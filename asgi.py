@@ -0,0 +1,176 @@
+"""Async (ASGI) serving mode for the Battery Monitor API.
+
+The SSE stream at /api/voltage/stream is served natively on the event loop: each
+subscriber is a coroutine waiting on one shared asyncio event, so an open dashboard
+costs a few KB instead of a whole OS thread. Every other route is the regular Flask
+app, run through asgiref's WSGI adapter on a pool of WSGI_THREADS worker threads, so
+slow requests (exports, ingest) do not hold up the others.
+
+Run with:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import (
+    app, create_db_and_table, cell_aggregates, ensure_background_services, log_rate_limited, stream_encoder,
+    voltage_broadcaster, SSE_KEEPALIVE_SECONDS, STREAM_ENCODINGS
+)
+
+SSE_RETRY_MILLISECONDS = 3000  # Reconnect delay suggested to EventSource clients
+WSGI_THREADS = 16  # Flask requests served concurrently (like a threaded WSGI server)
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'access-control-allow-origin', b'*'),
+    (b'x-accel-buffering', b'no'),  # Disable proxy buffering (nginx)
+]
+
+
+class AsyncSnapshotBridge:
+    """Hands sampler snapshots from the acquisition thread to the event loop.
+
+    Every waiting stream is woken through a single shared asyncio.Event that is swapped
+    per frame. Encoded frames are cached on the snapshot by stream_encoder, so each
+    encoding is serialized once no matter how many streams use it.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._event = None
+        self._snapshot = None
+
+    def attach(self, loop):
+        if self._loop is not None:
+            return
+        self._loop = loop
+        self._event = asyncio.Event()
+        voltage_broadcaster.add_listener(self._on_publish)
+        snapshot = voltage_broadcaster.latest()
+        if snapshot is not None:
+            self._deliver(snapshot)
+
+    def _on_publish(self, snapshot):
+        # Called on the sampler thread.
+        self._loop.call_soon_threadsafe(self._deliver, snapshot)
+
+    def _deliver(self, snapshot):
+        if self._snapshot is not None and snapshot['seq'] <= self._snapshot['seq']:
+            return
+        self._snapshot = snapshot
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait_for_next(self, last_seq):
+        """Return the first snapshot newer than last_seq."""
+        while self._snapshot is None or self._snapshot['seq'] <= last_seq:
+            await self._event.wait()
+        return self._snapshot
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that runs each request on its own pool thread.
+
+    asgiref's adapter runs the WSGI app with sync_to_async(thread_sensitive=True), which puts
+    every request on one shared thread: requests are served strictly one after another.
+    """
+
+    def __init__(self, wsgi_application, threads=WSGI_THREADS):
+        super().__init__(wsgi_application)
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+        class Instance(WsgiToAsgiInstance):
+            run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False, executor=executor)
+
+        self._instance_class = Instance
+
+    async def __call__(self, scope, receive, send):
+        await self._instance_class(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+bridge = AsyncSnapshotBridge()
+flask_application = ThreadPoolWsgiToAsgi(app)
+
+
+async def send_json_error(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def voltage_stream(scope, receive, send):
+    """Native async SSE endpoint with keep-alive comments and disconnect detection."""
+    encoding = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('encoding', ['json'])[0]
+    if encoding not in STREAM_ENCODINGS:
+        await send_json_error(send, 400, {
+            'status': 'error',
+            'message': f"Unknown stream encoding '{encoding}'. Expected one of: {', '.join(STREAM_ENCODINGS)}.",
+            'error_code': 'BSE4011'
+        })
+        return
+
+    bridge.attach(asyncio.get_running_loop())
+    ensure_background_services()
+    stream_task = asyncio.current_task()
+
+    async def watch_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                stream_task.cancel()
+                return
+
+    watcher = asyncio.create_task(watch_disconnect())
+    voltage_broadcaster.subscribe()
+    log_rate_limited('sse_connect', logging.INFO, "Starting async SSE voltage stream.")
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+        await send({'type': 'http.response.body', 'body': f"retry: {SSE_RETRY_MILLISECONDS}\n\n".encode(), 'more_body': True})
+        last_seq = 0
+        while True:
+            try:
+                snapshot = await asyncio.wait_for(bridge.wait_for_next(last_seq), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                frame = b": keep-alive\n\n"
+            else:
+                frame = stream_encoder.frame(snapshot, encoding, last_seq)
+                last_seq = snapshot['seq']
+            await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+    except (asyncio.CancelledError, OSError):
+        log_rate_limited('sse_disconnect', logging.INFO, "Async SSE voltage stream client disconnected.")
+    finally:
+        watcher.cancel()
+        voltage_broadcaster.unsubscribe()
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(None, create_db_and_table)
+            await asyncio.get_running_loop().run_in_executor(None, cell_aggregates.load)
+            bridge.attach(asyncio.get_running_loop())
+            ensure_background_services()
+            app.logger.info("Battery Monitor ASGI API starting...")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/api/voltage/stream' and scope['method'] == 'GET':
+        await voltage_stream(scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
@@ -0,0 +1,52 @@
+"""Frames-per-second benchmark for the two ADC scan modes.
+
+Run on the Raspberry Pi from the repository root:
+
+    python benchmarks/adc_scan_benchmark.py --frames 200
+
+Off-device, the same benchmark runs against the simulated ADC backend:
+
+    BATTERY_MONITOR_ADC_BACKEND=simulated BATTERY_MONITOR_SIM_CELLS=1000 python benchmarks/adc_scan_benchmark.py
+
+Each mode reads full frames (all PYTHON_NUMBER_OF_CELLS channels) back to back
+and reports frames per second and the mean time per frame.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adc  # noqa: E402
+
+
+def run_mode(scan_mode, frames):
+    """Read `frames` full frames in the given scan mode and return (frames_per_second, mean_ms)."""
+    adc.read_all_voltages(scan_mode=scan_mode)  # Warm-up, also primes the block-read state
+    started = time.perf_counter()
+    for _ in range(frames):
+        adc.read_all_voltages(scan_mode=scan_mode)
+    elapsed = time.perf_counter() - started
+    return frames / elapsed, (elapsed / frames) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=100, help='Frames to read per mode (default: 100)')
+    parser.add_argument('--modes', nargs='+', default=['per_channel', 'auto_increment'],
+                        choices=['per_channel', 'auto_increment'])
+    args = parser.parse_args()
+
+    print(f"Cells per frame: {adc.PYTHON_NUMBER_OF_CELLS}, frames per mode: {args.frames}")
+    for scan_mode in args.modes:
+        try:
+            fps, mean_ms = run_mode(scan_mode, args.frames)
+        except IOError as e:
+            print(f"{scan_mode:>15}: unavailable ({e})")
+            continue
+        print(f"{scan_mode:>15}: {fps:8.1f} frames/s  {mean_ms:8.2f} ms/frame")
+
+
+if __name__ == '__main__':
+    main()
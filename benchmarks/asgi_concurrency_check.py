@@ -0,0 +1,73 @@
+"""Check that the ASGI serving mode runs Flask requests concurrently.
+
+Run from the repository root (needs asgiref, not a running server or database):
+
+    python benchmarks/asgi_concurrency_check.py --requests 4 --delay 1
+
+Sends --requests concurrent requests, each taking --delay seconds, through the same WSGI
+adapter asgi.py uses for every Flask route, and through plain asgiref WsgiToAsgi for
+comparison. With overlapping requests the total is about one delay, not requests x delay.
+Exits with status 1 if the requests did not overlap.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asgiref.wsgi import WsgiToAsgi  # noqa: E402
+
+from asgi import ThreadPoolWsgiToAsgi  # noqa: E402
+
+
+def make_slow_wsgi_app(delay):
+    def slow_app(environ, start_response):
+        time.sleep(delay)  # Stands in for a long export or ingest request
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+    return slow_app
+
+
+async def one_request(application):
+    scope = {'type': 'http', 'method': 'GET', 'path': '/slow', 'query_string': b'', 'headers': [], 'http_version': '1.1'}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status']
+
+
+async def timed_burst(application, requests):
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*(one_request(application) for _ in range(requests)))
+    assert all(status == 200 for status in statuses), statuses
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=4, help='Concurrent requests (default: 4)')
+    parser.add_argument('--delay', type=float, default=1.0, help='Seconds each request takes (default: 1)')
+    args = parser.parse_args()
+
+    wsgi_app = make_slow_wsgi_app(args.delay)
+    pooled = asyncio.run(timed_burst(ThreadPoolWsgiToAsgi(wsgi_app), args.requests))
+    shared = asyncio.run(timed_burst(WsgiToAsgi(wsgi_app), args.requests))
+    print(f"{args.requests} concurrent {args.delay}s requests")
+    print(f"  asgi.py adapter (thread pool): {pooled:6.2f} s")
+    print(f"  asgiref WsgiToAsgi (one thread): {shared:6.2f} s")
+    if pooled >= 2 * args.delay:
+        print("FAIL: requests did not overlap.")
+        sys.exit(1)
+    print("OK: requests overlap.")
+
+
+if __name__ == '__main__':
+    main()
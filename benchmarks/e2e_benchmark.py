@@ -0,0 +1,434 @@
+"""End-to-end benchmark for acquisition, ingest, API endpoints and SSE fan-out.
+
+Runs against a local MariaDB server, in a throwaway database that is created for
+the run and dropped afterwards, with the simulated ADC backend (the background sampler
+keeps running at SAMPLE_INTERVAL_SECONDS while the endpoints are measured, as in production).
+Needs asgiref, like the ASGI serving mode. From the repository root:
+
+    python benchmarks/e2e_benchmark.py --sizes 10000 100000 1000000
+    python benchmarks/e2e_benchmark.py --sizes 10000 10000000 --baseline benchmarks/results/e2e-previous.json
+
+Measured:
+  acquisition  frames/s and cells/s of read_all_voltages() on the simulated ADC
+  ingest       rows/s accepted by the write-behind buffer, rows/s appended to the spool
+               and rows/s committed to MariaDB, both by the drainer and by insert_voltage_batch()
+  endpoints    p50/p99 latency of /api/voltage, /api/history, /api/dashboard and /api/download
+               after growing voltage_readings to each of --sizes rows
+  sse_fanout   delivery latency and CPU time per subscriber and frame for 1..N in-process clients
+               of the ASGI stream endpoint (asgi.application), alongside the background sampler
+
+Results are written as JSON (--output). With --baseline, every latency and throughput figure
+is compared against an earlier result file and changes beyond --tolerance are flagged.
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault('BATTERY_MONITOR_ADC_BACKEND', 'simulated')
+# The API endpoints start the background sampler; keep its spool away from the production spool file.
+SCRATCH_DIR = tempfile.mkdtemp(prefix='battery-benchmark-')
+atexit.register(shutil.rmtree, SCRATCH_DIR, True)  # Registered first, so it runs after the app's shutdown hook
+os.environ['BATTERY_MONITOR_SPOOL_PATH'] = os.path.join(SCRATCH_DIR, 'voltage_spool.sqlite3')
+
+import adc  # noqa: E402
+import app as battery_app  # noqa: E402
+import asgi  # noqa: E402
+
+SEED_BATCH_ROWS = 10000  # Rows per insert_voltage_batch() call while growing the table
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(samples_seconds):
+    """Summarize latencies (seconds) as milliseconds."""
+    ordered = sorted(samples_seconds)
+    return {
+        'requests': len(ordered),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000.0, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000.0, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000.0, 3),
+        'max_ms': round(ordered[-1] * 1000.0, 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def table_row_count():
+    conn = battery_app.get_db_connection()
+    if not conn:
+        raise RuntimeError("Benchmark database is not reachable.")
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM voltage_readings")
+        return cursor.fetchone()[0]
+    finally:
+        battery_app.close_db_resources(cursor, conn, 'benchmark row count')
+
+
+def drop_database(name):
+    conn = battery_app.mariadb.connect(
+        host=battery_app.db_config['host'],
+        user=battery_app.db_config['user'],
+        password=battery_app.db_config['password']
+    )
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP DATABASE IF EXISTS {name}")
+    finally:
+        battery_app.close_db_resources(cursor, conn, 'benchmark drop database')
+
+
+def simulated_frames(count):
+    """Read `count` frames from the simulated ADC. Returns (frames, elapsed_seconds)."""
+    frames = []
+    started = time.perf_counter()
+    for _ in range(count):
+        frames.append(battery_app.read_all_voltages())
+    return frames, time.perf_counter() - started
+
+
+def bench_acquisition(frame_count):
+    frames, elapsed = simulated_frames(frame_count)
+    cells = battery_app.PYTHON_NUMBER_OF_CELLS
+    return {
+        'cells': cells,
+        'frames': frame_count,
+        'frames_per_second': round(frame_count / elapsed, 1),
+        'cells_per_second': round(frame_count * cells / elapsed, 1),
+    }, frames
+
+
+def bench_ingest(frames, spool_dir, drain_timeout):
+    """Push frames through writer -> spool -> drainer -> MariaDB and time every stage."""
+    # Frames 1 ms apart, ending now: no row is stamped in the future. The direct inserts below
+    # reuse them shifted back by the span, so both sets are in the past and never share a seq.
+    rows = []
+    span = timedelta(milliseconds=len(frames))
+    origin = datetime.now() - span
+    for index, frame in enumerate(frames):
+        sample_time = origin + timedelta(milliseconds=index)
+        rows.extend((r['cell'], r['voltage'], sample_time) for r in frame if r['voltage'] is not None)
+
+    spool = battery_app.LocalSpool(os.path.join(spool_dir, 'bench_spool.sqlite3'), max_rows=len(rows) + 1)
+    writer = battery_app.VoltageWriter(sink=spool.append, max_rows=len(rows) + 1)
+    drainer = battery_app.SpoolDrainer(spool)
+    rows_before = table_row_count()
+
+    writer.start()
+    started = time.perf_counter()
+    for cell, voltage, timestamp in rows:
+        writer.submit(cell, voltage, timestamp)
+    submitted = time.perf_counter()
+    writer.stop(timeout=drain_timeout)
+    spooled = time.perf_counter()
+
+    drainer.start()
+    deadline = time.monotonic() + drain_timeout
+    while spool.stats()['depth'] > 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    drained = time.perf_counter()
+    drainer.stop()
+    spool.close()
+
+    committed = table_row_count() - rows_before
+    result = {
+        'rows': len(rows),
+        'submit_rows_per_second': round(len(rows) / (submitted - started), 1),
+        'spool_rows_per_second': round(len(rows) / (spooled - started), 1),
+        'drain_rows_per_second': round(committed / (drained - spooled), 1),
+        'rows_committed': committed,
+        'writer': writer.stats(),
+        'drainer': drainer.stats(),
+    }
+
+    # Direct batch inserts without the spool, in the writer's default batch size.
+    direct_rows = [(cell, voltage, timestamp - span) for cell, voltage, timestamp in rows]
+    started = time.perf_counter()
+    for offset in range(0, len(direct_rows), battery_app.DB_WRITE_BATCH_SIZE):
+        battery_app.insert_voltage_batch(direct_rows[offset:offset + battery_app.DB_WRITE_BATCH_SIZE])
+    result['insert_batch_rows_per_second'] = round(len(direct_rows) / (time.perf_counter() - started), 1)
+    return result
+
+
+class TableSeeder:
+    """Grows voltage_readings with deterministic 1 Hz history, going back in time from `origin`."""
+
+    def __init__(self, origin, seed=1):
+        self.origin = origin
+        self.frames_written = 0
+        self._rng = random.Random(seed)
+        self.cells = [entry['cell'] for entry in battery_app.DEVICE_MAP]
+
+    def grow_to(self, target_rows):
+        current = table_row_count()
+        started = time.perf_counter()
+        added = 0
+        while current + added < target_rows:
+            batch = []
+            while len(batch) < SEED_BATCH_ROWS and current + added + len(batch) < target_rows:
+                timestamp = self.origin - timedelta(seconds=self.frames_written)
+                self.frames_written += 1
+                batch.extend((cell, round(self._rng.uniform(3.0, 4.2), 3), timestamp) for cell in self.cells)
+            if not battery_app.insert_voltage_batch(batch):
+                raise RuntimeError("Seeding voltage_readings failed; see battery_monitor.log.")
+            added += len(batch)
+        return added, time.perf_counter() - started
+
+    @property
+    def oldest(self):
+        return self.origin - timedelta(seconds=self.frames_written)
+
+
+def time_requests(client, url, count, warmup=3):
+    samples = []
+    for attempt in range(warmup + count):
+        started = time.perf_counter()
+        response = client.get(url)
+        body = response.get_data()  # Drains streamed responses (/api/download)
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}: {body[:200]!r}")
+        if attempt >= warmup:
+            samples.append(elapsed)
+    return latency_summary(samples)
+
+
+def bench_endpoints(seeder, sizes, requests_per_endpoint, latest_frame):
+    client = battery_app.app.test_client()
+    sample_time = datetime.now()
+    battery_app.voltage_broadcaster.publish({
+        'status': 'success',
+        'readings': latest_frame,
+        'timestamp': sample_time.isoformat(),
+        'epoch_ms': int(sample_time.timestamp() * 1000)
+    })
+
+    results = {}
+    for size in sizes:
+        added, seed_seconds = seeder.grow_to(size)
+        print(f"  table at {table_row_count()} rows (+{added} in {seed_seconds:.1f}s)")
+        window_end = seeder.origin
+        window_start = window_end - timedelta(hours=1)
+        range_params = f"start={window_start.isoformat()}&end={window_end.isoformat()}"
+        endpoints = {
+            '/api/voltage': '/api/voltage',
+            '/api/history': '/api/history',
+            '/api/history (1h range)': f"/api/history?limit=5000&{range_params}",
+            '/api/dashboard': '/api/dashboard',
+            '/api/download (1h range)': f"/api/download?{range_params}",
+        }
+        results[str(size)] = {
+            name: time_requests(client, url, requests_per_endpoint) for name, url in endpoints.items()
+        }
+        for name, summary in results[str(size)].items():
+            print(f"    {name:>26}: p50 {summary['p50_ms']:9.2f} ms  p99 {summary['p99_ms']:9.2f} ms")
+    return results
+
+
+async def sse_fanout_run(count, frame_count, encoding, latest_frame, interval):
+    """Open `count` /api/voltage/stream requests on asgi.application and publish frame_count snapshots.
+
+    Frames go through the production path: voltage_broadcaster -> AsyncSnapshotBridge -> the
+    native SSE coroutine -> stream_encoder. Latency runs from publish() to the subscriber's send().
+    """
+    published = {}  # timestamp (json frames) or epoch_ms (other encodings) -> perf_counter at publish
+    latencies = []
+    connected = [0]
+    all_connected = asyncio.Event()
+    stop = asyncio.Event()
+    scope = {'type': 'http', 'method': 'GET', 'path': '/api/voltage/stream', 'query_string': f"encoding={encoding}".encode(),
+             'headers': [], 'http_version': '1.1'}
+
+    async def receive():
+        await stop.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        body = message.get('body', b'')
+        if body.startswith(b'retry:'):
+            connected[0] += 1
+            if connected[0] == count:
+                all_connected.set()
+        elif body.startswith(b'data: '):
+            payload = json.loads(body[len(b'data: '):])
+            published_at = published.get(payload.get('t', payload.get('timestamp')))
+            if published_at is not None:  # Not one of the background sampler's frames
+                latencies.append(time.perf_counter() - published_at)
+
+    def publish_frames():
+        for _ in range(frame_count):
+            sample_time = datetime.now()
+            snapshot = {
+                'status': 'success',
+                'readings': latest_frame,
+                'timestamp': sample_time.isoformat(),
+                'epoch_ms': int(sample_time.timestamp() * 1000),
+            }
+            published_at = time.perf_counter()
+            published[snapshot['timestamp']] = published[snapshot['epoch_ms']] = published_at
+            battery_app.voltage_broadcaster.publish(snapshot)
+            time.sleep(interval)
+
+    streams = [asyncio.create_task(asgi.application(scope, receive, send)) for _ in range(count)]
+    await all_connected.wait()
+    cpu_started = time.process_time()
+    await asyncio.get_running_loop().run_in_executor(None, publish_frames)
+    await asyncio.sleep(max(interval, 0.2))  # Let the last frame reach every subscriber
+    cpu_seconds = time.process_time() - cpu_started
+    stop.set()
+    await asyncio.gather(*streams)
+    return latencies, cpu_seconds
+
+
+async def bench_sse_fanout(subscriber_counts, frame_count, encoding, latest_frame, interval):
+    """Deliver frame_count snapshots to N in-process clients of the ASGI SSE endpoint.
+
+    Runs on one event loop throughout: asgi.bridge attaches to the first loop that serves a stream.
+    """
+    results = []
+    for count in subscriber_counts:
+        latencies, cpu_seconds = await sse_fanout_run(count, frame_count, encoding, latest_frame, interval)
+        summary = latency_summary(latencies)
+        summary.update({
+            'subscribers': count,
+            'frames': frame_count,
+            'deliveries': len(latencies),
+            'cpu_us_per_subscriber_frame': round(cpu_seconds / (count * frame_count) * 1e6, 2),
+        })
+        results.append(summary)
+        print(f"  {count:>5} subscribers: delivery p50 {summary['p50_ms']:7.2f} ms  p99 {summary['p99_ms']:7.2f} ms  "
+              f"{summary['cpu_us_per_subscriber_frame']:8.2f} us CPU per subscriber and frame")
+    return results
+
+
+def flatten_metrics(node, prefix=''):
+    """Yield (path, value) for every comparable number in a result tree."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from flatten_metrics(value, f"{prefix}/{key}" if prefix else key)
+    elif isinstance(node, list):
+        for item in node:
+            label = f"{item.get('subscribers')}_subscribers" if isinstance(item, dict) else ''
+            yield from flatten_metrics(item, f"{prefix}/{label}")
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        if prefix.endswith(('_ms', '_per_second', '_per_subscriber_frame')):
+            yield prefix, node
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = dict(flatten_metrics(json.load(f)['results']))
+    regressions = 0
+    print(f"\nComparison with {baseline_path} (tolerance {tolerance:.0%}):")
+    for path, value in flatten_metrics(results):
+        previous = baseline.get(path)
+        if not previous:
+            continue
+        ratio = value / previous
+        higher_is_better = path.endswith('_per_second')
+        worse = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+        better = ratio > 1 + tolerance if higher_is_better else ratio < 1 - tolerance
+        if worse or better:
+            regressions += worse
+            print(f"  {'REGRESSION' if worse else 'improved':>10}  {path}: {previous} -> {value} ({ratio:.2f}x)")
+    print(f"  {regressions} regression(s).")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='i2c_db_benchmark', help='Throwaway database name (default: i2c_db_benchmark)')
+    parser.add_argument('--keep-database', action='store_true', help='Do not drop the database afterwards')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='voltage_readings sizes (rows) to measure the endpoints at, ascending')
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per endpoint and size')
+    parser.add_argument('--ingest-frames', type=int, default=2000, help='Simulated frames pushed through ingest')
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--sse-frames', type=int, default=50, help='Frames published per fan-out run')
+    parser.add_argument('--sse-interval', type=float, default=0.02, help='Seconds between fan-out frames')
+    parser.add_argument('--sse-encoding', default='json', choices=battery_app.STREAM_ENCODINGS)
+    parser.add_argument('--drain-timeout', type=float, default=300, help='Max seconds to wait for the spool to drain')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/e2e-<timestamp>.json)')
+    parser.add_argument('--baseline', help='Earlier result file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Relative change reported by --baseline')
+    args = parser.parse_args()
+
+    if args.database == 'i2c_db':
+        parser.error("Refusing to benchmark against the production database 'i2c_db'.")
+    battery_app.db_config['database'] = args.database
+    battery_app.create_db_and_table()
+    if not battery_app.get_db_connection():
+        print(f"Cannot reach MariaDB at {battery_app.db_config['host']} as {battery_app.db_config['user']}.")
+        return 1
+
+    results = {}
+    try:
+        print(f"Acquisition ({adc.adc_backend.name} ADC, {battery_app.PYTHON_NUMBER_OF_CELLS} cells):")
+        results['acquisition'], frames = bench_acquisition(args.ingest_frames)
+        print(f"  {results['acquisition']['frames_per_second']} frames/s, {results['acquisition']['cells_per_second']} cells/s")
+
+        print("Ingest:")
+        results['ingest'] = bench_ingest(frames, SCRATCH_DIR, args.drain_timeout)
+        for key in ('submit_rows_per_second', 'spool_rows_per_second', 'drain_rows_per_second', 'insert_batch_rows_per_second'):
+            print(f"  {key}: {results['ingest'][key]}")
+
+        print("Endpoints:")
+        seeder = TableSeeder(origin=datetime.now() - timedelta(days=2))
+        results['endpoints'] = bench_endpoints(seeder, sorted(args.sizes), args.requests, frames[-1])
+
+        print(f"SSE fan-out ({args.sse_encoding}):")
+        results['sse_fanout'] = asyncio.run(bench_sse_fanout(args.subscribers, args.sse_frames, args.sse_encoding,
+                                                             frames[-1], args.sse_interval))
+    finally:
+        if not args.keep_database:
+            drop_database(args.database)
+
+    output = args.output or os.path.join(REPO_ROOT, 'benchmarks', 'results',
+                                         f"e2e-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {
+                'created_at': datetime.now().isoformat(),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'adc_backend': adc.adc_backend.name,
+                'cells': battery_app.PYTHON_NUMBER_OF_CELLS,
+                'arguments': vars(args),
+            },
+            'results': results,
+        }, f, indent=2, default=str)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        return 1 if compare_with_baseline(results, args.baseline, args.tolerance) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Check that readings survive a MariaDB outage through the local spool and are stored exactly once.
+
+Runs against a local MariaDB server, in a throwaway database that is created for the run and
+dropped afterwards, with the simulated ADC backend. From the repository root:
+
+    python benchmarks/spool_outage_check.py --frames 600 --outage-after 150 \\
+        --stop-cmd 'sudo systemctl stop mariadb' --start-cmd 'sudo systemctl start mariadb'
+
+Frames are pushed through the production path (VoltageWriter -> LocalSpool -> SpoolDrainer ->
+insert_voltage_batch) at --interval. After --outage-after frames, --stop-cmd is run (kill or stop
+the server), sampling continues for --outage-seconds, then --start-cmd brings the server back.
+Without the commands, the check prints when to stop and restart the server by hand.
+
+Once sampling ends, the spool must drain to zero within --drain-timeout and the database must
+hold every spooled row exactly once (no gaps from the outage, no duplicates from replays).
+Exits with status 1 otherwise.
+"""
+import argparse
+import atexit
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault('BATTERY_MONITOR_ADC_BACKEND', 'simulated')
+SCRATCH_DIR = tempfile.mkdtemp(prefix='battery-outage-')
+atexit.register(shutil.rmtree, SCRATCH_DIR, True)  # Registered first, so it runs after the app's shutdown hook
+os.environ['BATTERY_MONITOR_SPOOL_PATH'] = os.path.join(SCRATCH_DIR, 'voltage_spool.sqlite3')
+
+import app as battery_app  # noqa: E402
+
+
+def run_command(command, what):
+    if command:
+        print(f"  {what}: {command}")
+        subprocess.run(command, shell=True, check=True)
+    else:
+        print(f"  {what} the MariaDB server now.")
+
+
+def stored_row_counts(first_timestamp):
+    """(rows, distinct (seq, cell) keys) of the local pack written by this run."""
+    conn = battery_app.get_db_connection()
+    if not conn:
+        raise RuntimeError("Check database is not reachable.")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT seq, cell_number) FROM voltage_readings WHERE pack_id = %s AND timestamp >= %s",
+            (battery_app.LOCAL_PACK_ID, first_timestamp)
+        )
+        return cursor.fetchone()
+    finally:
+        battery_app.close_db_resources(cursor, conn, 'outage check row count')
+
+
+def drop_database(name):
+    conn = battery_app.mariadb.connect(
+        host=battery_app.db_config['host'],
+        user=battery_app.db_config['user'],
+        password=battery_app.db_config['password']
+    )
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP DATABASE IF EXISTS {name}")
+    finally:
+        battery_app.close_db_resources(cursor, conn, 'outage check drop database')
+
+
+def wait_for_database(timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        conn = battery_app.get_db_connection()
+        if conn:
+            battery_app.close_db_resources(None, conn, 'outage check wait')
+            return True
+        time.sleep(1)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='i2c_db_outage_check', help='Throwaway database name (default: i2c_db_outage_check)')
+    parser.add_argument('--keep-database', action='store_true', help='Do not drop the database afterwards')
+    parser.add_argument('--frames', type=int, default=600, help='Frames sampled in total')
+    parser.add_argument('--interval', type=float, default=0.1, help='Seconds between frames')
+    parser.add_argument('--outage-after', type=int, default=150, help='Frames sampled before the server is stopped')
+    parser.add_argument('--outage-seconds', type=float, default=20, help='Seconds the server stays down')
+    parser.add_argument('--stop-cmd', help='Shell command that kills or stops MariaDB')
+    parser.add_argument('--start-cmd', help='Shell command that starts MariaDB again')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='Max seconds to wait for the spool to drain')
+    args = parser.parse_args()
+
+    if args.database == 'i2c_db':
+        parser.error("Refusing to run against the production database 'i2c_db'.")
+    battery_app.db_config['database'] = args.database
+    battery_app.create_db_and_table()
+    if not wait_for_database(5):
+        print(f"Cannot reach MariaDB at {battery_app.db_config['host']} as {battery_app.db_config['user']}.")
+        return 1
+
+    spool = battery_app.LocalSpool(os.path.join(SCRATCH_DIR, 'outage_spool.sqlite3'))
+    writer = battery_app.VoltageWriter(sink=spool.append)
+    drainer = battery_app.SpoolDrainer(spool)
+    # Whole seconds before the first frame, so the count query sees every row of this run.
+    first_timestamp = datetime.now().replace(microsecond=0) - timedelta(seconds=1)
+    submitted = 0
+    failed = False
+    try:
+        writer.start()
+        drainer.start()
+        print(f"Sampling {args.frames} frames of {battery_app.PYTHON_NUMBER_OF_CELLS} cells every {args.interval}s:")
+        outage_ends = None
+        for frame in range(args.frames):
+            if frame == args.outage_after:
+                run_command(args.stop_cmd, 'Stop')
+                outage_ends = time.monotonic() + args.outage_seconds
+            if outage_ends is not None and time.monotonic() >= outage_ends:
+                run_command(args.start_cmd, 'Start')
+                outage_ends = None
+            timestamp = datetime.now()
+            for reading in battery_app.read_all_voltages():
+                if reading['voltage'] is not None:
+                    writer.submit(reading['cell'], reading['voltage'], timestamp)
+                    submitted += 1
+            time.sleep(args.interval)
+        if outage_ends is not None:
+            time.sleep(max(0.0, outage_ends - time.monotonic()))
+            run_command(args.start_cmd, 'Start')
+        writer.stop(timeout=args.drain_timeout)
+
+        deadline = time.monotonic() + args.drain_timeout
+        while spool.stats()['depth'] > 0 and time.monotonic() < deadline:
+            time.sleep(0.5)
+        depth = spool.stats()['depth']
+        drainer.stop()
+        rows, distinct = stored_row_counts(first_timestamp)
+        dead_lettered = spool.stats()['dead_lettered']
+
+        print(f"  submitted {submitted}, stored {rows} ({distinct} distinct), spool depth {depth}, dead-lettered {dead_lettered}")
+        print(f"  drainer: {drainer.stats()}")
+        if depth:
+            print("FAIL: the spool did not drain after the server came back.")
+            failed = True
+        if rows != distinct:
+            print(f"FAIL: {rows - distinct} duplicate rows after replay.")
+            failed = True
+        if distinct + dead_lettered != submitted:
+            print(f"FAIL: {submitted - distinct - dead_lettered} rows lost.")
+            failed = True
+        if not failed:
+            print("OK: every reading stored exactly once.")
+    finally:
+        spool.close()
+        if not args.keep_database:
+            drop_database(args.database)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
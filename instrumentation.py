@@ -0,0 +1,166 @@
+"""Prometheus-style metrics and rate-limited logging shared by app.py and adc.py.
+
+Importing this module has no side effects beyond creating the (empty) metrics registry.
+"""
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Instrumentation. Counters and histograms are exported in Prometheus text format at /api/metrics.
+METRICS_PREFIX = 'battery_monitor_'
+METRICS_I2C_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)  # Seconds
+METRICS_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # Seconds
+METRICS_ENCODE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)  # Seconds
+# Repeated hot-path log messages (same cell / board / event) are written at most once per this many seconds.
+LOG_RATE_LIMIT_SECONDS = 60
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values."""
+
+    metric_type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', labels, value) for labels, value in self._values.items()]
+
+
+class Histogram:
+    """Fixed-bucket histogram. observe() is one bisect and one locked increment."""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [per-bucket counts (last one is +Inf), sum]
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        samples = []
+        for labels, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', labels + ('+Inf' if bound == float('inf') else repr(bound),), cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class CallbackMetric:
+    """Value read at scrape time, e.g. a queue depth. callback returns a number or {labels: number}."""
+
+    def __init__(self, name, help_text, callback, labelnames=(), metric_type='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.labelnames = labelnames
+        self.metric_type = metric_type
+
+    def samples(self):
+        value = self.callback()
+        if isinstance(value, dict):
+            return [('', labels, v) for labels, v in value.items()]
+        return [('', (), value)]
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text exposition format."""
+
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _register(self, metric):
+        metric.name = self.prefix + metric.name
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, buckets, labelnames=()):
+        return self._register(Histogram(name, help_text, buckets, labelnames))
+
+    def gauge(self, name, help_text, callback, labelnames=(), metric_type='gauge'):
+        return self._register(CallbackMetric(name, help_text, callback, labelnames, metric_type))
+
+    @staticmethod
+    def _format_labels(names, values):
+        if not names:
+            return ''
+        pairs = []
+        for name, value in zip(names, values):
+            escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{name}="{escaped}"')
+        return '{' + ','.join(pairs) + '}'
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            for suffix, labels, value in samples:
+                names = metric.labelnames + ('le',) if suffix == '_bucket' else metric.labelnames
+                formatted = str(int(value)) if isinstance(value, int) else repr(float(value))
+                lines.append(f"{metric.name}{suffix}{self._format_labels(names, labels)} {formatted}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metric_log_suppressed = metrics.counter(
+    'log_messages_suppressed_total', 'Hot-path log messages dropped by the rate limiter.')
+
+_log_rate_limits = {}  # key -> [monotonic time last logged, messages suppressed since]
+_log_rate_lock = threading.Lock()
+
+def log_rate_limited(key, level, message, interval=LOG_RATE_LIMIT_SECONDS):
+    """Log message at most once per interval for the same key; repeats in between are only counted."""
+    now = time.monotonic()
+    with _log_rate_lock:
+        state = _log_rate_limits.get(key)
+        if state is not None and now - state[0] < interval:
+            state[1] += 1
+            suppressed = None
+        else:
+            suppressed = state[1] if state is not None else 0
+            _log_rate_limits[key] = [now, 0]
+    if suppressed is None:
+        metric_log_suppressed.inc()
+        return
+    if suppressed:
+        message = f"{message} ({suppressed} similar messages suppressed)"
+    logger.log(level, message)
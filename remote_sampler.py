@@ -0,0 +1,159 @@
+"""Remote sampler: reads this node's cells and pushes them to a central instance's /api/ingest.
+
+Run on each Raspberry Pi from the repository root:
+
+    python remote_sampler.py --url http://central-host:5000 --pack-id 3
+
+Frames are read with adc.py, the ADC code app.py uses (device_map.json, calibration, filtering),
+buffered in memory and sent as gzip-compressed batches. Every frame carries seq = its timestamp
+in microseconds, so the central instance drops frames it already stored when a batch is resent
+after a timeout. While the central instance is unreachable, frames accumulate (the oldest are
+dropped beyond --max-buffer-frames) and sending resumes with exponential backoff.
+
+To try it on one machine, run a local instance and a simulated sampler next to it:
+
+    python app.py
+    BATTERY_MONITOR_ADC_BACKEND=simulated python remote_sampler.py --url http://127.0.0.1:5000 --pack-id 1
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from datetime import datetime
+
+import adc
+
+logger = logging.getLogger('remote_sampler')
+
+RETRY_MIN_SECONDS = 1  # Backoff after a failed send, doubled up to...
+RETRY_MAX_SECONDS = 60  # ...this ceiling
+
+
+class IngestClient:
+    """Buffers frames and POSTs them in batches to /api/ingest."""
+
+    def __init__(self, url, pack_id, token=None, batch_frames=60, max_buffer_frames=86400, timeout=10):
+        self.url = url.rstrip('/') + '/api/ingest'
+        self.pack_id = pack_id
+        self.token = token
+        self.batch_frames = batch_frames
+        self.timeout = timeout
+        self.buffer = deque()
+        self.max_buffer_frames = max_buffer_frames
+        self.dropped = 0
+        self.sent = 0
+        self._retry_delay = RETRY_MIN_SECONDS
+        self._retry_at = 0.0
+
+    def add(self, timestamp, readings):
+        """Buffer one frame of readings (dicts with 'cell' and 'voltage', voltage None on a failed read)."""
+        if len(self.buffer) >= self.max_buffer_frames:
+            self.buffer.popleft()
+            self.dropped += 1
+        self.buffer.append({
+            'seq': adc.reading_seq(timestamp),
+            'timestamp': timestamp.isoformat(),
+            'cells': [reading['cell'] for reading in readings],
+            'voltages': [reading['voltage'] for reading in readings],
+        })
+
+    def flush(self, force=False):
+        """Send buffered frames batch by batch. Returns False if sending failed and is backing off."""
+        while self.buffer and (force or len(self.buffer) >= self.batch_frames):
+            if time.monotonic() < self._retry_at:
+                return False
+            batch = [self.buffer[i] for i in range(min(self.batch_frames, len(self.buffer)))]
+            if not self._send(batch):
+                self._retry_at = time.monotonic() + self._retry_delay
+                self._retry_delay = min(self._retry_delay * 2, RETRY_MAX_SECONDS)
+                return False
+            for _ in batch:
+                self.buffer.popleft()
+            self.sent += len(batch)
+            self._retry_delay = RETRY_MIN_SECONDS
+        return True
+
+    def _send(self, batch):
+        body = gzip.compress(json.dumps({'pack_id': self.pack_id, 'frames': batch}).encode('utf-8'))
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+            return True
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500 and e.code not in (408, 429):
+                # The server will never accept this batch; keep the rest flowing.
+                logger.error(f"Ingest rejected {len(batch)} frames ({e.code}): {e.read().decode('utf-8', 'replace')}")
+                return True
+            logger.warning(f"Ingest failed ({e.code}). {len(self.buffer)} frames buffered; retrying in {self._retry_delay}s.")
+        except (urllib.error.URLError, OSError) as e:
+            logger.warning(f"Ingest failed ({e}). {len(self.buffer)} frames buffered; retrying in {self._retry_delay}s.")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default=os.environ.get('BATTERY_MONITOR_INGEST_URL'),
+                        help='Base URL of the central instance (default: $BATTERY_MONITOR_INGEST_URL)')
+    parser.add_argument('--pack-id', type=int, required=True, help=f'Pack id of this node (1-{adc.MAX_PACK_ID})')
+    parser.add_argument('--token', default=os.environ.get('BATTERY_MONITOR_INGEST_TOKEN'),
+                        help='Ingest token, if the central instance requires one (default: $BATTERY_MONITOR_INGEST_TOKEN)')
+    parser.add_argument('--interval', type=float, default=adc.SAMPLE_INTERVAL_SECONDS, help='Seconds between frames')
+    parser.add_argument('--batch-frames', type=int, default=60, help='Frames per request (default: 60)')
+    parser.add_argument('--flush-seconds', type=float, default=5.0, help='Send a partial batch after this long (default: 5)')
+    parser.add_argument('--max-buffer-frames', type=int, default=86400, help='Frames kept while the server is unreachable')
+    parser.add_argument('--frames', type=int, default=None, help='Stop after this many frames (default: run forever)')
+    args = parser.parse_args()
+    if not args.url:
+        parser.error('--url is required')
+    if not 1 <= args.pack_id <= adc.MAX_PACK_ID:
+        parser.error(f"--pack-id must be between 1 and {adc.MAX_PACK_ID} ({adc.LOCAL_PACK_ID} is the central node's own pack)")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(name)s: %(message)s')
+    client = IngestClient(args.url, args.pack_id, args.token, args.batch_frames, args.max_buffer_frames)
+    logger.info(f"Sampling {adc.PYTHON_NUMBER_OF_CELLS} cells every {args.interval}s as pack {args.pack_id} -> {client.url}")
+
+    frames = 0
+    last_flush = time.monotonic()
+    next_frame = time.monotonic()
+    try:
+        while args.frames is None or frames < args.frames:
+            try:
+                readings = adc.read_all_voltages()
+            except IOError as e:
+                logger.error(f"ADC unavailable ({e}). Retrying in {adc.HARDWARE_ERROR_RETRY_SECONDS}s.")
+                time.sleep(adc.HARDWARE_ERROR_RETRY_SECONDS)
+                next_frame = time.monotonic()
+                continue
+            client.add(datetime.now(), readings)
+            frames += 1
+
+            if time.monotonic() - last_flush >= args.flush_seconds:
+                client.flush(force=True)
+                last_flush = time.monotonic()
+            else:
+                client.flush()
+
+            # Fixed schedule; if a slow send overran one or more ticks, skip them instead of bursting.
+            next_frame += args.interval
+            now = time.monotonic()
+            if next_frame < now:
+                next_frame = now
+            time.sleep(next_frame - now)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.flush(force=True)
+        logger.info(f"Stopped after {frames} frames: {client.sent} sent, {len(client.buffer)} unsent, {client.dropped} dropped.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+"""Shared setup for the unit tests: the simulated ADC backend and scratch paths, so importing
+app.py or adc.py needs neither I2C hardware nor a running MariaDB server."""
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix='battery-tests-')
+os.environ['BATTERY_MONITOR_ADC_BACKEND'] = 'simulated'
+os.environ.setdefault('BATTERY_MONITOR_SPOOL_PATH', os.path.join(SCRATCH_DIR, 'voltage_spool.sqlite3'))
+os.environ.setdefault('BATTERY_MONITOR_ARCHIVE_DIR', os.path.join(SCRATCH_DIR, 'archive'))
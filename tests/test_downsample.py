@@ -0,0 +1,56 @@
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as battery_app
+
+START = datetime(2024, 5, 1, 12, 0, 7)
+
+
+def buckets_touched(start, end, bucket_seconds, origin):
+    return math.ceil((end.timestamp() - origin) / bucket_seconds) - math.floor((start.timestamp() - origin) / bucket_seconds)
+
+
+@pytest.mark.parametrize('span', [
+    timedelta(seconds=10), timedelta(minutes=17), timedelta(hours=5, seconds=3), timedelta(days=3), timedelta(days=400),
+])
+@pytest.mark.parametrize('points', [1, 2, 7, 500, 5000])
+def test_grid_never_exceeds_the_requested_points(span, points):
+    bucket_seconds, origin = battery_app.downsample_grid(START, START + span, points)
+    assert buckets_touched(START, START + span, bucket_seconds, origin) <= points
+    if points > 1:
+        assert origin == 0
+        for level_seconds in (86400, 3600, 60):
+            if bucket_seconds > level_seconds:
+                assert bucket_seconds % level_seconds == 0
+                break
+
+
+def test_single_point_is_one_bucket_from_start():
+    assert battery_app.downsample_grid(START, START + timedelta(minutes=90), 1) == (5400, START.timestamp())
+
+
+def test_short_ranges_get_second_buckets():
+    assert battery_app.downsample_grid(START, START + timedelta(seconds=100), 500) == (1, 0)
+
+
+def test_minute_rollup_answers_whole_minutes_only():
+    end = START + timedelta(hours=1)
+    assert battery_app.rollup_level_fits(60, 120, 0, START.replace(second=0), end.replace(second=0))
+    assert not battery_app.rollup_level_fits(60, 90, 0, START.replace(second=0), end.replace(second=0))
+
+
+def test_rollups_are_skipped_for_packs_with_late_rows(monkeypatch):
+    worker = battery_app.RollupWorker()
+    monkeypatch.setattr(battery_app, 'rollup_worker', worker)
+    start = datetime.now().replace(second=0, microsecond=0) - timedelta(hours=2)
+    end = start + timedelta(hours=1)
+    worker._watermarks['voltage_rollup_1m'] = end
+    assert battery_app.choose_bucket_source(60, start, end, pack_id=3) == ('voltage_rollup_1m', start, end)
+
+    worker.note_rows_written(3, start + timedelta(minutes=30))
+    table, rollup_start, rollup_end = battery_app.choose_bucket_source(60, start, end, pack_id=3)
+    assert table == 'voltage_rollup_1m' and rollup_end < start + timedelta(minutes=30)
+    assert battery_app.choose_bucket_source(60, start, end, pack_id=4) == ('voltage_rollup_1m', start, end)
+    assert worker.final_until('voltage_rollup_1m') == rollup_end
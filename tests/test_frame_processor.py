@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+import adc  # noqa: E402
+
+
+DIVIDER = 2.0
+
+
+def device_map(cells=2):
+    return [{'cell': cell, 'bus': 1, 'address': 0x48, 'channel': cell - 1, 'divider': DIVIDER} for cell in range(1, cells + 1)]
+
+
+def code_for(volts):
+    """Raw ADC code (unrounded) that converts back to volts with DIVIDER."""
+    return volts / DIVIDER / 5.0 * 255.0
+
+
+def test_converts_codes_with_divider():
+    processor = adc.FrameProcessor(device_map())
+    assert processor.process([[94], [100]]) == [round(94 / 255.0 * 5.0 * DIVIDER, 3), round(100 / 255.0 * 5.0 * DIVIDER, 3)]
+
+
+def test_failed_read_is_none_and_low_reading_is_zero():
+    processor = adc.FrameProcessor(device_map())
+    assert processor.process([None, [code_for(1.0)]]) == [None, 0.0]
+
+
+def test_median_reducer_ignores_a_spike():
+    processor = adc.FrameProcessor(device_map(1), reducer='median')
+    assert processor.process([[94, 94, 255]]) == [round(94 / 255.0 * 5.0 * DIVIDER, 3)]
+
+
+def test_calibration_interpolates_and_extrapolates():
+    processor = adc.FrameProcessor(device_map(), calibration={1: [(3.0, 3.1), (4.0, 4.3)]})
+    voltages = processor.process([[code_for(3.5)], [code_for(3.5)]])
+    assert voltages == [pytest.approx(3.7, abs=0.001), pytest.approx(3.5, abs=0.001)]
+    assert processor.process([[code_for(4.5)], [code_for(4.5)]])[0] == pytest.approx(4.9, abs=0.001)
+
+
+def test_ema_filter_moves_towards_new_readings():
+    processor = adc.FrameProcessor(device_map(1), filter_mode='ema')
+    assert processor.process([[code_for(3.7)]]) == [pytest.approx(3.7, abs=0.001)]
+    expected = 3.7 + adc.FILTER_EMA_ALPHA * 0.1
+    assert processor.process([[code_for(3.8)]]) == [pytest.approx(expected, abs=0.001)]
+
+
+def test_kalman_converges_from_a_wrong_first_reading():
+    processor = adc.FrameProcessor(device_map(1), filter_mode='kalman')
+    processor.process([[code_for(3.8)]])
+    for _ in range(30):
+        voltage = processor.process([[code_for(3.7)]])[0]
+    assert voltage == pytest.approx(3.7, abs=0.005)
+
+
+def test_failed_read_restarts_the_filter():
+    processor = adc.FrameProcessor(device_map(1), filter_mode='ema')
+    processor.process([[code_for(3.7)]])
+    assert processor.process([None]) == [None]
+    assert processor.process([[code_for(3.9)]]) == [pytest.approx(3.9, abs=0.001)]
+
+
+def test_partial_frame_leaves_the_filter_state_alone():
+    processor = adc.FrameProcessor(device_map(), filter_mode='ema')
+    processor.process([[code_for(3.7)], [code_for(3.7)]])
+    assert processor.process([[code_for(3.9)]], rows=[1]) == [pytest.approx(3.9, abs=0.001)]
+    second = processor.process([[code_for(3.7)], [code_for(3.7)]])
+    assert second == [pytest.approx(3.7, abs=0.001), pytest.approx(3.7, abs=0.001)]
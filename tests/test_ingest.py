@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytest
+
+import app as battery_app
+
+
+def frame(**overrides):
+    values = {'seq': 1, 'timestamp': '2024-05-01T12:00:00', 'cells': [1, 2], 'voltages': [3.7, 3.65]}
+    values.update(overrides)
+    return values
+
+
+def test_rows_are_grouped_by_pack():
+    rows = battery_app.parse_ingest_frames({'pack_id': 3, 'frames': [frame(), frame(pack_id=4, seq=2)]})
+    timestamp = datetime(2024, 5, 1, 12)
+    assert rows == {3: [(1, 1, 3.7, timestamp), (1, 2, 3.65, timestamp)],
+                    4: [(2, 1, 3.7, timestamp), (2, 2, 3.65, timestamp)]}
+
+
+def test_repeated_rows_collapse_and_failed_reads_are_skipped():
+    rows = battery_app.parse_ingest_frames({'pack_id': 3, 'frames': [frame(voltages=[None, 3.6]), frame(voltages=[None, 3.6])]})
+    assert [row[:3] for row in rows[3]] == [(1, 2, 3.6)]
+
+
+def test_seq_defaults_to_the_timestamp_and_cells_to_one_based():
+    rows = battery_app.parse_ingest_frames({'pack_id': 3, 'frames': [{'timestamp': 1714564800.5, 'voltages': [3.7]}]})
+    seq, cell, _, timestamp = rows[3][0]
+    assert (seq, cell) == (battery_app.reading_seq(timestamp), 1)
+
+
+def test_offset_timestamps_become_local_time():
+    rows = battery_app.parse_ingest_frames({'pack_id': 3, 'frames': [frame(timestamp='2024-05-01T12:00:00+00:00')]})
+    expected = datetime.fromisoformat('2024-05-01T12:00:00+00:00').astimezone().replace(tzinfo=None)
+    assert rows[3][0][3] == expected
+
+
+@pytest.mark.parametrize('payload', [
+    [],
+    {'frames': [frame()]},  # No pack_id
+    {'pack_id': battery_app.LOCAL_PACK_ID, 'frames': [frame()]},
+    {'pack_id': 3, 'frames': [frame(timestamp='yesterday')]},
+    {'pack_id': 3, 'frames': [frame(seq=-1)]},
+    {'pack_id': 3, 'frames': [frame(cells=[1])]},
+    {'pack_id': 3, 'frames': [frame(cells=[0, 1])]},
+    {'pack_id': 3, 'frames': [frame(voltages=[3.7, True])]},
+    {'pack_id': 3, 'frames': [frame(voltages=[3.7, 150])]},
+])
+def test_invalid_payloads_are_rejected(payload):
+    with pytest.raises(ValueError):
+        battery_app.parse_ingest_frames(payload)
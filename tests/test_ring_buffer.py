@@ -0,0 +1,72 @@
+import math
+import time
+from datetime import datetime, timedelta
+
+import app as battery_app
+
+# Frames must be newer than the buffer's creation to count as complete.
+BASE = datetime.fromtimestamp(math.ceil(time.time()) + 60)
+
+
+def fill(ring, seconds, cells=(1, 2), frames_per_second=1):
+    for second in range(seconds):
+        for frame in range(frames_per_second):
+            timestamp = BASE + timedelta(seconds=second, milliseconds=frame * 1000 // frames_per_second)
+            ring.append_frame(timestamp, [{'cell': cell, 'voltage': 3.0 + second / 100} for cell in cells])
+
+
+def stamps(rows):
+    return [(row['timestamp'], row['cell_number']) for row in rows]
+
+
+def test_newest_rows_first_in_whole_seconds():
+    ring = battery_app.VoltageRingBuffer([1, 2], capacity=10)
+    ring.append_frame(BASE + timedelta(milliseconds=400), [{'cell': 1, 'voltage': 3.7}, {'cell': 2, 'voltage': 3.6}])
+    ring.append_frame(BASE + timedelta(seconds=1, milliseconds=400), [{'cell': 1, 'voltage': 3.71}, {'cell': 2, 'voltage': 3.61}])
+    rows = ring.query(4, start=BASE)
+    assert [row['timestamp'] for row in rows] == [BASE + timedelta(seconds=1)] * 2 + [BASE] * 2
+    assert sorted(row['voltage'] for row in rows[:2]) == [3.61, 3.71]
+
+
+def test_failed_reads_and_unknown_cells_are_skipped():
+    ring = battery_app.VoltageRingBuffer([1, 2], capacity=10)
+    ring.append_frame(BASE, [{'cell': 1, 'voltage': None}, {'cell': 2, 'voltage': 3.6}, {'cell': 9, 'voltage': 3.5}])
+    assert stamps(ring.query(10, start=BASE)) == [(BASE, 2)]
+
+
+def test_page_cut_inside_a_second_leaves_that_second_for_the_next_page():
+    ring = battery_app.VoltageRingBuffer([1, 2], capacity=10)
+    fill(ring, 3)
+    rows = ring.query(3, start=BASE)
+    # Three rows would split second 1 (two rows per second); only second 2 fits whole.
+    assert sorted(stamps(rows)) == [(BASE + timedelta(seconds=2), 1), (BASE + timedelta(seconds=2), 2)]
+
+
+def test_second_with_more_rows_than_the_limit_needs_the_db():
+    ring = battery_app.VoltageRingBuffer([1, 2], capacity=10)
+    fill(ring, 2, frames_per_second=2)
+    assert ring.query(3, start=BASE) is None
+
+
+def test_end_bounds_the_page():
+    ring = battery_app.VoltageRingBuffer([1], capacity=10)
+    fill(ring, 5, cells=(1,))
+    rows = ring.query(2, start=BASE, end=BASE + timedelta(seconds=2))
+    assert [row['timestamp'] for row in rows] == [BASE + timedelta(seconds=2), BASE + timedelta(seconds=1)]
+
+
+def test_rows_older_than_the_buffer_need_the_db():
+    ring = battery_app.VoltageRingBuffer([1], capacity=10)
+    fill(ring, 3, cells=(1,))
+    assert ring.query(2, start=BASE - timedelta(days=1)) is None
+    # Without a start, a short page may be missing older rows that are only in the DB.
+    assert ring.query(5) is None
+    assert len(ring.query(2)) == 2
+
+
+def test_overwritten_samples_move_the_complete_window():
+    ring = battery_app.VoltageRingBuffer([1], capacity=3)
+    fill(ring, 5, cells=(1,))
+    assert ring.query(10, start=BASE) is None
+    rows = ring.query(10, start=BASE + timedelta(seconds=2))
+    assert [row['timestamp'] for row in rows] == [BASE + timedelta(seconds=second) for second in (4, 3, 2)]
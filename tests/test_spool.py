@@ -0,0 +1,109 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as battery_app
+
+START = datetime(2024, 5, 1, 12)
+
+
+def make_rows(count, cell=1):
+    return [(cell, 3.7, START + timedelta(seconds=second)) for second in range(count)]
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = battery_app.LocalSpool(str(tmp_path / 'spool.sqlite3'), max_rows=10)
+    yield spool
+    spool.close()
+
+
+def dead_letter_rows(spool):
+    with sqlite3.connect(spool.path) as conn:
+        return conn.execute("SELECT cell_number, error FROM dead_letter ORDER BY id").fetchall()
+
+
+def test_file_is_created_on_first_use(tmp_path):
+    spool = battery_app.LocalSpool(str(tmp_path / 'spool.sqlite3'))
+    assert not (tmp_path / 'spool.sqlite3').exists()
+    assert spool.append(make_rows(1))
+    assert (tmp_path / 'spool.sqlite3').exists()
+    spool.close()
+
+
+def test_rows_come_back_oldest_first_and_are_removed(spool):
+    spool.append(make_rows(3))
+    last_id, rows = spool.peek(2)
+    assert rows == make_rows(2)
+    spool.remove_through(last_id)
+    assert spool.peek(10)[1] == make_rows(3)[2:]
+    assert spool.stats()['depth'] == 1
+
+
+def test_oldest_rows_are_dropped_beyond_max_rows(spool):
+    spool.append(make_rows(12))
+    assert spool.peek(20)[1] == make_rows(12)[2:]
+    assert spool.stats()['dropped_full'] == 2
+
+
+def test_rows_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'spool.sqlite3')
+    first = battery_app.LocalSpool(path)
+    first.append(make_rows(2))
+    first.close()
+    second = battery_app.LocalSpool(path)
+    assert second.peek(10)[1] == make_rows(2)
+    assert second.stats()['depth'] == 2
+    second.close()
+
+
+def test_failed_sink_keeps_the_rows(spool):
+    spool.append(make_rows(3))
+    drainer = battery_app.SpoolDrainer(spool, sink=lambda rows: False)
+    assert drainer.drain_once() is None
+    assert spool.stats()['depth'] == 3
+    assert drainer.stats()['failed_batches'] == 1
+
+
+def test_drainer_replays_in_batches(spool):
+    spool.append(make_rows(5))
+    written = []
+    drainer = battery_app.SpoolDrainer(spool, sink=lambda rows: written.append(rows) or True, batch_rows=2)
+    assert [drainer.drain_once() for _ in range(4)] == [2, 2, 1, 0]
+    assert [row for batch in written for row in batch] == make_rows(5)
+    assert spool.stats()['depth'] == 0
+
+
+def test_poison_row_is_dead_lettered_and_the_rest_gets_through(spool):
+    rows = make_rows(3, cell=1)
+    poison = (99, 3.7, START)
+    spool.append([rows[0], poison, *rows[1:]])
+    written = []
+
+    def sink(batch):
+        if poison in batch:
+            raise battery_app.PermanentBatchError('Out of range value for column cell_number')
+        written.extend(batch)
+        return True
+
+    drainer = battery_app.SpoolDrainer(spool, sink=sink)
+    assert drainer.drain_once() == 4
+    assert written == rows
+    assert dead_letter_rows(spool) == [(99, 'Out of range value for column cell_number')]
+    assert spool.stats()['depth'] == 0
+    assert drainer.stats()['dead_lettered'] == 1
+
+
+def test_outage_while_isolating_rows_keeps_the_batch(spool):
+    spool.append(make_rows(2))
+
+    def sink(batch):
+        if len(batch) > 1:
+            raise battery_app.PermanentBatchError('Data too long')
+        return False  # MariaDB went away
+
+    drainer = battery_app.SpoolDrainer(spool, sink=sink)
+    assert drainer.drain_once() is None
+    assert spool.stats()['depth'] == 2
+    assert dead_letter_rows(spool) == []
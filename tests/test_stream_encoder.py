@@ -0,0 +1,100 @@
+import base64
+import json
+import math
+import struct
+import threading
+from datetime import datetime
+
+import app as battery_app
+
+
+def snapshot(voltages, status='success'):
+    if status != 'success':
+        return {'status': status, 'message': 'I2C bus unavailable', 'error_kind': 'hardware'}
+    return {
+        'status': 'success',
+        'readings': [{'cell': cell, 'ain_channel': f"AIN{cell - 1}", 'voltage': voltage} for cell, voltage in enumerate(voltages, 1)],
+        'timestamp': datetime(2024, 5, 1, 12).isoformat(),
+        'epoch_ms': 1714564800000,
+    }
+
+
+def payload(frame):
+    assert frame.startswith(b'data: ') and frame.endswith(b'\n\n')
+    return json.loads(frame[len(b'data: '):])
+
+
+def publish(broadcaster, voltages, status='success'):
+    snap = snapshot(voltages, status)
+    broadcaster.publish(snap)
+    return snap
+
+
+def make_stream(keyframe_interval=30):
+    encoder = battery_app.StreamFrameEncoder(epsilon=0.005, keyframe_interval=keyframe_interval)
+    return encoder, battery_app.SampleBroadcaster(prepare=encoder.prepare)
+
+
+def test_json_frame_matches_the_dashboard_format():
+    encoder, broadcaster = make_stream()
+    snap = publish(broadcaster, [3.7, None])
+    assert encoder.frame(snap) == battery_app.format_sse_frame(snap)
+    assert payload(encoder.frame(snap))['readings'][1]['voltage'] is None
+
+
+def test_columnar_frame_packs_float16_with_nan_for_failed_reads():
+    encoder, broadcaster = make_stream()
+    snap = publish(broadcaster, [3.7, None, 4.2])
+    data = payload(encoder.frame(snap, 'columnar'))
+    values = struct.unpack('<3e', base64.b64decode(data['v']))
+    assert (data['n'], data['dtype'], data['seq']) == (3, 'float16', snap['seq'])
+    assert abs(values[0] - 3.7) < 0.002 and math.isnan(values[1]) and abs(values[2] - 4.2) < 0.002
+
+
+def test_delta_frames_carry_only_moved_cells():
+    encoder, broadcaster = make_stream()
+    first = publish(broadcaster, [3.7, 3.6, 3.5])
+    key = payload(encoder.frame(first, 'delta'))
+    assert (key['type'], key['cells'], key['v']) == ('key', [1, 2, 3], [3.7, 3.6, 3.5])
+    second = publish(broadcaster, [3.703, 3.62, None])
+    delta = payload(encoder.frame(second, 'delta', last_sent_seq=first['seq']))
+    assert (delta['type'], delta['c']) == ('delta', [[2, 3.62], [3, None]])
+
+
+def test_subscriber_that_missed_a_frame_gets_a_keyframe_of_the_reference():
+    encoder, broadcaster = make_stream()
+    first = publish(broadcaster, [3.7, 3.6])
+    publish(broadcaster, [3.8, 3.6])
+    third = publish(broadcaster, [3.8, 3.5])
+    resync = payload(encoder.frame(third, 'delta', last_sent_seq=first['seq']))
+    assert (resync['type'], resync['v']) == ('key', [3.8, 3.5])
+    in_sync = payload(encoder.frame(third, 'delta', last_sent_seq=third['seq'] - 1))
+    assert in_sync['c'] == [[2, 3.5]]
+
+
+def test_keyframe_interval_and_error_frames_reset_the_reference():
+    encoder, broadcaster = make_stream(keyframe_interval=2)
+    snaps = [publish(broadcaster, [3.7]) for _ in range(4)]
+    assert [snap['delta_changes'] is None for snap in snaps] == [True, False, False, True]
+    error = publish(broadcaster, None, status='error')
+    assert payload(encoder.frame(error, 'delta'))['error_code'] == 'BSE_STREAM_NO_HW_INTERFACE'
+    after_error = publish(broadcaster, [3.7])
+    assert payload(encoder.frame(after_error, 'delta', last_sent_seq=error['seq']))['type'] == 'key'
+
+
+def test_each_frame_is_encoded_once_for_all_subscribers():
+    encoder, broadcaster = make_stream()
+    snap = publish(broadcaster, [3.7] * 64)
+    frames = []
+    barrier = threading.Barrier(8)
+
+    def subscriber():
+        barrier.wait()
+        frames.append(encoder.frame(snap, 'columnar'))
+
+    threads = [threading.Thread(target=subscriber) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(frames) == 8 and all(frame is frames[0] for frame in frames)